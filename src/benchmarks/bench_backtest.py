@@ -0,0 +1,89 @@
+"""Benchmark of the trigger backtest: one trigger at a time in Python vs evaluate_triggers broadcasting the threshold grid
+
+Run from the src folder, on synthetic indicators and yields (e.g. 96 departments, 4 crops, 30 seasons):
+    python -m benchmarks.bench_backtest --departments 96 --crops 4 --seasons 30 --workers 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.backtest import DIRECTIONS, LOSS_THRESHOLD, N_THRESHOLDS, PAYOUT_SPREAD, _backtest_task, threshold_grid, yield_losses
+from utils.indicators import indicator_columns
+
+
+def synthetic_zones(n_departments, n_crops, n_seasons, seed=0):
+    """Backtest tasks (see backtest._backtest_task) of yields partly driven by the first indicator"""
+    rng = np.random.default_rng(seed)
+    indicators = indicator_columns()[1:]
+    years = np.arange(2021 - n_seasons, 2021)
+    tasks = []
+    for dpt in range(n_departments):
+        index_values = rng.gamma(4., 50., (len(indicators), n_seasons))
+        for crop in range(n_crops):
+            yields = 70 + 0.5 * (years - years[0]) - 0.05 * (index_values[0] - index_values[0].mean()) + rng.normal(0, 5, n_seasons)
+            tasks.append((f"crop_{crop}", f"{dpt:02d}", (years, yields, years, index_values, indicators, LOSS_THRESHOLD, N_THRESHOLDS)))
+    return tasks
+
+
+def loop_zone(years, yields, seasons, index_values, indicators, loss_threshold, n_thresholds):
+    # Reference implementation: one (indicator, direction, threshold) trigger and one season at a time
+    losses = yield_losses(years, yields)
+    _, thresholds = threshold_grid(index_values, n_thresholds)
+    rows = []
+    for direction in DIRECTIONS:
+        for i in range(len(indicators)):
+            spread = PAYOUT_SPREAD * index_values[i].std()
+            for threshold in thresholds[i]:
+                n_triggers = n_hits = disagreements = 0
+                payout_errors = 0.
+                for value, loss in zip(index_values[i], losses):
+                    beyond = value - threshold if direction == "above" else threshold - value
+                    triggered = beyond >= 0
+                    payout = min(beyond / spread, 1.) if triggered and spread > 0 else float(triggered)
+                    n_triggers += triggered
+                    n_hits += triggered and loss > loss_threshold
+                    disagreements += triggered != (loss > loss_threshold)
+                    payout_errors += abs(payout - loss)
+                rows.append((n_triggers, n_hits, disagreements / len(losses), payout_errors / len(losses)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--departments", type=int, default=96)
+    parser.add_argument("--crops", type=int, default=4)
+    parser.add_argument("--seasons", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=1, help="processes of the vectorized run")
+    parser.add_argument("--sample", type=int, default=10,
+                        help="number of (crop, department) run through the loop (its time is extrapolated to all)")
+    args = parser.parse_args()
+
+    tasks = synthetic_zones(args.departments, args.crops, args.seasons)
+    n_triggers = len(tasks[0][2][4]) * len(DIRECTIONS) * N_THRESHOLDS
+    print(f"{len(tasks)} (crop, department) x {n_triggers} triggers x {args.seasons} seasons")
+
+    start = time.perf_counter()
+    if args.workers == 1:
+        results = [_backtest_task(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(_backtest_task, tasks))
+    vectorized_time = time.perf_counter() - start
+    print(f"Vectorized ({args.workers} process(es)): {vectorized_time:.2f}s")
+
+    max_difference = 0.
+    start = time.perf_counter()
+    for task, (_, _, columns) in zip(tasks[:args.sample], results):
+        rows = np.array(loop_zone(*task[2]))
+        vectorized = np.column_stack([columns["n_triggers"], columns["basis_risk"], columns["payout_basis_risk"]])
+        max_difference = max(max_difference, float(np.abs(vectorized - rows[:, [0, 2, 3]]).max()))
+    loop_time = time.perf_counter() - start
+    loop_total = loop_time * len(tasks) / min(args.sample, len(tasks))
+    print(f"Loop: {loop_time:.2f}s for {min(args.sample, len(tasks))} zones, ~{loop_total:.0f}s extrapolated to all")
+    print(f"Speedup: ~{loop_total / vectorized_time:.0f}x, max difference on the sample: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
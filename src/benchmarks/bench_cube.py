@@ -0,0 +1,46 @@
+"""Benchmark of the common ERA5 reductions: long-format MultiIndex frame vs dense MeteoCube
+
+Run from the src folder:
+    python -m benchmarks.bench_cube --meteo ../data/ERA5_data.parquet
+"""
+import argparse
+
+from benchmarks.timing import timed
+from utils.cube import cube_from_frame
+from utils.era5 import read_meteo_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meteo", default="../data/ERA5_data.parquet")
+    args = parser.parse_args()
+
+    df_meteo = read_meteo_data(args.meteo)
+    cube, build_time = timed(lambda: cube_from_frame(df_meteo))
+    frame_bytes = df_meteo.memory_usage(deep=True, index=True).sum()
+    print(f"Memory: frame {frame_bytes / 1e6:.0f} MB, cube {cube.nbytes / 1e6:.0f} MB (built in {build_time:.2f}s)")
+
+    df_reset = df_meteo.reset_index()
+    dates = df_reset["date"]
+    reductions = {
+        "daily spatial mean": (
+            lambda: df_reset.groupby("date")[cube.variables].mean(),
+            lambda: cube.spatial_mean(),
+        ),
+        "monthly mean per grid point": (
+            lambda: df_reset.groupby(["latitude", "longitude", dates.dt.to_period("M")])[cube.variables].mean(),
+            lambda: cube.monthly_mean(),
+        ),
+        "day-of-year climatology per grid point": (
+            lambda: df_reset.groupby(["latitude", "longitude", dates.dt.dayofyear])[cube.variables].mean(),
+            lambda: cube.climatology("day_of_year"),
+        ),
+    }
+    for name, (frame_reduction, cube_reduction) in reductions.items():
+        _, frame_time = timed(frame_reduction)
+        _, cube_time = timed(cube_reduction)
+        print(f"{name}: frame {frame_time:.3f}s, cube {cube_time:.3f}s ({frame_time / cube_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark of the department averages: legacy groupby.apply vs vectorized weighted_average
+
+Run from the src folder:
+    python -m benchmarks.bench_dpt_average --departments 10 --days 365
+"""
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+from utils.meteo import METEOROLOGICAL_COLUMNS, surface_dpt_average
+
+
+def legacy_surface_dpt_average(gdf_meteo):
+    # Former implementation of surface_dpt_average, kept here as the reference
+    gdf_meteo['area'] = gdf_meteo.geometry.area
+
+    def weighted_avg(group, cols, weight_col):
+        weighted_avgs = {}
+        total_weight = group[weight_col].sum()
+        for col in cols:
+            weighted_avgs[col] = (group[col] * group[weight_col]).sum() / total_weight
+        return pd.Series(weighted_avgs)
+
+    result = gdf_meteo.groupby(['DEP', 'date']).apply(weighted_avg, METEOROLOGICAL_COLUMNS, 'area')
+    result.reset_index(level='date', inplace=True)
+    return result
+
+
+def synthetic_communes_meteo(n_departments, cells_per_department, n_days, seed=0):
+    """Communes-per-grid-cell polygons with daily values, shaped like convert_lat_long_to_communes output"""
+    rng = np.random.default_rng(seed)
+    n_cells = n_departments * cells_per_department
+    x = np.tile(np.arange(cells_per_department) * 0.25, n_departments)
+    y = np.repeat(np.arange(n_departments) * 0.25, cells_per_department) + 45.
+    widths = rng.uniform(0.1, 0.25, n_cells)
+    gdf_geom = gpd.GeoDataFrame({
+        'nearest_id': np.arange(n_cells),
+        'DEP': np.repeat([f"{d:02d}" for d in range(1, n_departments + 1)], cells_per_department),
+    }, geometry=[box(a, b, a + w, b + w) for a, b, w in zip(x, y, widths)], crs="EPSG:4326")
+
+    dates = pd.date_range('2020-01-01', periods=n_days, freq='D')
+    df_values = pd.DataFrame(
+        rng.normal(size=(n_cells * n_days, len(METEOROLOGICAL_COLUMNS))).astype('float32'),
+        columns=METEOROLOGICAL_COLUMNS,
+    )
+    df_values['id'] = np.repeat(np.arange(n_cells), n_days)
+    df_values['date'] = np.tile(dates, n_cells)
+    return gdf_geom.merge(df_values, left_on='nearest_id', right_on='id', how='left')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--departments", type=int, default=10)
+    parser.add_argument("--cells-per-department", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    gdf_meteo = synthetic_communes_meteo(args.departments, args.cells_per_department, args.days)
+    print(f"{len(gdf_meteo)} rows, {args.departments} departments x {args.days} days")
+
+    start = time.perf_counter()
+    legacy = legacy_surface_dpt_average(gdf_meteo.copy())
+    legacy_time = time.perf_counter() - start
+
+    # Same (planar) weights as the legacy implementation to compare the values
+    gdf_planar = gdf_meteo.assign(area=gdf_meteo.geometry.area)
+    start = time.perf_counter()
+    vectorized = surface_dpt_average(gdf_planar)
+    vectorized_time = time.perf_counter() - start
+
+    print(f"Legacy groupby.apply: {legacy_time:.3f}s")
+    print(f"Vectorized weighted_average: {vectorized_time:.3f}s ({legacy_time / vectorized_time:.0f}x)")
+    max_difference = np.abs(legacy[METEOROLOGICAL_COLUMNS].to_numpy() - vectorized[METEOROLOGICAL_COLUMNS].to_numpy()).max()
+    print(f"Max absolute difference: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
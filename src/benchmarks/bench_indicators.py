@@ -0,0 +1,83 @@
+"""Benchmark of the agro-climatic indicators: per grid point Python loop vs vectorized compute_indicators
+
+Run from the src folder, on a synthetic cube the size of the ERA5 grid of France over 20 years:
+    python -m benchmarks.bench_indicators --latitudes 43 --longitudes 63 --years 20
+or on the ERA5 data:
+    python -m benchmarks.bench_indicators --meteo ../data/ERA5_data.parquet
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import synthetic_cube
+from utils.cube import read_cube
+from utils.indicators import (DRY_DAY_THRESHOLD, FROST_THRESHOLD, GDD_BASE, HEAT_THRESHOLDS, INDICATOR_VARIABLES,
+                              PHENOLOGICAL_WINDOWS, compute_indicators, season_codes)
+
+
+def loop_indicators(dates, tmin, tavg, tmax, precipitation):
+    # Reference implementation: one grid point, one season at a time, dry spells counted day by day
+    df = pd.DataFrame({"Tmin": tmin, "Tavg": tavg, "Tmax": tmax, "precipitation": precipitation}, index=dates)
+    rows = {}
+    for season, df_season in df.groupby(season_codes(dates)):
+        row = {
+            "gdd": (df_season["Tavg"] - GDD_BASE).clip(lower=0).sum(),
+            "frost_days": (df_season["Tmin"] < FROST_THRESHOLD).sum(),
+        }
+        for threshold in HEAT_THRESHOLDS:
+            row[f"heat_days_{threshold:g}"] = (df_season["Tmax"] > threshold).sum()
+        longest = current = 0
+        for rain in df_season["precipitation"]:
+            current = current + 1 if rain < DRY_DAY_THRESHOLD else 0
+            longest = max(longest, current)
+        row["longest_dry_spell"] = longest
+        row["rain"] = df_season["precipitation"].sum()
+        for window, months in PHENOLOGICAL_WINDOWS.items():
+            row[f"rain_{window}"] = df_season.loc[df_season.index.month.isin(months), "precipitation"].sum()
+        rows[season] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meteo", help="ERA5 parquet file or folder, a synthetic cube by default")
+    parser.add_argument("--latitudes", type=int, default=43)
+    parser.add_argument("--longitudes", type=int, default=63)
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--sample", type=int, default=20,
+                        help="number of grid points run through the loop (its time is extrapolated to the grid)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.meteo:
+        cube = read_cube(args.meteo, columns=INDICATOR_VARIABLES)
+    else:
+        cube = synthetic_cube(np.arange(args.latitudes) * 0.25 + 41., np.arange(args.longitudes) * 0.25 - 5.,
+                              range(2021 - args.years, 2021), variables=INDICATOR_VARIABLES)
+    n_points = len(cube.latitudes) * len(cube.longitudes)
+    print(f"{len(cube.dates)} days x {n_points} grid points ({cube.nbytes / 1e6:.0f} MB) loaded in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    seasons, indicators = compute_indicators(cube)
+    vectorized_time = time.perf_counter() - start
+    print(f"Vectorized: {vectorized_time:.2f}s for {len(seasons)} seasons and {len(indicators)} indicators")
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(n_points, size=min(args.sample, n_points), replace=False)
+    max_difference = 0.
+    start = time.perf_counter()
+    for point in sample:
+        lat, lon = divmod(int(point), len(cube.longitudes))
+        df_loop = loop_indicators(cube.dates, *(cube.values[variable][:, lat, lon] for variable in INDICATOR_VARIABLES))
+        vectorized = np.column_stack([indicators[column][:, lat, lon] for column in df_loop.columns])
+        max_difference = max(max_difference, float(np.nanmax(np.abs(vectorized - df_loop.to_numpy(dtype="float64")) / np.maximum(np.abs(vectorized), 1.))))
+    loop_time = time.perf_counter() - start
+    loop_total = loop_time * n_points / len(sample)
+    print(f"Loop: {loop_time:.2f}s for {len(sample)} grid points, ~{loop_total:.0f}s extrapolated to the grid")
+    print(f"Speedup: ~{loop_total / vectorized_time:.0f}x, max relative difference on the sample: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark of the snapshot map payload: full-resolution GeoJSON embedded twice vs precomputed simplified geometry
+
+Run from the src folder (the communes artifacts are built if needed):
+    python -m benchmarks.bench_map_payload --column Tavg
+"""
+import argparse
+
+import folium
+import numpy as np
+import pandas as pd
+from folium.features import GeoJsonTooltip
+
+from benchmarks.timing import timed
+from utils.data_extraction import get_communes_artifact
+from utils.map_geometry import MAP_TOLERANCES, build_map_geometry, feature_collection, payload_size
+from utils.maps import DICT_THRESHOLDS, create_map
+
+
+def legacy_create_map(geo_df, geojson_data, meteo_column):
+    # Former implementation of create_map (Choropleth + tooltip GeoJson layers), kept here as the reference
+    m = folium.Map(location=[geo_df["geometry"].centroid.y.mean(), geo_df["geometry"].centroid.x.mean()], zoom_start=6)
+    threshold_scale = DICT_THRESHOLDS[meteo_column]
+    geo_df['capped_value'] = geo_df[meteo_column].apply(lambda x: max(min(x, threshold_scale[-1]), threshold_scale[0]))
+    folium.Choropleth(
+        geo_data=geojson_data, data=geo_df, columns=['id', 'capped_value'], key_on="feature.properties.id",
+        fill_color="YlGnBu", threshold_scale=threshold_scale, fill_opacity=0.7, line_opacity=0.2, legend_name=meteo_column,
+    ).add_to(m)
+    folium.GeoJson(
+        geojson_data, name="Communes",
+        style_function=lambda feature: {"color": "black", "weight": 0.5, "fillOpacity": 0.1},
+        tooltip=GeoJsonTooltip(fields=[meteo_column], aliases=[meteo_column + ": "], localize=True, sticky=True),
+    ).add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--column", default="Tavg", choices=list(DICT_THRESHOLDS))
+    args = parser.parse_args()
+
+    gdf_grid = get_communes_artifact("communes_grid", geo=True)
+    # Synthetic values of a month, the payload size does not depend on them
+    rng = np.random.default_rng(0)
+    thresholds = DICT_THRESHOLDS[args.column]
+    df_values = pd.DataFrame(
+        {args.column: rng.uniform(thresholds[0], thresholds[-1], len(gdf_grid))},
+        index=pd.Index(gdf_grid["nearest_id"].to_numpy(), name="id"),
+    )
+    print(f"{len(gdf_grid)} polygons, variable {args.column}")
+
+    # Legacy: full-resolution polygons serialized on each render and embedded in two layers
+    gdf_legacy = gdf_grid.merge(df_values.reset_index(), left_on="nearest_id", right_on="id")
+    geojson_legacy, serialize_time = timed(lambda: gdf_legacy.to_json())
+    html_legacy, render_time = timed(lambda: legacy_create_map(gdf_legacy, geojson_legacy, args.column).get_root().render())
+    print(f"{'legacy':>8}: GeoJSON {payload_size(geojson_legacy) / 1024:8.0f} kB x 2 layers, "
+          f"HTML {len(html_legacy.encode()) / 1024:8.0f} kB, render {serialize_time + render_time:.3f}s")
+
+    for detail, tolerance in MAP_TOLERANCES.items():
+        gdf_map = get_communes_artifact(f"communes_map_{detail}", geo=True)
+        map_geometry, build_time = timed(lambda: build_map_geometry(gdf_map))
+        collection = feature_collection(map_geometry, df_values, [args.column])
+        html, render_time = timed(lambda: create_map(df_values, args.column, map_geometry, thresholds).get_root().render())
+        print(f"{detail:>8}: GeoJSON {payload_size(collection) / 1024:8.0f} kB x 1 layer,  "
+              f"HTML {len(html.encode()) / 1024:8.0f} kB, render {render_time:.3f}s "
+              f"(tolerance {tolerance}, geometry built once in {build_time:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark of the commune -> ERA5 grid matching: legacy iterrows/nearest_points loop vs KD-tree
+
+Run from the src folder:
+    python -m benchmarks.bench_nearest_grid --sample 2000
+"""
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.ops import nearest_points
+
+from utils.grid import build_grid_index, nearest_grid_ids
+
+
+def load_grid(path_base_meteo, base_date="2020-01-01"):
+    df_base_meteo = pd.read_parquet(path_base_meteo)
+    df_base_meteo = df_base_meteo[df_base_meteo.index.get_level_values("date") == base_date]
+    gdf_grid = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(
+            df_base_meteo.index.get_level_values("longitude"),
+            df_base_meteo.index.get_level_values("latitude"),
+        ),
+    )
+    gdf_grid["id"] = range(len(gdf_grid))
+    return gdf_grid
+
+
+def legacy_nearest_ids(centroids, gdf_grid):
+    # Former implementation of load_communes_geometry, kept here as the reference
+    nearest_ids = []
+    for centroid in centroids:
+        nearest_geom = nearest_points(centroid, gdf_grid.unary_union)[1]
+        nearest_data = gdf_grid.loc[gdf_grid["geometry"] == nearest_geom]
+        nearest_ids.append(nearest_data["id"].values[0])
+    return np.array(nearest_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--communes", default="../data/communes-20220101-shp/")
+    parser.add_argument("--meteo", default="../data/ERA5_data.parquet")
+    parser.add_argument("--sample", type=int, default=1000,
+                        help="number of communes run through the legacy loop (its time is extrapolated to all communes)")
+    args = parser.parse_args()
+
+    gdf_grid = load_grid(args.meteo)
+    gdf_communes = gpd.read_file(args.communes)
+    centroids = gdf_communes.geometry.centroid
+    print(f"{len(gdf_communes)} communes, {len(gdf_grid)} grid points")
+
+    start = time.perf_counter()
+    grid_index = build_grid_index(gdf_grid)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    kdtree_ids = nearest_grid_ids(centroids, gdf_grid, grid_index=grid_index)
+    query_time = time.perf_counter() - start
+    print(f"KD-tree: build {build_time:.3f}s, query {query_time:.3f}s for all communes")
+
+    sample = centroids.iloc[:min(args.sample, len(centroids))]
+    start = time.perf_counter()
+    legacy_ids = legacy_nearest_ids(sample, gdf_grid)
+    legacy_time = time.perf_counter() - start
+    legacy_total = legacy_time * len(centroids) / len(sample)
+    print(f"Legacy loop: {legacy_time:.3f}s for {len(sample)} communes, ~{legacy_total:.1f}s extrapolated to all communes")
+    print(f"Speedup: ~{legacy_total / (build_time + query_time):.0f}x")
+
+    # Equidistant grid points may be resolved differently, so report the agreement rather than assert it
+    agreement = (kdtree_ids[:len(sample)] == legacy_ids).mean()
+    print(f"Agreement with the legacy loop on the sample: {agreement:.2%}")
+
+
+if __name__ == "__main__":
+    main()
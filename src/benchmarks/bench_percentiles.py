@@ -0,0 +1,58 @@
+"""Benchmark of the calendar day percentiles: np.nanpercentile per day vs window_percentiles sorting blocks of days
+
+Run from the src folder, on synthetic daily values the size of the ERA5 grid of France over 20 years:
+    python -m benchmarks.bench_percentiles --cells 2709 --years 20
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.fixtures import synthetic_cube
+from utils.percentiles import BLOCK_BYTES, CALENDAR_DAYS, PERCENTILES, WINDOW_DAYS, calendar_array, window_percentiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cells", type=int, default=2709)
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--block-mb", type=int, default=BLOCK_BYTES // 1024 ** 2, help="memory budget of the sorted blocks")
+    parser.add_argument("--sample", type=int, default=10,
+                        help="number of calendar days run through np.nanpercentile (its time is extrapolated to the year)")
+    args = parser.parse_args()
+
+    # Cells in a single row of latitude, arranged by year and calendar day
+    years = np.arange(2021 - args.years, 2021)
+    cube = synthetic_cube([45.], np.arange(args.cells) * 0.25, years, variables=["Tavg"])
+    values = calendar_array(cube.dates, cube.values["Tavg"][:, 0], years)
+    del cube
+    # A few missing days, as at the ends of the data
+    values[0, :200] = np.nan
+    print(f"{args.years} years x {CALENDAR_DAYS} days x {args.cells} cells ({values.nbytes / 1e6:.0f} MB)")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    percentiles = window_percentiles(values, max_bytes=args.block_mb * 1024 ** 2)
+    blocks_time = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"Blocks: {blocks_time:.2f}s, peak memory {peak / 1e6:.0f} MB")
+
+    half = WINDOW_DAYS // 2
+    rng = np.random.default_rng(0)
+    days = rng.choice(CALENDAR_DAYS, size=min(args.sample, CALENDAR_DAYS), replace=False)
+    max_difference = 0.
+    start = time.perf_counter()
+    for day in days:
+        window_days = np.arange(day - half, day + WINDOW_DAYS - half) % CALENDAR_DAYS
+        reference = np.nanpercentile(values[:, window_days].reshape(-1, args.cells), PERCENTILES, axis=0)
+        max_difference = max(max_difference, float(np.abs(percentiles[:, day] - reference).max()))
+    reference_time = time.perf_counter() - start
+    reference_total = reference_time * CALENDAR_DAYS / len(days)
+    print(f"np.nanpercentile: {reference_time:.2f}s for {len(days)} days, ~{reference_total:.0f}s extrapolated to the year")
+    print(f"Speedup: ~{reference_total / blocks_time:.0f}x, max difference on the sample: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
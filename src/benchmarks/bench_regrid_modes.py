@@ -0,0 +1,56 @@
+"""Benchmark of the department regridding: nearest grid point vs area overlap with the ERA5 cells
+
+Run from the src folder:
+    python -m benchmarks.bench_regrid_modes --departments 27 28 --start 2020-01-01 --end 2020-12-31
+"""
+import argparse
+import time
+
+from utils.data_extraction import build_communes_mapping, load_base_grid
+from utils.era5 import ERA5_PATH, read_meteo_data
+from utils.grid import grid_cell_polygons, overlap_weights, polygon_areas
+from utils.meteo import METEOROLOGICAL_COLUMNS
+from utils.regrid import build_weight_matrix, regrid_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--communes", default="../data/communes-20220101-shp/")
+    parser.add_argument("--cog", default="../data/cog_ensemble_2021_csv/commune2021.csv")
+    parser.add_argument("--meteo", default=ERA5_PATH)
+    parser.add_argument("--departments", nargs="+", default=["27", "28"])
+    parser.add_argument("--start", default="2020-01-01")
+    parser.add_argument("--end", default="2020-12-31")
+    args = parser.parse_args()
+
+    gdf_grid = load_base_grid(args.meteo)
+    gdf_communes = build_communes_mapping(gdf_grid, args.communes, args.cog, args.departments)
+    print(f"{len(gdf_communes)} communes, {len(gdf_grid)} grid points")
+
+    # One-time builds of the weights, the nearest ids are already in the mapping
+    start = time.perf_counter()
+    gdf_communes["area"] = polygon_areas(gdf_communes)
+    nearest_matrix, labels = build_weight_matrix(gdf_communes, len(gdf_grid))
+    nearest_build = time.perf_counter() - start
+    start = time.perf_counter()
+    df_overlap = overlap_weights(gdf_communes, grid_cell_polygons(gdf_grid), ["insee", "DEP"])
+    overlap_matrix, _ = build_weight_matrix(df_overlap, len(gdf_grid), cells="cell_id")
+    overlap_build = time.perf_counter() - start
+    print(f"Weights build: nearest {nearest_build:.3f}s ({nearest_matrix.nnz} cells), "
+          f"overlap {overlap_build:.3f}s ({overlap_matrix.nnz} cells, {len(df_overlap)} commune x cell pairs)")
+
+    df_meteo = read_meteo_data(args.meteo, start_date=args.start, end_date=args.end)
+    results = {}
+    for mode, matrix in (("nearest", nearest_matrix), ("overlap", overlap_matrix)):
+        start = time.perf_counter()
+        results[mode] = regrid_frame(df_meteo, matrix, labels, gdf_grid)
+        print(f"Regrid {mode}: {time.perf_counter() - start:.3f}s for {len(df_meteo)} rows")
+
+    # Mean absolute difference of the department averages between the modes
+    difference = (results["overlap"] - results["nearest"]).abs().groupby(level=labels.name).mean()
+    print("Mean absolute difference overlap - nearest per department:")
+    print(difference[METEOROLOGICAL_COLUMNS].round(4).to_string())
+
+
+if __name__ == "__main__":
+    main()
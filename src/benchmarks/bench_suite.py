@@ -0,0 +1,143 @@
+"""Benchmark suite of the core functions on synthetic data, at several scales, against saved baselines
+
+Run from the src folder:
+    python -m benchmarks.bench_suite --scales 2 10 country
+    python -m benchmarks.bench_suite --scales 2 10 --save-baseline
+    python -m benchmarks.bench_suite --scales 2 10 --check
+
+The fixtures of each scale are generated once in --data-dir (see benchmarks.fixtures). Each function is
+timed --repeat times and its best time compared with the baseline of the scale: --check exits with an
+error when a function is slower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import fixture_departments, fixture_paths, write_fixtures
+from utils.agri import read_agri_data
+from utils.data_extraction import load_communes_geometry
+from utils.era5 import read_meteo_data
+from utils.map_geometry import MAP_TOLERANCES, build_map_geometry, simplify_polygons
+from utils.maps import compute_thresholds, create_map
+from utils.meteo import convert_lat_long_to_communes, get_monthly_mean, surface_dpt_average
+
+# Number of departments per scale
+SCALES = {"2": 2, "10": 10, "country": 96}
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+# Time differences below this (s) are noise, never reported as regressions
+NOISE_SECONDS = 0.01
+
+
+def best_time(function, repeat):
+    """Best wall time of repeat calls, and the result of the last one"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def run_scale(n_departments, years, data_dir, repeat, variable="Tavg"):
+    """Times the core functions on the fixtures of a scale
+
+    Returns:
+        dict: function -> best time (s)
+    """
+    if not os.path.exists(os.path.join(data_dir, "agreste.csv")):
+        start = time.perf_counter()
+        write_fixtures(data_dir, n_departments, years)
+        print(f"  fixtures written to {data_dir} in {time.perf_counter() - start:.1f}s")
+    paths = fixture_paths(data_dir)
+    departments = tuple(fixture_departments(n_departments))
+    year = max(years)
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as artifacts_dir:
+        # Uncached loader (the DataContext would return the first result), cold then from the artifacts
+        load_geometry = load_communes_geometry.__wrapped__
+        arguments = (paths["communes"], paths["cog"], paths["meteo"], departments, artifacts_dir)
+        timings["load_communes_geometry (build)"], _ = best_time(lambda: load_geometry(*arguments), 1)
+        timings["load_communes_geometry (artifact)"], gdf_geom = best_time(lambda: load_geometry(*arguments), repeat)
+
+    df_meteo = read_meteo_data(paths["meteo"])
+    timings["get_monthly_mean"], df_monthly = best_time(lambda: get_monthly_mean(df_meteo, year=year), repeat)
+    timings["convert_lat_long_to_communes"], gdf_meteo = best_time(
+        lambda: convert_lat_long_to_communes(df_monthly, gdf_geom, path_meteo=paths["meteo"]), repeat)
+    timings["surface_dpt_average"], _ = best_time(lambda: surface_dpt_average(gdf_meteo), repeat)
+
+    # Map of the first month of the season, from the geometry precomputed by load_map_geometry
+    map_geometry = build_map_geometry(simplify_polygons(gdf_geom[["nearest_id", "geometry"]], MAP_TOLERANCES["medium"]))
+    df_month = gdf_meteo[gdf_meteo["date"] == gdf_meteo["date"].min()].groupby("nearest_id")[[variable]].first()
+    thresholds = compute_thresholds(df_month[variable].to_numpy())
+    timings["create_map"], folium_map = best_time(lambda: create_map(df_month, variable, map_geometry, thresholds), repeat)
+    timings["create_map (render)"], _ = best_time(lambda: folium_map.get_root().render(), repeat)
+
+    timings["read_agri_data"], _ = best_time(lambda: read_agri_data(paths["agri"], departments), repeat)
+    return timings
+
+
+def baseline_path(scale, baselines_dir=BASELINES_DIR):
+    return os.path.join(baselines_dir, f"{scale}.json")
+
+
+def compare(timings, baseline, tolerance):
+    """Ratio of each timing to its baseline, and the functions slower than the baseline by more than tolerance"""
+    ratios, regressions = {}, []
+    for function, seconds in timings.items():
+        reference = baseline.get(function)
+        if reference is None:
+            continue
+        ratios[function] = seconds / reference if reference else float("inf")
+        if seconds > reference * tolerance and seconds - reference > NOISE_SECONDS:
+            regressions.append(function)
+    return ratios, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", default=["2", "10"], choices=list(SCALES))
+    parser.add_argument("--years", type=int, default=2, help="years of daily ERA5 data, ending in 2020")
+    parser.add_argument("--data-dir", default="../data/benchmarks")
+    parser.add_argument("--baselines-dir", default=BASELINES_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.5, help="ratio to the baseline above which a timing is a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="save the timings as the baselines of the scales")
+    parser.add_argument("--check", action="store_true", help="exit with an error on regressions")
+    args = parser.parse_args()
+
+    years = list(range(2021 - args.years, 2021))
+    all_regressions = []
+    for scale in args.scales:
+        print(f"Scale {scale} ({SCALES[scale]} departments, {len(years)} years)")
+        data_dir = os.path.join(args.data_dir, f"{scale}_{len(years)}y")
+        timings = run_scale(SCALES[scale], years, data_dir, args.repeat)
+
+        path = baseline_path(scale, args.baselines_dir)
+        baseline = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                baseline = json.load(file)["timings"]
+        ratios, regressions = compare(timings, baseline, args.tolerance)
+        for function, seconds in timings.items():
+            reference = f"  baseline {baseline[function]:.4f}s ({ratios[function]:.2f}x)" if function in ratios else ""
+            flag = "  REGRESSION" if function in regressions else ""
+            print(f"  {function:<36}{seconds:9.4f}s{reference}{flag}")
+        all_regressions += [(scale, function) for function in regressions]
+
+        if args.save_baseline:
+            os.makedirs(args.baselines_dir, exist_ok=True)
+            with open(path, "w") as file:
+                json.dump({"departments": SCALES[scale], "years": len(years), "repeat": args.repeat, "timings": timings}, file, indent=2)
+            print(f"  baseline saved to {path}")
+
+    if args.check and all_regressions:
+        print(f"{len(all_regressions)} regressions: " + ", ".join(f"{function} ({scale})" for scale, function in all_regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark of the zone resolution: intersecting every grid cell vs cell_weights querying the R-tree of the cells
+
+Run from the src folder, on a synthetic grid the size of the ERA5 grid of France and random site zones:
+    python -m benchmarks.bench_zones --cells 2709 --zones 200 --radius-km 20
+"""
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point, box
+
+from utils.grid import AREA_CRS
+from utils.zones import cell_weights
+
+# Spacing of the ERA5 grid (0.25°) in Lambert-93, roughly
+CELL_SIZE = 25000.
+
+
+def synthetic_cells(n_cells):
+    """Square grid of n_cells cells with their R-tree, as returned by zones.load_zone_cells"""
+    side = int(np.ceil(np.sqrt(n_cells)))
+    x, y = np.meshgrid(np.arange(side) * CELL_SIZE, np.arange(side) * CELL_SIZE)
+    x, y = x.ravel()[:n_cells], y.ravel()[:n_cells]
+    cells = gpd.GeoDataFrame(
+        {"id": np.arange(n_cells), "latitude": y, "longitude": x},
+        geometry=[box(left, bottom, left + CELL_SIZE, bottom + CELL_SIZE) for left, bottom in zip(x, y)],
+        crs=AREA_CRS,
+    )
+    cells.sindex
+    return cells
+
+
+def all_cells_weights(zone, gdf_cells):
+    # Reference implementation: intersection of the zone with every cell
+    areas = gdf_cells.geometry.intersection(zone).area
+    areas = areas[areas > 0]
+    return (areas / areas.sum()).to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cells", type=int, default=2709)
+    parser.add_argument("--zones", type=int, default=200)
+    parser.add_argument("--radius-km", type=float, default=20.)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    gdf_cells = synthetic_cells(args.cells)
+    print(f"{args.cells} cells, index built in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(0)
+    extent = np.sqrt(args.cells) * CELL_SIZE
+    zones = [Point(x, y).buffer(args.radius_km * 1000.) for x, y in rng.uniform(0, extent, (args.zones, 2))]
+
+    start = time.perf_counter()
+    indexed = [cell_weights(zone, gdf_cells) for zone in zones]
+    indexed_time = time.perf_counter() - start
+    print(f"R-tree: {indexed_time / len(zones) * 1000:.2f}ms per zone")
+
+    start = time.perf_counter()
+    reference = [all_cells_weights(zone, gdf_cells) for zone in zones]
+    reference_time = time.perf_counter() - start
+    print(f"All cells: {reference_time / len(zones) * 1000:.2f}ms per zone")
+
+    max_difference = max(float(np.abs(weights.to_numpy() - expected).max()) for weights, expected in zip(indexed, reference))
+    print(f"Speedup: ~{reference_time / indexed_time:.0f}x, max difference: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Synthetic inputs shaped like the app data: ERA5 parquet, communes shapefile, COG CSV and agreste CSV
+
+The departments are 1 degree tiles laid out in rows of DEPARTMENTS_PER_ROW from FIXTURE_ORIGIN, each
+cut in square communes, and the ERA5 grid covers them with a margin of one grid step.
+"""
+import math
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+from utils.cube import MeteoCube
+from utils.meteo import METEOROLOGICAL_COLUMNS
+
+# (longitude, latitude) of the south-west corner of the first department
+FIXTURE_ORIGIN = (-4.5, 42.5)
+DEPARTMENTS_PER_ROW = 12
+DEPARTMENT_SIZE = 1.
+GRID_STEP = 0.25
+# Around 35,000 communes for the 96 departments of metropolitan France (the largest scale)
+COMMUNES_PER_DEPARTMENT = 370
+AGRI_CATEGORIES = ["Blé tendre d'hiver et épeautre", "Orge d'hiver et escourgeon", "Maïs grain"]
+AGRI_VARIABLES = ["Production (volume)", "Superficie développée", "Rendement"]
+
+
+def fixture_departments(n_departments):
+    # Corsica is split in 2A and 2B, as in the COG
+    codes = [f"{number:02d}" for number in range(1, 20)] + ["2A", "2B"] + [f"{number}" for number in range(21, 96)]
+    return codes[:n_departments]
+
+
+def fixture_paths(data_dir):
+    """Paths of the fixture files, named like the files of ../data"""
+    return {
+        "meteo": os.path.join(data_dir, "ERA5_data.parquet"),
+        "communes": os.path.join(data_dir, "communes-20220101-shp"),
+        "cog": os.path.join(data_dir, "cog_ensemble_2021_csv", "commune2021.csv"),
+        "agri": os.path.join(data_dir, "agreste.csv"),
+    }
+
+
+def _department_origin(position):
+    row, column = divmod(position, DEPARTMENTS_PER_ROW)
+    return FIXTURE_ORIGIN[0] + column * DEPARTMENT_SIZE, FIXTURE_ORIGIN[1] + row * DEPARTMENT_SIZE
+
+
+def synthetic_communes(n_departments, communes_per_department=COMMUNES_PER_DEPARTMENT):
+    """Square communes tiling each department
+
+    Returns:
+        gpd.GeoDataFrame: 'insee', 'nom', 'wikipedia', 'surf_ha', 'DEP' and the polygons (WGS84)
+    """
+    side = math.ceil(math.sqrt(communes_per_department))
+    step = DEPARTMENT_SIZE / side
+    offsets = np.arange(side) * step
+    rows = []
+    for position, department in enumerate(fixture_departments(n_departments)):
+        x0, y0 = _department_origin(position)
+        for number, (dx, dy) in enumerate((dx, dy) for dx in offsets for dy in offsets):
+            rows.append((f"{department}{number:03d}", department, box(x0 + dx, y0 + dy, x0 + dx + step, y0 + dy + step)))
+    return gpd.GeoDataFrame({
+        "insee": [row[0] for row in rows],
+        "nom": [f"Commune {row[0]}" for row in rows],
+        "wikipedia": "",
+        "surf_ha": 100.,
+        "DEP": [row[1] for row in rows],
+    }, geometry=[row[2] for row in rows], crs="EPSG:4326")
+
+
+def synthetic_cube(latitudes, longitudes, years, variables=METEOROLOGICAL_COLUMNS, seed=0):
+    """Daily values on a grid, with a seasonal temperature cycle and intermittent rain
+
+    Args:
+        latitudes (np.ndarray): latitudes of the grid
+        longitudes (np.ndarray): longitudes of the grid
+        years (range): years of daily data
+        variables (list): columns of METEOROLOGICAL_COLUMNS to draw
+
+    Returns:
+        MeteoCube: float32 [date, latitude, longitude] values of the variables
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(f"{min(years)}-01-01", f"{max(years)}-12-31", freq="D", name="date")
+    shape = (len(dates), len(latitudes), len(longitudes))
+    cycle = 11 + 8 * np.sin((dates.dayofyear.to_numpy() - 110) / 365 * 2 * np.pi)
+    temperature = cycle[:, None, None] + rng.normal(0, 3, shape)
+    generators = {
+        "precipitation": lambda: rng.gamma(0.6, 3, shape) * (rng.random(shape) < 0.5),
+        "r_min": lambda: rng.uniform(20, 100, shape),
+        "ssrd_mean": lambda: rng.uniform(0, 350, shape),
+        "Tmax": lambda: temperature + 5,
+        "Tavg": lambda: temperature,
+        "Tmin": lambda: temperature - 5,
+        "ws10_mean": lambda: rng.uniform(0, 10, shape),
+    }
+    values = {variable: generators[variable]().astype("float32") for variable in variables}
+    return MeteoCube(dates, np.asarray(latitudes), np.asarray(longitudes), values)
+
+
+def synthetic_meteo(n_departments, years, seed=0):
+    """Daily values on the grid covering the departments, see synthetic_cube
+
+    Returns:
+        pd.DataFrame: METEOROLOGICAL_COLUMNS (float32) indexed by latitude, longitude and date
+    """
+    n_rows = math.ceil(n_departments / DEPARTMENTS_PER_ROW)
+    n_columns = min(n_departments, DEPARTMENTS_PER_ROW)
+    longitudes = np.round(np.arange(FIXTURE_ORIGIN[0] - GRID_STEP, FIXTURE_ORIGIN[0] + n_columns * DEPARTMENT_SIZE + 1.5 * GRID_STEP, GRID_STEP), 2)
+    latitudes = np.round(np.arange(FIXTURE_ORIGIN[1] - GRID_STEP, FIXTURE_ORIGIN[1] + n_rows * DEPARTMENT_SIZE + 1.5 * GRID_STEP, GRID_STEP), 2)
+    return synthetic_cube(latitudes, longitudes, years, seed=seed).to_frame()[METEOROLOGICAL_COLUMNS]
+
+
+def synthetic_agri(n_departments, years, seed=0):
+    """Agreste rows (one value per category, department, variable and year)"""
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [AGRI_CATEGORIES, fixture_departments(n_departments), AGRI_VARIABLES, list(years)],
+        names=["n6", "dpt", "variable", "year"],
+    )
+    df_agri = index.to_frame(index=False)
+    df_agri.insert(0, "n1", "Grandes cultures")
+    df_agri.insert(2, "departement", "Département " + df_agri["dpt"])
+    df_agri["value"] = rng.uniform(40, 90, len(df_agri))
+    return df_agri
+
+
+def write_fixtures(data_dir, n_departments, years, communes_per_department=COMMUNES_PER_DEPARTMENT, seed=0):
+    """Writes the synthetic inputs of a scale to data_dir, see fixture_paths
+
+    Returns:
+        dict: paths of the written files
+    """
+    paths = fixture_paths(data_dir)
+    os.makedirs(paths["communes"], exist_ok=True)
+    os.makedirs(os.path.dirname(paths["cog"]), exist_ok=True)
+
+    synthetic_meteo(n_departments, years, seed).to_parquet(paths["meteo"])
+
+    gdf_communes = synthetic_communes(n_departments, communes_per_department)
+    gdf_communes.drop(columns="DEP").to_file(os.path.join(paths["communes"], "communes-20220101.shp"))
+    pd.DataFrame({
+        "TYPECOM": "COM", "COM": gdf_communes["insee"], "REG": 0, "DEP": gdf_communes["DEP"], "CTCD": "", "ARR": "",
+        "TNCC": 0, "NCC": "", "NCCENR": "", "LIBELLE": gdf_communes["nom"], "CAN": "", "COMPARENT": "",
+    }).to_csv(paths["cog"], index=False)
+
+    synthetic_agri(n_departments, years, seed).to_csv(paths["agri"])
+    return paths
@@ -0,0 +1,9 @@
+"""Timing helpers shared by the benchmarks"""
+import time
+
+
+def timed(function):
+    """Result and wall time of a call of function"""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
@@ -0,0 +1,66 @@
+"""Builds the on-disk artifacts read by the app at startup
+
+Run from the src folder (data read from ../data), after each data refresh:
+    python build_artifacts.py
+
+The departments are configured with the DEPARTMENTS environment variable (e.g. DEPARTMENTS=27,28,45), their
+communes and agreste artifacts are written to one partition folder per department.
+"""
+import argparse
+import logging
+import time
+
+from utils.agri import build_agri_partitions
+from utils.artifacts import ARTIFACTS_DIR
+from utils.data_extraction import build_communes_artifacts, build_grid_cells, check_departments
+from utils.departments import DEPARTMENTS
+from utils.era5 import ERA5_PARTITIONED_PATH, ERA5_PATH, partition_meteo_by_year
+from utils.indicators import build_indicators
+from utils.percentiles import build_percentiles
+from utils.rollups import build_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--communes", default="../data/communes-20220101-shp/")
+    parser.add_argument("--cog", default="../data/cog_ensemble_2021_csv/commune2021.csv")
+    parser.add_argument("--meteo", default=ERA5_PATH)
+    parser.add_argument("--artifacts-dir", default=ARTIFACTS_DIR)
+    parser.add_argument("--partition-meteo", action="store_true",
+                        help=f"also rewrite the ERA5 file as one parquet file per year in {ERA5_PARTITIONED_PATH}")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    check_departments(args.cog)
+
+    if args.partition_meteo:
+        start = time.perf_counter()
+        written_files = partition_meteo_by_year(args.meteo)
+        print(f"ERA5 data partitioned in {len(written_files)} yearly files in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = build_communes_artifacts(args.communes, args.cog, args.meteo, artifacts_dir=args.artifacts_dir)
+    print(f"Communes artifacts {key} of {len(DEPARTMENTS)} departments built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = build_grid_cells(args.meteo, artifacts_dir=args.artifacts_dir)
+    print(f"Grid cells {key} built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = build_agri_partitions(artifacts_dir=args.artifacts_dir)
+    print(f"Agri partitions {key} of {len(DEPARTMENTS)} departments built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = build_rollups(args.meteo, args.artifacts_dir, args.communes, args.cog)
+    print(f"Rollups {key} built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = build_indicators(args.meteo, args.artifacts_dir, args.communes, args.cog)
+    print(f"Agro-climatic indicators {key} built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = build_percentiles(args.meteo, args.artifacts_dir, path_gpd_communes=args.communes, path_df_communes=args.cog)
+    print(f"Percentile climatologies and extreme events {key} built in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
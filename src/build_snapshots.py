@@ -0,0 +1,41 @@
+"""Precomputes the year snapshot page products of every (season, variable) in parallel
+
+Run from the src folder (data read from ../data), after build_artifacts.py or ingest_meteo.py:
+    python build_snapshots.py --workers 8
+"""
+import argparse
+import os
+import time
+
+from utils.artifacts import ARTIFACTS_DIR
+from utils.era5 import meteo_date_range
+from utils.meteo import METEOROLOGICAL_COLUMNS, season_range
+from utils.snapshots import build_snapshots
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--artifacts-dir", default=ARTIFACTS_DIR)
+    parser.add_argument("--years", type=int, nargs="*", help="seasons, every season with data by default")
+    parser.add_argument("--variables", nargs="*", default=METEOROLOGICAL_COLUMNS, choices=METEOROLOGICAL_COLUMNS)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, the number of CPUs by default")
+    args = parser.parse_args()
+
+    if args.years:
+        years = args.years
+    else:
+        first_season, last_season = season_range(*meteo_date_range())
+        years = list(range(first_season, last_season + 1))
+
+    start = time.perf_counter()
+    key, df_timings = build_snapshots(years, args.variables, max_workers=args.workers, artifacts_dir=args.artifacts_dir,
+                                      snapshots_dir=os.path.join(args.artifacts_dir, "snapshots"))
+    wall_time = time.perf_counter() - start
+
+    print(f"{len(df_timings)} snapshots ({len(years)} seasons x {len(args.variables)} variables) {key} built in {wall_time:.1f}s")
+    print("Time per stage (s), summed over the tasks:")
+    print(df_timings.sum().to_frame("total").assign(mean=df_timings.mean(), max=df_timings.max()).round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
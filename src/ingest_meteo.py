@@ -0,0 +1,72 @@
+"""Appends new daily ERA5 data and updates the rollups for the new days only
+
+Run from the src folder (data read from ../data), e.g. nightly with the last extracted days:
+    python ingest_meteo.py new_days.parquet
+
+The input files have the layout of the ERA5 file (indexed by latitude, longitude and date).
+"""
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from utils.artifacts import ARTIFACTS_DIR
+from utils.era5 import ERA5_PARTITIONED_PATH, ERA5_PATH, append_meteo_data, compact_meteo_partitions, meteo_date_range, partition_meteo_by_year, resolve_meteo_path
+from utils.indicators import build_indicators
+from utils.percentiles import build_percentiles
+from utils.rollups import build_rollups, read_rollups, refresh_rollups, rollups_key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="*", help="parquet files of new daily ERA5 data")
+    parser.add_argument("--artifacts-dir", default=ARTIFACTS_DIR)
+    parser.add_argument("--compact", action="store_true",
+                        help="merge the files appended to the partitions of the past years")
+    args = parser.parse_args()
+
+    if resolve_meteo_path(ERA5_PATH) != ERA5_PARTITIONED_PATH:
+        # The data is appended to the year-partitioned copy of the ERA5 file, built once
+        start = time.perf_counter()
+        written_files = partition_meteo_by_year()
+        print(f"ERA5 data partitioned in {len(written_files)} yearly files in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    previous_key = rollups_key(artifacts_dir=args.artifacts_dir)
+    if read_rollups(previous_key, artifacts_dir=args.artifacts_dir) is None:
+        build_rollups(artifacts_dir=args.artifacts_dir)
+        print(f"Rollups {previous_key} built in {time.perf_counter() - start:.1f}s")
+
+    if args.compact:
+        start = time.perf_counter()
+        last_year = meteo_date_range(ERA5_PARTITIONED_PATH)[1].year
+        years = compact_meteo_partitions(years=range(last_year))
+        print(f"Years {years} compacted in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    df_new = pd.concat([pd.read_parquet(path) for path in args.inputs]) if args.inputs else None
+    new_dates = pd.DatetimeIndex([]) if df_new is None else append_meteo_data(df_new)
+    print(f"{len(new_dates)} new days appended to {os.path.abspath(ERA5_PARTITIONED_PATH)} in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    key = refresh_rollups(previous_key, new_dates, artifacts_dir=args.artifacts_dir)
+    print(f"Rollups {key} updated in {time.perf_counter() - start:.1f}s")
+
+    if len(new_dates):
+        # Season-level indicators, recomputed in one vectorized pass
+        start = time.perf_counter()
+        key = build_indicators(artifacts_dir=args.artifacts_dir)
+        print(f"Agro-climatic indicators {key} built in {time.perf_counter() - start:.1f}s")
+
+        # The percentiles pool every year: rebuilt, streaming the daily data by chunks of years
+        start = time.perf_counter()
+        key = build_percentiles(artifacts_dir=args.artifacts_dir)
+        print(f"Percentile climatologies and extreme events {key} built in {time.perf_counter() - start:.1f}s")
+
+    first_date, last_date = meteo_date_range()
+    print(f"ERA5 data available from {first_date:%Y-%m-%d} to {last_date:%Y-%m-%d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,69 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from utils.data_extraction import load_meteo_data
+from utils.meteo import METEOROLOGICAL_COLUMNS
+from utils.queries import get_event_series, get_percentile_series, get_seasons, get_series
+from utils.charts import chart_data
+from utils.sidebar import sidebar_context_stats, sidebar_profile
+from utils.profiling import stage, start_run
 
 def plot_daily():
     st.subheader('Données aggrégées par jour')
-    df_meteo = load_meteo_data()
-
-    # Reset index to make 'date' a column
-    df_meteo_reset = df_meteo.reset_index()
-
-    # Group by 'date' and calculate the mean for each date
-    mean_per_date = df_meteo_reset.groupby('date').mean()
-    mean_per_date.drop(columns=['latitude', 'longitude'], inplace=True)
-    mean_per_date = mean_per_date.reset_index()
 
     # User input for the year
-    year = st.number_input("Sélectionnez l'année", min_value=2000, max_value=2021, value=2020)
+    first_season, last_season = get_seasons()
+    year = st.number_input("Sélectionnez l'année", min_value=first_season, max_value=last_season, value=min(2020, last_season))
 
     # Selector for the meteorological data column
     meteo_column = st.selectbox("Sélectionnez la variable météorologique à afficher", 
-                                mean_per_date.columns.drop('date'))
+                                METEOROLOGICAL_COLUMNS)
 
-    # Filter the data from September of the selected year to August of the next year
-    start_date = pd.to_datetime(f"{year-1}-09-01")
-    end_date = pd.to_datetime(f"{year}-08-31")
-    filtered_df = mean_per_date[(mean_per_date['date'] >= start_date) & (mean_per_date['date'] <= end_date)]
-    mean_per_date = filtered_df.groupby('date').mean().reset_index()
-    mean_per_date['day_of_year'] = mean_per_date['date'].dt.dayofyear
+    # Daily means over the study area from September of the previous year to August of the selected year,
+    # with the percentiles of the same calendar day over all years (February 29 shares those of February 28)
+    daily_df = get_percentile_series(meteo_column, year)
 
-    # Calculate the overall daily mean across all years
-    df_meteo_reset['day_of_year'] = df_meteo_reset['date'].dt.dayofyear
-    overall_mean = df_meteo_reset.groupby('day_of_year').mean().reset_index()
-    overall_mean = overall_mean.merge(mean_per_date[['day_of_year', 'date']], how='left', on='day_of_year')
+    # Single dataset shared by the layers, reduced to the plotted columns and points
+    chart_df = chart_data(daily_df, 'date', [meteo_column, 'p10', 'p50', 'p90', 'extreme'])
+
+    # Band between the 10th and 90th percentiles
+    band_chart = alt.Chart().mark_area(opacity=0.3, color='lightgray').encode(
+        x=alt.X('date:T', title='Date', axis=alt.Axis(labelAngle=-45)),
+        y=alt.Y('p10:Q', title=meteo_column.capitalize()),
+        y2='p90:Q'
+    )
 
     # Base line chart for selected year
-    line_chart = alt.Chart(mean_per_date).mark_line().encode(
+    line_chart = alt.Chart().mark_line().encode(
         x=alt.X('date:T', title='Date', axis=alt.Axis(labelAngle=-45)),
         y=alt.Y(f'{meteo_column}:Q', title=meteo_column.capitalize()),
     )
 
-    # Line chart for overall mean
-    mean_line_chart = alt.Chart(overall_mean).mark_line(color='red').encode(
+    # Line chart for the median
+    median_line_chart = alt.Chart().mark_line(color='red').encode(
         x=alt.X('date:T', title='Date', axis=alt.Axis(labelAngle=-45)),
-        y=alt.Y(f'{meteo_column}:Q', title='Mean ' + meteo_column.capitalize()),
+        y=alt.Y('p50:Q', title='Median ' + meteo_column.capitalize()),
     )
 
+    # Days outside of the band
+    extreme_points = alt.Chart().mark_point(filled=True).encode(
+        x='date:T',
+        y=f'{meteo_column}:Q',
+        color=alt.Color('extreme:N', scale=alt.Scale(domain=['above', 'below'], range=['orange', 'blue']),
+                        legend=alt.Legend(title='Hors P10-P90'))
+    ).transform_filter(alt.datum.extreme != '')
+
     # Transparent selector across the chart
-    selectors = alt.Chart(mean_per_date).mark_rule().encode(
+    selectors = alt.Chart().mark_rule().encode(
         x='date:T',
         opacity=alt.value(0),
-        tooltip=[alt.Tooltip('date:T', title='Date'), alt.Tooltip(f'{meteo_column}:Q', title=meteo_column.capitalize())]
+        tooltip=[alt.Tooltip('date:T', title='Date'), alt.Tooltip(f'{meteo_column}:Q', title=meteo_column.capitalize()),
+                 alt.Tooltip('p10:Q', title='P10'), alt.Tooltip('p50:Q', title='P50'), alt.Tooltip('p90:Q', title='P90')]
     ).add_selection(
         alt.selection_single(fields=['date'], nearest=True, on='mouseover', empty='none')
     )
 
     # Combine the charts
-    chart = alt.layer(line_chart, mean_line_chart, selectors).properties(
+    chart = alt.layer(band_chart, line_chart, median_line_chart, extreme_points, selectors, data=chart_df).properties(
         width=700,
         height=400
     ).interactive()
@@ -64,55 +71,49 @@ def plot_daily():
     # Display the chart in Streamlit
     st.altair_chart(chart, use_container_width=True)
 
+    # Share of the study area in each extreme event per day
+    st.subheader('Événements extrêmes (part de la zone)')
+    events_df = get_event_series(year).reset_index().melt(id_vars=['date'], var_name='event', value_name='share')
+    events_chart = alt.Chart(events_df).mark_bar().encode(
+        x=alt.X('date:T', title='Date'),
+        y=alt.Y('share:Q', title='Part de la zone', axis=alt.Axis(format='%'), stack=None),
+        color=alt.Color('event:N', legend=alt.Legend(title='Événement')),
+        tooltip=['date:T', 'event:N', alt.Tooltip('share:Q', format='.0%')]
+    ).properties(width=700, height=200)
+    st.altair_chart(events_chart, use_container_width=True)
+
 def plot_monthly():
     st.subheader('Données aggrégées par mois')
-    df_meteo = load_meteo_data()
-
-    # Reset index to make 'date' a column
-    df_meteo_reset = df_meteo.reset_index()
-
-    # Group by 'date' and calculate the mean for each date
-    mean_per_date = df_meteo_reset.groupby('date').mean()
-    mean_per_date.drop(columns=['latitude', 'longitude'], inplace=True)
-    mean_per_date = mean_per_date.reset_index()
 
     # User input for the year
-    year = st.number_input("Sélectionnez l'année", min_value=2000, max_value=2021, value=2020)
+    first_season, last_season = get_seasons()
+    year = st.number_input("Sélectionnez l'année", min_value=first_season, max_value=last_season, value=min(2020, last_season))
 
     # Selector for the meteorological data column
     meteo_column = st.selectbox("Sélectionnez la variable météorologique à afficher", 
-                                mean_per_date.columns.drop('date'))
-
-    # Filter the data from September of the selected year to August of the next year
-    start_date = pd.to_datetime(f"{year-1}-09-01")
-    end_date = pd.to_datetime(f"{year}-08-31")
-    filtered_df = mean_per_date[(mean_per_date['date'] >= start_date) & (mean_per_date['date'] <= end_date)]
-    # Group by year and month and calculate the mean
-    monthly_means = filtered_df.groupby([filtered_df['date'].dt.year.rename('year'), filtered_df['date'].dt.month.rename('month')]).mean()
-    # Reset the index to turn the grouping columns back into regular columns
-    monthly_means = monthly_means.reset_index()
-    # Create a new 'date' column with the first day of each month
-    monthly_means['date'] = pd.to_datetime(monthly_means.rename(columns={'date': 'year'}).apply(lambda row: f"{int(row['year'])}-{int(row['month'])}-01", axis=1))
-
-    # Calculate the overall daily mean across all years
-    df_meteo_reset['month'] = df_meteo_reset['date'].dt.month
-    overall_mean = df_meteo_reset.groupby('month').mean().reset_index()
-    overall_mean = overall_mean.merge(monthly_means[['month', 'date']], how='left', on='month')
+                                METEOROLOGICAL_COLUMNS)
+
+    # Monthly means over the study area from September of the previous year to August of the selected year,
+    # with the overall monthly mean across all years
+    monthly_means = get_series(meteo_column, year, 'monthly')
+
+    # Single dataset shared by the layers, reduced to the plotted columns
+    chart_df = chart_data(monthly_means, 'date', [meteo_column, 'climatology'])
 
     # Base line chart for selected year
-    line_chart = alt.Chart(monthly_means).mark_line().encode(
+    line_chart = alt.Chart().mark_line().encode(
         x=alt.X('date:T', title='Date', axis=alt.Axis(labelAngle=-45)),
         y=alt.Y(f'{meteo_column}:Q', title=meteo_column.capitalize()),
     )
 
     # Line chart for overall mean
-    mean_line_chart = alt.Chart(overall_mean).mark_line(color='red').encode(
+    mean_line_chart = alt.Chart().mark_line(color='red').encode(
         x=alt.X('date:T', title='Date', axis=alt.Axis(labelAngle=-45)),
-        y=alt.Y(f'{meteo_column}:Q', title='Mean ' + meteo_column.capitalize()),
+        y=alt.Y('climatology:Q', title='Mean ' + meteo_column.capitalize()),
     )
 
     # Transparent selector across the chart
-    selectors = alt.Chart(monthly_means).mark_rule().encode(
+    selectors = alt.Chart().mark_rule().encode(
         x='date:T',
         opacity=alt.value(0),
         tooltip=[alt.Tooltip('date:T', title='Date'), alt.Tooltip(f'{meteo_column}:Q', title=meteo_column.capitalize())]
@@ -121,7 +122,7 @@ def plot_monthly():
     )
 
     # Combine the charts
-    chart = alt.layer(line_chart, mean_line_chart, selectors).properties(
+    chart = alt.layer(line_chart, mean_line_chart, selectors, data=chart_df).properties(
         width=700,
         height=400
     ).interactive()
@@ -131,6 +132,7 @@ def plot_monthly():
 
 
 if __name__ == '__main__':
+    start_run('2_Meteo_dashboard')
     st.title('Dashboard variables météorologiques')
 
     # Add a radio button to select the function
@@ -138,6 +140,11 @@ if __name__ == '__main__':
 
     # Call the appropriate function based on the selection
     if date_range_selection == 'Par mois':
-        plot_monthly()
+        with stage('plot_monthly'):
+            plot_monthly()
     elif date_range_selection == 'Par jour':
-        plot_daily()
\ No newline at end of file
+        with stage('plot_daily'):
+            plot_daily()
+
+    sidebar_context_stats()
+    sidebar_profile()
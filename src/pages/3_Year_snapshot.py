@@ -2,44 +2,38 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 from streamlit_folium import folium_static
-from utils.meteo import get_monthly_mean, convert_lat_long_to_communes, surface_dpt_average
-from utils.data_extraction import load_meteo_data, load_communes_geometry, load_agri_data
-from utils.maps import create_map
+from utils.charts import chart_data
+from utils.data_extraction import load_map_geometry
+from utils.departments import department_name
+from utils.map_geometry import MAP_TOLERANCES
+from utils.maps import compute_thresholds, create_map, symmetric_thresholds
+from utils.percentiles import EVENTS
+from utils.queries import (get_event_days, get_indicators, get_seasons, get_snapshot, get_snapshot_anomaly, get_snapshot_chart,
+                           get_snapshot_months, get_yield, get_yields)
+from utils.snapshots import load_thresholds
+from utils.sidebar import sidebar_context_stats, sidebar_departments, sidebar_profile
+from utils.profiling import stage, start_run
 
 METEOROLOGICAL_COLUMNS = ['precipitation', 'r_min', 'ssrd_mean', 'Tmax', 'Tavg', 'Tmin', 'ws10_mean']
+MAP_DISPLAYS = ['Valeurs', 'Anomalies', 'Événements extrêmes']
+# Color bins of the number of days of an event in a month
+EVENT_DAYS_THRESHOLDS = [0., 1., 3., 5., 10., 20., 31.]
 
-def plot_monthly(meteo_column, year, df_meteo, gdf_geom):
-    df_meteo_year = get_monthly_mean(df_meteo, year=year)
-    df_meteo_mean = get_monthly_mean(df_meteo, compare_year=year)
-
-    gdf_meteo_year = convert_lat_long_to_communes(df_meteo_year, gdf_geom=gdf_geom)
-    gdf_meteo_mean = convert_lat_long_to_communes(df_meteo_mean, gdf_geom=gdf_geom)
-
-    df_meteo_year = surface_dpt_average(gdf_meteo_year)
-    df_meteo_mean = surface_dpt_average(gdf_meteo_mean)
-
-    df_meteo_year_27 = df_meteo_year.loc['27']
-    df_meteo_year_28 = df_meteo_year.loc['28']
-    df_meteo_mean_27 = df_meteo_mean.loc['27']
-    df_meteo_mean_28 = df_meteo_mean.loc['28']
-    # Add a new 'line_type' column to each DataFrame
-    df_meteo_year_27['line_type'] = 'Dpt 27'
-    df_meteo_year_28['line_type'] = 'Dpt 28'
-    df_meteo_mean_27['line_type'] = 'Mean Dpt 27'
-    df_meteo_mean_28['line_type'] = 'Mean Dpt 28'
-
-    # Combine all DataFrames for plotting
-    combined_df = pd.concat([df_meteo_year_27, df_meteo_year_28, df_meteo_mean_27, df_meteo_mean_28])
+def plot_monthly(meteo_column, year, departments):
+    # Department monthly means of the season and climatology, precomputed in the snapshot store (see build_snapshots.py)
+    combined_df = get_snapshot_chart(year, meteo_column, departments)
+    # Single dataset shared by the layers, reduced to the plotted columns and points
+    chart_df = chart_data(combined_df, 'date', [meteo_column], by='line_type')
 
     # Create a combined chart
-    combined_chart = alt.Chart(combined_df).mark_line().encode(
+    combined_chart = alt.Chart().mark_line().encode(
         x=alt.X('date:T', title='Date', axis=alt.Axis(labelAngle=-45)),
         y=alt.Y(f'{meteo_column}:Q', title=meteo_column.capitalize()),
         color='line_type:N'
     )
 
     # Transparent selector across the chart
-    selectors = alt.Chart(combined_df).mark_rule().encode(
+    selectors = alt.Chart().mark_rule().encode(
         x='date:T',
         opacity=alt.value(0),
         tooltip=[alt.Tooltip('date:T', title='Date'), alt.Tooltip(f'{meteo_column}:Q', title=meteo_column.capitalize())]
@@ -48,7 +42,7 @@ def plot_monthly(meteo_column, year, df_meteo, gdf_geom):
     )
 
     # Combine the line chart with selectors
-    chart = alt.layer(combined_chart, selectors).properties(
+    chart = alt.layer(combined_chart, selectors, data=chart_df).properties(
         width=700,
         height=400
     ).interactive()
@@ -56,72 +50,103 @@ def plot_monthly(meteo_column, year, df_meteo, gdf_geom):
     # Display the chart in Streamlit
     st.altair_chart(chart, use_container_width=True)
 
-    return gdf_meteo_year, gdf_meteo_mean
-
-def plot_agri_yield(year):
+def plot_agri_yield(year, departments):
     st.header('Rendements agricoles')
-    agri_df = load_agri_data()
     variable = 'Rendement'
 
-    # Filter DataFrame based on selected variable
-    filtered_df = agri_df[agri_df['variable'] == variable]
-    filtered_df = filtered_df[filtered_df['year'] == year]
-    # Get unique values of 'n6'
-    n6_values = filtered_df['n6'].unique()
+    # Values of the variable, indexed by (n6, dpt, year)
+    filtered_df = get_yields(variable, departments=departments)
+    # Get the values of 'n6' with data for the year
+    n6_values = filtered_df[filtered_df.index.get_level_values('year') == year].index.unique('n6')
 
     # Plotting
     for n6_value in n6_values:
         st.subheader(f"Catégorie: '{n6_value}'")
-        n6_filtered_df = filtered_df[filtered_df['n6'] == n6_value]
 
-        for dpt_value in ['27', '28']:
-            if dpt_value == '27':
-                dpt = 'Eure'
-            else:
-                dpt = 'Eure-et-Loire'
-            st.text(f"Pour le département de l'{dpt}")
-                    
-            dpt_filtered_df = n6_filtered_df[n6_filtered_df['dpt'] == dpt_value]
+        for dpt_value in departments:
+            st.text(f"Pour le département {dpt_value} ({department_name(dpt_value)})")
 
             for kpi in st.columns(1):
                 kpi.metric(
                     label=str(year),
-                    value=dpt_filtered_df.iloc[0]['value']
+                    value=get_yield(variable, n6_value, dpt_value, year)
                 )
 
-def plot_map_snapshot(gdf, meteo_column):
-    # Extract unique months and convert to a readable format
-    unique_months = gdf['date'].dt.strftime('%B %Y').unique()
+def plot_indicators(year, departments):
+    st.header('Indicateurs agro-climatiques')
+    # Indicators of the season per department, and their mean over the complete seasons
+    df_season = get_indicators(year, departments=departments)
+    df_all = get_indicators(departments=departments)
+    df_mean = df_all[df_all['days'] >= 365].groupby(level='DEP').mean()
+
+    df_table = pd.concat({str(year): df_season, 'Moyenne': df_mean}).swaplevel().sort_index()
+    st.dataframe(df_table.round(1))
+
+def plot_map_snapshot(year, meteo_column, departments):
+    # Months of the season and convert to a readable format
+    unique_months = list(get_snapshot_months(year, meteo_column).strftime('%B %Y'))
     # Create a select box for user to choose the month
     selected_month = st.selectbox("Sélectionnez le mois", unique_months)
+    detail = st.radio("Niveau de détail de la carte", list(MAP_TOLERANCES), index=1, horizontal=True)
     # Filter the DataFrame based on the user's selection
     # Convert 'selected_month' back to datetime for comparison
     selected_month_dt = pd.to_datetime(selected_month)
-    filtered_gdf = gdf[gdf['date'].dt.month == selected_month_dt.month]
-    geojson_map = filtered_gdf.drop(columns=['date']).to_json()
-    
-    m = create_map(filtered_gdf, geojson_map, meteo_column)
-
-    folium_static(m, width=725)
+    display = st.radio("Affichage de la carte", MAP_DISPLAYS, horizontal=True)
+    # Only the values of the month (per grid cell) are attached to the precomputed geometry
+    if display == 'Valeurs':
+        filtered_df = get_snapshot(year, selected_month_dt.month, meteo_column)
+        m = create_map(filtered_df, meteo_column, load_map_geometry(detail, departments=departments), thresholds=load_thresholds(meteo_column))
+    elif display == 'Anomalies':
+        # Difference to the monthly climatology, on a scale computed from the anomalies of the month
+        filtered_df = get_snapshot_anomaly(year, selected_month_dt.month, meteo_column)
+        thresholds = compute_thresholds(filtered_df[meteo_column].to_numpy(), method='range')
+        if len(thresholds) <= 3:
+            # Anomalies too close to each other for the rounded bins, on a scale centred on 0
+            thresholds = symmetric_thresholds(filtered_df[meteo_column].to_numpy())
+        m = create_map(filtered_df, meteo_column, load_map_geometry(detail, departments=departments), thresholds=thresholds)
+    else:
+        # Days of the month in an extreme event (percentiles of the calendar day over all years)
+        event = st.selectbox("Sélectionnez l'événement", list(EVENTS))
+        filtered_df = get_event_days(year, selected_month_dt.month, event)
+        m = create_map(filtered_df, event, load_map_geometry(detail, departments=departments), thresholds=EVENT_DAYS_THRESHOLDS)
+
+    # Serialization of the map (GeoJSON included) to HTML and its sending to the browser
+    with stage('folium_static'):
+        folium_static(m, width=725)
 
 
 def main():
+    start_run('3_Year_snapshot')
     st.title('Dashboard snapshot sur une année')
-    df_meteo = load_meteo_data()
-    gdf_geom = load_communes_geometry()
+
+    # Only the partitions of the selected departments are loaded
+    departments = sidebar_departments()
+    if not departments:
+        st.info("Sélectionnez au moins un département")
+        return
 
     # User input for the year
-    year = st.number_input("Sélectionnez l'année", min_value=2000, max_value=2021, value=2020)
+    first_season, last_season = get_seasons()
+    year = st.number_input("Sélectionnez l'année", min_value=first_season, max_value=last_season, value=min(2020, last_season))
 
     # Selector for the meteorological data column
     meteo_column = st.selectbox("Sélectionnez la variable météorologique à afficher", 
                                 METEOROLOGICAL_COLUMNS)
 
-    plot_agri_yield(year=year)
-    
-    gdf_meteo_year, gdf_meteo_mean = plot_monthly(meteo_column, year, df_meteo=df_meteo, gdf_geom=gdf_geom)
+    with stage('plot_agri_yield', year=year):
+        plot_agri_yield(year=year, departments=departments)
+
+    with stage('plot_indicators', year=year):
+        plot_indicators(year=year, departments=departments)
+
+    with stage('plot_monthly', year=year, variable=meteo_column):
+        plot_monthly(meteo_column, year, departments)
+
+    with stage('plot_map_snapshot', year=year, variable=meteo_column):
+        plot_map_snapshot(year, meteo_column, departments)
 
-    plot_map_snapshot(gdf_meteo_year, meteo_column)
+    sidebar_context_stats()
+    sidebar_profile()
 
     
 
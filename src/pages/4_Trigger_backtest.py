@@ -0,0 +1,91 @@
+import streamlit as st
+import altair as alt
+from utils.backtest import DIRECTIONS, LOSS_THRESHOLD
+from utils.departments import department_name
+from utils.queries import get_backtest, get_trigger_history
+from utils.sidebar import sidebar_context_stats, sidebar_departments, sidebar_profile
+from utils.profiling import stage, start_run
+
+METRICS = ['hit_rate', 'false_alarm_rate', 'basis_risk', 'payout_basis_risk', 'expected_payout']
+
+def plot_best_triggers(df_backtest, n):
+    # Triggers with the lowest basis risk, the hit rate deciding between ties
+    st.subheader(f"Les {n} meilleurs déclencheurs (risque de base le plus faible)")
+    df_best = df_backtest.sort_values(['basis_risk', 'hit_rate'], ascending=[True, False]).head(n)
+    st.dataframe(df_best.drop(columns=['n6', 'dpt']).round(3))
+
+def plot_payout_curve(df_trigger, indicator, direction):
+    # Metrics of the trigger along its threshold grid
+    st.subheader(f"Courbes du déclencheur '{indicator}' ({direction})")
+    df_chart = df_trigger.melt(id_vars=['threshold'], value_vars=METRICS, var_name='metric')
+    chart = alt.Chart(df_chart).mark_line(point=True).encode(
+        x=alt.X('threshold:Q', title='Seuil'),
+        y=alt.Y('value:Q', title='Valeur'),
+        color=alt.Color('metric:N', legend=alt.Legend(title='Métrique')),
+        tooltip=['threshold:Q', 'metric:N', alt.Tooltip('value:Q', format='.2f')]
+    ).properties(width=700, height=400).interactive()
+    st.altair_chart(chart, use_container_width=True)
+
+def plot_history(n6, dpt, indicator, threshold, loss_threshold):
+    # Indicator against the yield loss of each season, with the selected threshold and the loss threshold
+    st.subheader("Historique des saisons")
+    df_history = get_trigger_history(n6, dpt, indicator).reset_index()
+    points = alt.Chart(df_history).mark_circle(size=80).encode(
+        x=alt.X(f'{indicator}:Q', title=indicator, scale=alt.Scale(zero=False)),
+        y=alt.Y('loss:Q', title='Perte de rendement (vs tendance)', axis=alt.Axis(format='%')),
+        tooltip=['year:O', alt.Tooltip(f'{indicator}:Q', format='.1f'), 'yield:Q', alt.Tooltip('loss:Q', format='.1%')]
+    )
+    threshold_rule = alt.Chart().mark_rule(color='red').encode(x=alt.datum(threshold))
+    loss_rule = alt.Chart().mark_rule(color='gray', strokeDash=[4, 4]).encode(y=alt.datum(loss_threshold))
+    st.altair_chart(alt.layer(points, threshold_rule, loss_rule).properties(width=700, height=400), use_container_width=True)
+
+
+def main():
+    start_run('4_Trigger_backtest')
+    st.title('Backtest des déclencheurs paramétriques')
+
+    # Only the departments selected in the sidebar are backtested
+    departments = sidebar_departments()
+    if not departments:
+        st.info("Sélectionnez au moins un département")
+        return
+
+    loss_threshold = st.slider("Perte de rendement sous la tendance définissant un sinistre", 0.05, 0.3, LOSS_THRESHOLD, 0.05)
+    with stage('backtest', loss_threshold=loss_threshold):
+        df_all = get_backtest(loss_threshold=loss_threshold, departments=departments)
+    if df_all.empty:
+        st.warning("Aucun rendement à confronter aux indicateurs agro-climatiques")
+        return
+
+    n6 = st.selectbox("Sélectionnez la catégorie", sorted(df_all['n6'].unique()))
+    # Selected departments with yields of the category
+    dpt_values = [dpt for dpt in departments if dpt in set(df_all.loc[df_all['n6'] == n6, 'dpt'])]
+    if not dpt_values:
+        st.warning("Aucun des départements sélectionnés n'a de rendements pour cette catégorie")
+        return
+    dpt = st.selectbox("Sélectionnez le département", dpt_values, format_func=lambda dpt: f"{dpt} - {department_name(dpt)}")
+    df_backtest = df_all[(df_all['n6'] == n6) & (df_all['dpt'] == dpt)]
+    st.text(f"{len(df_backtest)} déclencheurs évalués sur {df_backtest['n_seasons'].iloc[0]} saisons, "
+            f"dont {df_backtest['n_losses'].iloc[0]} sinistrées")
+
+    with stage('best_triggers'):
+        plot_best_triggers(df_backtest, st.slider("Nombre de déclencheurs à afficher", 5, 50, 10))
+
+    indicator = st.selectbox("Sélectionnez l'indicateur", list(df_backtest['indicator'].unique()))
+    direction = st.radio("Déclenchement", list(DIRECTIONS), horizontal=True,
+                         format_func={'above': 'Au-dessus du seuil', 'below': 'En dessous du seuil'}.get)
+    df_trigger = df_backtest[(df_backtest['indicator'] == indicator) & (df_backtest['direction'] == direction)]
+    with stage('payout_curve', indicator=indicator):
+        plot_payout_curve(df_trigger, indicator, direction)
+
+    threshold = st.select_slider("Seuil", options=list(df_trigger['threshold'].round(2)),
+                                 value=round(df_trigger.loc[df_trigger['basis_risk'].idxmin(), 'threshold'], 2))
+    with stage('history', indicator=indicator):
+        plot_history(n6, dpt, indicator, threshold, loss_threshold)
+
+    sidebar_context_stats()
+    sidebar_profile()
+
+
+if __name__ == '__main__':
+    main()
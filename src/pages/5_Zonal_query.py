@@ -0,0 +1,104 @@
+import json
+
+import streamlit as st
+import altair as alt
+import folium
+import geopandas as gpd
+from folium.plugins import Draw
+from shapely.geometry import box
+from streamlit_folium import st_folium
+from utils.grid import AREA_CRS
+from utils.meteo import season_dates
+from utils.queries import get_seasons, get_zone_series, get_zone_weights
+from utils.sidebar import sidebar_context_stats, sidebar_profile
+from utils.profiling import stage, start_run
+from utils.zones import ZONE_CRS, ZONE_FREQS, load_zone_cells
+
+METEOROLOGICAL_COLUMNS = ['precipitation', 'r_min', 'ssrd_mean', 'Tmax', 'Tavg', 'Tmin', 'ws10_mean']
+ZONE_INPUTS = ['Dessiner', 'Importer un GeoJSON', 'Communes (INSEE)', 'Site et rayon']
+
+def grid_center():
+    # Center of the ERA5 grid, in the CRS of the map
+    bounds = gpd.GeoSeries([box(*load_zone_cells().total_bounds)], crs=AREA_CRS).to_crs(ZONE_CRS).iloc[0]
+    return [bounds.centroid.y, bounds.centroid.x]
+
+def zone_input():
+    # Zone arguments of the queries (see zones.resolve_zone), None until a zone is given
+    mode = st.radio("Définition de la zone", ZONE_INPUTS, horizontal=True)
+    if mode == 'Dessiner':
+        m = folium.Map(location=grid_center(), zoom_start=7)
+        Draw(draw_options={'polyline': False, 'marker': False, 'circlemarker': False}, export=False).add_to(m)
+        with stage('st_folium'):
+            drawing = st_folium(m, width=725, height=450, returned_objects=['all_drawings'])
+        drawings = (drawing or {}).get('all_drawings') or []
+        return {'geojson': {'type': 'FeatureCollection', 'features': drawings}} if drawings else None
+    if mode == 'Importer un GeoJSON':
+        uploaded = st.file_uploader("Fichier GeoJSON (longitude, latitude)", type=['geojson', 'json'])
+        return {'geojson': json.load(uploaded)} if uploaded is not None else None
+    if mode == 'Communes (INSEE)':
+        codes = st.text_input("Codes INSEE séparés par des virgules", placeholder="27229, 28085")
+        insee = [code.strip() for code in codes.split(',') if code.strip()]
+        return {'insee': insee} if insee else None
+    longitude = st.number_input("Longitude", value=1.5, format="%.4f")
+    latitude = st.number_input("Latitude", value=48.9, format="%.4f")
+    radius_km = st.slider("Rayon (km)", 1, 100, 20)
+    return {'longitude': longitude, 'latitude': latitude, 'radius_km': float(radius_km)}
+
+def plot_zone(df_weights):
+    # Grid points of the zone, sized by their weight (area share of the zone)
+    st.subheader(f"{len(df_weights)} points de grille ERA5 dans la zone")
+    m = folium.Map(location=[df_weights['latitude'].mean(), df_weights['longitude'].mean()], zoom_start=9)
+    for row in df_weights.itertuples():
+        folium.CircleMarker([row.latitude, row.longitude], radius=3 + 12 * row.weight, fill=True,
+                            tooltip=f"Poids : {row.weight:.1%}").add_to(m)
+    with stage('st_folium_zone'):
+        st_folium(m, width=725, height=350, returned_objects=[], key='zone_map')
+
+def plot_series(df_series, variables):
+    # Weighted averages of the zone
+    df_chart = df_series.reset_index().melt(id_vars=['date'], value_vars=variables, var_name='variable')
+    chart = alt.Chart(df_chart).mark_line().encode(
+        x=alt.X('date:T', title='Date'),
+        y=alt.Y('value:Q', title='Valeur'),
+        color=alt.Color('variable:N', legend=alt.Legend(title='Variable')),
+        tooltip=['date:T', 'variable:N', alt.Tooltip('value:Q', format='.2f')]
+    ).properties(width=700, height=400).interactive()
+    st.altair_chart(chart, use_container_width=True)
+
+
+def main():
+    start_run('5_Zonal_query')
+    st.title('Requête météo sur une zone')
+
+    zone = zone_input()
+    variables = st.multiselect("Variables météorologiques", METEOROLOGICAL_COLUMNS, default=['Tavg', 'precipitation'])
+    first_season, last_season = get_seasons()
+    first_date, last_date = season_dates(first_season)[0].date(), season_dates(last_season)[1].date()
+    dates = st.date_input("Période", value=(season_dates(last_season)[0].date(), last_date), min_value=first_date, max_value=last_date)
+    freq = st.radio("Fréquence", list(ZONE_FREQS), horizontal=True, format_func={'daily': 'Journalière', 'monthly': 'Mensuelle'}.get)
+    if zone is None or not variables or len(dates) != 2:
+        st.info("Définissez une zone, au moins une variable et une période")
+        return
+
+    try:
+        with stage('zone_weights'):
+            df_weights = get_zone_weights(**zone)
+        with stage('zone_series', freq=freq):
+            df_series = get_zone_series(variables, str(dates[0]), str(dates[1]), freq, **zone)
+    except (KeyError, ValueError) as error:
+        # Unknown communes, zone outside of the grid, invalid GeoJSON...
+        st.error(f"Zone invalide : {error}")
+        return
+
+    plot_zone(df_weights)
+    with stage('plot_series'):
+        plot_series(df_series, variables)
+    st.dataframe(df_series.round(2))
+    st.download_button("Télécharger (CSV)", df_series.to_csv(), file_name='zone_series.csv', mime='text/csv')
+
+    sidebar_context_stats()
+    sidebar_profile()
+
+
+if __name__ == '__main__':
+    main()
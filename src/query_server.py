@@ -0,0 +1,144 @@
+"""Serves the query layer (utils/queries.py) as JSON over HTTP, one thread per request
+
+Run from the src folder (data read from ../data):
+    python query_server.py --port 8502
+
+Each query is a path with its arguments as query parameters, e.g.
+    /department_series?variable=Tavg&season=2020&freq=daily&departments=27,28
+    /snapshot?season=2020&month=1&variable=precipitation
+    /zone_series?variables=Tavg,precipitation&longitude=1.5&latitude=48.5&radius_km=20&freq=monthly
+Frames are returned as lists of records, with ISO dates.
+"""
+import argparse
+import inspect
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from utils.data_extraction import check_departments
+from utils.queries import (get_backtest, get_department_series, get_event_days, get_event_series, get_indicators,
+                           get_lowest_yields, get_percentile_series, get_seasons, get_series, get_snapshot,
+                           get_snapshot_anomaly, get_snapshot_chart, get_snapshot_months, get_trigger_history,
+                           get_yield, get_yield_variables, get_yields, get_zone_series, get_zone_weights)
+
+logger = logging.getLogger(__name__)
+
+
+def comma_list(value):
+    """Parameter given as comma-separated values, e.g. variables=Tavg,precipitation"""
+    return value.split(",")
+
+
+# Parameters of an ad-hoc zone, see zones.resolve_zone
+ZONE_PARAMETERS = {"wkt": str, "geojson": json.loads, "insee": comma_list, "longitude": float, "latitude": float, "radius_km": float}
+
+# Path -> (query, type of each parameter), parameters with a default in the query are optional
+QUERIES = {
+    "/seasons": (get_seasons, {}),
+    "/series": (get_series, {"variable": str, "season": int, "freq": str, "level": str, "departments": comma_list}),
+    "/department_series": (get_department_series, {"variable": str, "season": int, "freq": str, "departments": comma_list}),
+    "/snapshot": (get_snapshot, {"season": int, "month": int, "variable": str}),
+    "/snapshot_chart": (get_snapshot_chart, {"season": int, "variable": str, "departments": comma_list}),
+    "/snapshot_months": (get_snapshot_months, {"season": int, "variable": str}),
+    "/percentile_series": (get_percentile_series, {"variable": str, "season": int, "level": str}),
+    "/event_series": (get_event_series, {"season": int}),
+    "/event_days": (get_event_days, {"season": int, "month": int, "event": str}),
+    "/snapshot_anomaly": (get_snapshot_anomaly, {"season": int, "month": int, "variable": str}),
+    "/indicators": (get_indicators, {"season": int, "level": str, "departments": comma_list}),
+    "/backtest": (get_backtest, {"n6": str, "dpt": str, "loss_threshold": float, "departments": comma_list}),
+    "/trigger_history": (get_trigger_history, {"n6": str, "dpt": str, "indicator": str}),
+    "/zone_series": (get_zone_series, {"variables": comma_list, "start_date": str, "end_date": str, "freq": str, **ZONE_PARAMETERS}),
+    "/zone_weights": (get_zone_weights, ZONE_PARAMETERS),
+    "/yield_variables": (get_yield_variables, {"departments": comma_list}),
+    "/yields": (get_yields, {"variable": str, "n6": str, "dpt": str, "departments": comma_list}),
+    "/yield": (get_yield, {"variable": str, "n6": str, "dpt": str, "year": int}),
+    "/lowest_yields": (get_lowest_yields, {"variable": str, "n6": str, "dpt": str, "n": int}),
+}
+
+
+def to_json(result):
+    """JSON document of a query result (frame, series, index, tuple or scalar)"""
+    if isinstance(result, pd.Series):
+        result = result.reset_index()
+    if isinstance(result, pd.DataFrame):
+        if any(name is not None for name in result.index.names):
+            # Named index levels (e.g. 'id' or 'year') are returned as fields of the records
+            result = result.reset_index()
+        return result.to_json(orient="records", date_format="iso")
+    if isinstance(result, pd.Index):
+        return pd.Series(result).to_json(orient="values", date_format="iso")
+    if isinstance(result, np.generic):
+        result = result.item()
+    return json.dumps(result)
+
+
+def query_arguments(query, types, query_parameters):
+    """Arguments of a query from the parameters of its URL (parse_qs), the last value of a repeated parameter wins
+
+    Raises:
+        TypeError: if a parameter is unknown or a parameter without default is missing
+        ValueError: if a value cannot be converted to the type of its parameter
+    """
+    parameters = {name: values[-1] for name, values in query_parameters.items()}
+    unknown = set(parameters) - set(types)
+    if unknown:
+        raise TypeError(f"Unknown parameters {sorted(unknown)}")
+    arguments = {}
+    for name, value in parameters.items():
+        try:
+            arguments[name] = types[name](value)
+        except ValueError as error:
+            raise ValueError(f"Invalid parameter {name}={value!r}: {error}") from error
+    inspect.signature(query).bind(**arguments)
+    return arguments
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in QUERIES:
+            self._send(404, json.dumps({"error": f"Unknown query {url.path}", "queries": sorted(QUERIES)}))
+            return
+        query, types = QUERIES[url.path]
+        try:
+            arguments = query_arguments(query, types, parse_qs(url.query))
+        except (TypeError, ValueError) as error:
+            # Unknown, missing or invalid parameters
+            self._send(400, json.dumps({"error": str(error)}))
+            return
+        try:
+            result = query(**arguments)
+        except Exception as error:
+            logger.exception("Query %s failed", self.path)
+            self._send(500, json.dumps({"error": f"{type(error).__name__}: {error}"}))
+            return
+        self._send(200, to_json(result))
+
+    def _send(self, status, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+    check_departments()
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    print(f"Serving {len(QUERIES)} queries on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,25 @@ from shapely.ops import nearest_points
 import folium
 from folium.features import GeoJsonTooltip
 from utils.maps import create_map
-from utils.data_extraction import load_communes_geometry, load_meteo_data_date
+from utils.data_extraction import check_departments, load_communes_geometry, load_meteo_data_date
+from utils.departments import DEPARTMENTS, department_name
 
 
-APP_TITLE = "Agricultural Yields in Eure and Eure-et-Loire Report"
+if len(DEPARTMENTS) <= 2:
+    APP_TITLE = f"Agricultural Yields in {' and '.join(map(department_name, DEPARTMENTS))} Report"
+else:
+    APP_TITLE = f"Agricultural Yields in {len(DEPARTMENTS)} Departments Report"
 APP_SUB_TITLE = "AXA Climate Process Project"
 
 if __name__ == "__main__":
     st.set_page_config(APP_TITLE)
     st.title(APP_TITLE)
     st.caption(APP_SUB_TITLE)
+    try:
+        check_departments()
+    except ValueError as error:
+        # Misconfigured DEPARTMENTS environment variable
+        st.error(str(error))
+        st.stop()
 
     st.subheader('Welcome to the Streamlit app of this project, feel free to dive in each page of the app: the first one explores agricultural yields in the past 20 years, the second explores meteorological data and the third one explore each year one by one!')
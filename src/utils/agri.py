@@ -0,0 +1,150 @@
+import logging
+import os
+
+import pandas as pd
+from utils.artifacts import ARTIFACTS_DIR, artifact_path, artifacts_key, hash_path, read_artifact, write_artifact
+from utils.departments import DEPARTMENTS, partition_dir
+
+logger = logging.getLogger(__name__)
+
+AGRI_PATH = "../data/agreste.csv"
+# Columns of the agreste CSV used by the app, and the index of the yield table
+AGRI_COLUMNS = ["n6", "dpt", "variable", "year", "value"]
+AGRI_INDEX = ["variable", "n6", "dpt", "year"]
+AGRI_DTYPES = {"n6": str, "dpt": str, "variable": str, "year": "int16", "value": "float64"}
+# Rows of the CSV parsed at once
+AGRI_CHUNK_SIZE = 100_000
+# Bumped when the content of the agri artifacts changes, to rebuild them
+AGRI_VERSION = 2
+
+
+def _categorical(values):
+    # Categories in their order of appearance in the file, so that sorting by them keeps that order
+    return values.astype(pd.CategoricalDtype(pd.unique(values)))
+
+
+def _categoricals(df_agri):
+    for column in ("n6", "dpt", "variable"):
+        df_agri[column] = _categorical(df_agri[column].astype(str))
+    return df_agri
+
+
+def read_agri_data(path=AGRI_PATH, departments=DEPARTMENTS, chunksize=AGRI_CHUNK_SIZE):
+    """Reads the agreste data of some departments, with only the columns used by the app
+
+    The CSV is parsed by chunks, each one filtered on the departments before the next is read, so
+    the memory used follows the kept rows rather than the national file.
+
+    Args:
+        path (str): agreste CSV (national)
+        departments (tuple): departments ('dpt') to keep
+        chunksize (int): rows parsed at once
+
+    Returns:
+        pd.DataFrame: 'n6', 'dpt', 'variable' (categorical), 'year' and 'value'
+    """
+    departments = list(departments)
+    n_scanned = 0
+    chunks = []
+    for chunk in pd.read_csv(path, usecols=AGRI_COLUMNS, dtype=AGRI_DTYPES, chunksize=chunksize):
+        n_scanned += len(chunk)
+        chunks.append(chunk[chunk["dpt"].isin(departments)])
+    df_agri = pd.concat(chunks, ignore_index=True)
+    logger.info("%s: %d rows scanned, %d kept for departments %s", path, n_scanned, len(df_agri), ", ".join(departments))
+    return _categoricals(df_agri)[AGRI_COLUMNS]
+
+
+def agri_key(path=AGRI_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Key of the agri partitions: content hash of the CSV"""
+    return artifacts_key(hash_path(path, artifacts_dir=artifacts_dir), version=AGRI_VERSION)
+
+
+def build_agri_partitions(path=AGRI_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Splits the agreste data into per-department partitions, in a single pass over the CSV
+
+    Each department gets, in its partition folder (see departments.partition_dir):
+    - 'agri_data': its rows, see read_agri_data
+    - 'agri_index': its values indexed by (variable, n6, dpt, year), sorted so that selecting a variable,
+      a category or a year is a binary search instead of a scan of string columns
+
+    Returns:
+        str: key of the written partitions
+    """
+    key = agri_key(path, artifacts_dir)
+    df_agri = read_agri_data(path, departments)
+    for dpt in departments:
+        df_partition = _categoricals(df_agri[df_agri["dpt"] == dpt].reset_index(drop=True))
+        write_artifact(df_partition, "agri_data", key, artifacts_dir=partition_dir(dpt, artifacts_dir))
+        write_artifact(df_partition.set_index(AGRI_INDEX).sort_index(), "agri_index", key, artifacts_dir=partition_dir(dpt, artifacts_dir))
+    return key
+
+
+def read_agri_partitions(name, path=AGRI_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Reads the 'agri_data' or 'agri_index' partition of each department, see build_agri_partitions
+
+    The missing partitions (first use of a department, or changed CSV) are built together, in a
+    single pass over the CSV.
+
+    Returns:
+        list: partition of each department
+    """
+    key = agri_key(path, artifacts_dir)
+    missing = [dpt for dpt in departments if not os.path.exists(artifact_path(name, key, partition_dir(dpt, artifacts_dir)))]
+    if missing:
+        build_agri_partitions(path, missing, artifacts_dir)
+    return [read_artifact(name, key, artifacts_dir=partition_dir(dpt, artifacts_dir)) for dpt in departments]
+
+
+def get_agri_data(path=AGRI_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Reads the agreste data of the departments from their 'agri_data' partitions"""
+    partitions = read_agri_partitions("agri_data", path, departments, artifacts_dir)
+    if len(partitions) == 1:
+        return partitions[0]
+    return _categoricals(pd.concat(partitions, ignore_index=True))
+
+
+def get_agri_index(path=AGRI_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Reads the agreste values of the departments indexed by (variable, n6, dpt, year), see build_agri_partitions
+
+    The index of a single department is its partition, those of several departments are merged and sorted.
+    """
+    if len(departments) == 1:
+        return read_agri_partitions("agri_index", path, departments, artifacts_dir)[0]
+    return get_agri_data(path, departments, artifacts_dir).set_index(AGRI_INDEX).sort_index()
+
+
+def agri_values(df_index, variable, n6=None, dpt=None):
+    """Values of a variable, optionally of a category ('n6') and of a department, from the agri index
+
+    Returns:
+        pd.DataFrame: 'value' indexed by the remaining levels of AGRI_INDEX (e.g. 'year'), empty if missing
+    """
+    if n6 is None and dpt is not None:
+        # Department of every category: not a prefix of the index, selected on the slice of the variable
+        df_variable = agri_values(df_index, variable)
+        try:
+            return df_variable.xs(dpt, level="dpt")
+        except KeyError:
+            return df_variable.iloc[:0].droplevel("dpt")
+    key = (variable,) + tuple(level for level in (n6, dpt) if level is not None)
+    try:
+        return df_index.loc[key]
+    except KeyError:
+        return df_index.iloc[:0].droplevel(list(range(len(key))))
+
+
+def agri_value(df_index, variable, n6, dpt, year):
+    """Value of a variable for a category, a department and a year, None if missing"""
+    try:
+        return df_index.at[(variable, n6, dpt, year), "value"]
+    except KeyError:
+        return None
+
+
+def lowest_values(df_index, variable, n6, dpt, n):
+    """n lowest values (worst years) of a variable for a category and a department
+
+    Returns:
+        pd.Series: values indexed by 'year', in increasing order
+    """
+    return agri_values(df_index, variable, n6, dpt)["value"].nsmallest(n)
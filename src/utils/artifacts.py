@@ -0,0 +1,121 @@
+import glob
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+ARTIFACTS_DIR = "../data/artifacts/"
+HASH_CACHE_FILE = "input_hashes.json"
+CHUNK_SIZE = 1 << 20
+
+
+def _file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _path_files(path):
+    # (relative path, absolute path) of the file, or of every file of the folder
+    if not os.path.isdir(path):
+        return [(os.path.basename(path), os.path.abspath(path))]
+    files = sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True))
+    return [(os.path.relpath(f, path), os.path.abspath(f)) for f in files if os.path.isfile(f)]
+
+
+def hash_path(path, artifacts_dir=ARTIFACTS_DIR):
+    """Computes the content hash of a file, or of every file of a folder (e.g. a shapefile)
+
+    The hash of each file is remembered in the artifacts folder along with its size and
+    modification time, so that unchanged files are not read again: on the next start, or when
+    files are appended to a folder (e.g. the partitioned ERA5 data), only the new ones are read.
+
+    Args:
+        path (str): file or folder
+        artifacts_dir (str): folder where the known hashes are stored
+
+    Returns:
+        str: sha1 hex digest of the content
+    """
+    hash_cache_path = os.path.join(artifacts_dir, HASH_CACHE_FILE)
+    hash_cache = {}
+    if os.path.exists(hash_cache_path):
+        with open(hash_cache_path) as f:
+            hash_cache = json.load(f)
+
+    sha1 = hashlib.sha1()
+    changed = False
+    for relative_path, file_path in _path_files(path):
+        stat = [os.path.getsize(file_path), os.stat(file_path).st_mtime_ns]
+        if file_path not in hash_cache or hash_cache[file_path]["stat"] != stat:
+            hash_cache[file_path] = {"stat": stat, "sha1": _file_sha1(file_path)}
+            changed = True
+        sha1.update(relative_path.encode())
+        sha1.update(hash_cache[file_path]["sha1"].encode())
+
+    if changed:
+        os.makedirs(artifacts_dir, exist_ok=True)
+        tmp_path = f"{hash_cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(hash_cache, f)
+        os.replace(tmp_path, hash_cache_path)
+
+    return sha1.hexdigest()
+
+
+def hash_grid(gdf_grid):
+    """Computes the content hash of the meteorological grid (coordinates and ids)"""
+    sha1 = hashlib.sha1()
+    for values in (gdf_grid.geometry.x, gdf_grid.geometry.y, gdf_grid["id"]):
+        sha1.update(np.ascontiguousarray(values.to_numpy(dtype="float64")).tobytes())
+    return sha1.hexdigest()
+
+
+def artifacts_key(*hashes, **params):
+    """Combines input hashes and build parameters into a short artifact key"""
+    sha1 = hashlib.sha1()
+    for value in hashes:
+        sha1.update(value.encode())
+    sha1.update(json.dumps(params, sort_keys=True).encode())
+    return sha1.hexdigest()[:16]
+
+
+def artifact_path(name, key, artifacts_dir=ARTIFACTS_DIR):
+    return os.path.join(artifacts_dir, f"{name}_{key}.parquet")
+
+
+def write_artifact(df, name, key, artifacts_dir=ARTIFACTS_DIR):
+    """Writes a (Geo)DataFrame artifact and removes the stale versions of it
+
+    The file is written under a temporary name then renamed, so that a concurrent reader
+    never sees a partial file.
+
+    Returns:
+        str: path of the written artifact
+    """
+    os.makedirs(artifacts_dir, exist_ok=True)
+    path = artifact_path(name, key, artifacts_dir=artifacts_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+    for stale_path in glob.glob(artifact_path(name, "*", artifacts_dir=artifacts_dir)):
+        if stale_path != path:
+            os.remove(stale_path)
+
+    return path
+
+
+def read_artifact(name, key, artifacts_dir=ARTIFACTS_DIR, geo=False, columns=None):
+    """Reads an artifact (memory-mapped), or returns None if it was not built for this key"""
+    path = artifact_path(name, key, artifacts_dir=artifacts_dir)
+    if not os.path.exists(path):
+        return None
+    if geo:
+        return gpd.read_parquet(path, columns=columns, memory_map=True)
+    return pd.read_parquet(path, columns=columns, memory_map=True)
@@ -0,0 +1,230 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from utils.agri import AGRI_PATH, agri_values
+from utils.artifacts import ARTIFACTS_DIR
+from utils.context import shared_data
+from utils.data_extraction import load_agri_index
+from utils.departments import DEPARTMENTS
+from utils.era5 import ERA5_PATH, meteo_version
+from utils.indicators import load_indicators
+from utils.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Yield variable of the agreste data the triggers are tested against
+YIELD_VARIABLE = "Rendement"
+# A season is a loss when the yield is below its trend by more than this fraction
+LOSS_THRESHOLD = 0.1
+# Thresholds tested per indicator: quantiles of the indicator over the seasons, from 5% to 95%
+N_THRESHOLDS = 19
+# A trigger fires when the indicator is above or below the threshold
+DIRECTIONS = ("above", "below")
+# Payout: from 0 at the threshold to 1 at PAYOUT_SPREAD standard deviations of the indicator beyond it
+PAYOUT_SPREAD = 1.
+# Seasons with fewer days of weather data are partial, not backtested
+MIN_SEASON_DAYS = 365
+# Processes of the backtests of the app and the query server, one per CPU by default (1 evaluates in the calling process)
+BACKTEST_WORKERS = int(os.environ.get("BACKTEST_WORKERS", os.cpu_count() or 1))
+# (crop, department) pairs with fewer seasons of both yields and indicators are not backtested
+MIN_COMMON_SEASONS = 3
+
+
+def yield_losses(years, yields):
+    """Relative shortfall of the yields below their linear trend (0 when above the trend)
+
+    Args:
+        years (np.ndarray): harvest years
+        yields (np.ndarray): yields of the years
+
+    Returns:
+        np.ndarray: loss fraction of each year, in [0, 1]
+    """
+    trend = np.polyval(np.polyfit(years, yields, 1), years) if len(years) > 2 else np.full(len(years), np.mean(yields))
+    return np.clip(1. - yields / trend, 0., 1.)
+
+
+def threshold_grid(index_values, n_thresholds=N_THRESHOLDS):
+    """Thresholds tested for each indicator: quantiles of its values, from 5% to 95%
+
+    Args:
+        index_values (np.ndarray): [indicator, season] values
+
+    Returns:
+        (np.ndarray, np.ndarray): quantile levels [threshold] and thresholds [indicator, threshold]
+    """
+    levels = np.linspace(0.05, 0.95, n_thresholds)
+    return levels, np.quantile(index_values, levels, axis=1).T
+
+
+def evaluate_triggers(index_values, losses, thresholds, loss_threshold=LOSS_THRESHOLD, payout_spread=PAYOUT_SPREAD):
+    """Evaluates every (indicator, threshold, direction) trigger at once, broadcasting over the seasons
+
+    - 'hit_rate': share of the loss seasons in which the trigger fires
+    - 'false_alarm_rate': share of the triggered seasons without loss
+    - 'basis_risk': share of the seasons in which the trigger and the loss disagree
+    - 'payout_basis_risk': mean absolute difference between the payout and the loss fraction
+    - 'expected_payout': mean payout per season, the payout growing linearly from 0 at the threshold to 1
+      at payout_spread standard deviations of the indicator beyond it
+
+    Args:
+        index_values (np.ndarray): [indicator, season] values of the weather indices
+        losses (np.ndarray): [season] loss fractions, see yield_losses
+        thresholds (np.ndarray): [indicator, threshold] thresholds, see threshold_grid
+
+    Returns:
+        dict: metric -> [direction, indicator, threshold] array, directions in the order of DIRECTIONS
+    """
+    values = index_values[:, None, :]
+    # Distance beyond the threshold, positive when the trigger fires: [direction, indicator, threshold, season]
+    beyond = np.stack([values - thresholds[:, :, None], thresholds[:, :, None] - values])
+    triggered = beyond >= 0
+    loss = losses > loss_threshold
+
+    spread = payout_spread * index_values.std(axis=1)[:, None, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        payouts = np.where(triggered, np.clip(np.where(spread > 0, beyond / spread, 1.), 0., 1.), 0.)
+        n_triggers = triggered.sum(axis=-1)
+        n_hits = (triggered & loss).sum(axis=-1)
+        return {
+            "n_triggers": n_triggers,
+            "hit_rate": n_hits / loss.sum() if loss.any() else np.full(n_triggers.shape, np.nan),
+            "false_alarm_rate": np.where(n_triggers > 0, (n_triggers - n_hits) / n_triggers, np.nan),
+            "basis_risk": (triggered != loss).mean(axis=-1),
+            "payout_basis_risk": np.abs(payouts - losses).mean(axis=-1),
+            "expected_payout": payouts.mean(axis=-1),
+        }
+
+
+def backtest_zone(years, yields, seasons, index_values, indicators, loss_threshold=LOSS_THRESHOLD, n_thresholds=N_THRESHOLDS):
+    """Backtests every trigger of the indicators against the yields of a crop in a department
+
+    Args:
+        years (np.ndarray): harvest years of the yields
+        yields (np.ndarray): yields of the years
+        seasons (np.ndarray): seasons of the indicator values
+        index_values (np.ndarray): [indicator, season] values
+        indicators (list): names of the indicators
+
+    Returns:
+        dict: column -> array of one row per (direction, indicator, threshold), see evaluate_triggers
+    """
+    common, year_positions, season_positions = np.intersect1d(years, seasons, return_indices=True)
+    index_values = index_values[:, season_positions]
+    losses = yield_losses(common, yields[year_positions])
+    levels, thresholds = threshold_grid(index_values, n_thresholds)
+    metrics = evaluate_triggers(index_values, losses, thresholds, loss_threshold)
+
+    shape = metrics["basis_risk"].shape
+    # Indicators and directions as categoricals, built from their codes
+    columns = {
+        "indicator": pd.Categorical.from_codes(np.broadcast_to(np.arange(len(indicators))[None, :, None], shape).ravel(), indicators),
+        "direction": pd.Categorical.from_codes(np.broadcast_to(np.arange(len(DIRECTIONS))[:, None, None], shape).ravel(), DIRECTIONS),
+        "quantile": np.broadcast_to(levels[None, None, :], shape).ravel(),
+        "threshold": np.broadcast_to(thresholds[None], shape).ravel(),
+    }
+    columns.update({metric: values.ravel() for metric, values in metrics.items()})
+    columns["n_seasons"] = np.full(columns["threshold"].shape, len(common))
+    columns["n_losses"] = np.full(columns["threshold"].shape, int((losses > loss_threshold).sum()))
+    return columns
+
+
+def trigger_history(n6, dpt, indicator, variable=YIELD_VARIABLE, path_agri=AGRI_PATH, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Values of an indicator and yields of a crop in a department over the backtested seasons
+
+    Returns:
+        pd.DataFrame: the indicator, 'yield' and 'loss' (see yield_losses) indexed by 'year'
+    """
+    df_yield = agri_values(load_agri_index(path_agri, (dpt,)), variable, n6, dpt)["value"].dropna()
+    df_indicators = load_indicators("dpt", path_meteo=path_meteo, artifacts_dir=artifacts_dir).loc[dpt]
+    df_indicators = df_indicators[df_indicators["days"] >= MIN_SEASON_DAYS]
+    years = df_yield.index.intersection(df_indicators.index)
+
+    df_history = pd.DataFrame({indicator: df_indicators.loc[years, indicator].to_numpy(), "yield": df_yield.loc[years].to_numpy()},
+                              index=pd.Index(years, name="year"))
+    df_history["loss"] = yield_losses(years.to_numpy(), df_history["yield"].to_numpy())
+    return df_history
+
+
+def _backtest_task(task):
+    n6, dpt, arguments = task
+    return n6, dpt, backtest_zone(*arguments)
+
+
+@profiled
+def backtest(crops=None, departments=None, indicators=None, loss_threshold=LOSS_THRESHOLD, n_thresholds=N_THRESHOLDS,
+             max_workers=1, variable=YIELD_VARIABLE, path_agri=AGRI_PATH, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Backtests the triggers of the department agro-climatic indicators against the yields of every (crop, department)
+
+    The (crop, department) pairs are evaluated in a pool of at most max_workers processes when there
+    are several of them and max_workers is above 1.
+
+    Args:
+        crops (list, optional): categories ('n6'), every category of the yields by default
+        departments (list, optional): departments, only their agreste partitions are read, DEPARTMENTS by default
+        indicators (list, optional): indicators (see indicators.indicator_columns), all by default
+
+    Returns:
+        pd.DataFrame: 'n6', 'dpt' and one row per (indicator, direction, threshold), see backtest_zone
+    """
+    departments = DEPARTMENTS if departments is None else tuple(departments)
+    df_yields = agri_values(load_agri_index(path_agri, departments), variable)["value"]
+    df_indicators = load_indicators("dpt", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    df_indicators = df_indicators[df_indicators["days"] >= MIN_SEASON_DAYS].drop(columns="days")
+    indicators = list(df_indicators.columns) if indicators is None else list(indicators)
+
+    crops = list(df_yields.index.unique("n6")) if crops is None else crops
+    departments = sorted(set(df_yields.index.unique("dpt")) & set(df_indicators.index.unique("DEP")))
+
+    zones = set(df_yields.index.droplevel("year"))
+    tasks = []
+    for n6 in crops:
+        for dpt in departments:
+            if (n6, dpt) not in zones:
+                continue
+            df_yield = df_yields.loc[(n6, dpt)].dropna()
+            df_dpt = df_indicators.loc[dpt, indicators]
+            n_common = len(df_yield.index.intersection(df_dpt.index))
+            if n_common < MIN_COMMON_SEASONS:
+                logger.info("Skipping %s in department %s: %d seasons with yields and indicators", n6, dpt, n_common)
+                continue
+            tasks.append((n6, dpt, (df_yield.index.to_numpy(), df_yield.to_numpy(), df_dpt.index.to_numpy(),
+                                    df_dpt.to_numpy().T, indicators, loss_threshold, n_thresholds)))
+
+    max_workers = min(max_workers, len(tasks))
+    if max_workers <= 1:
+        results = [_backtest_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_backtest_task, tasks))
+
+    if not results:
+        return pd.DataFrame(columns=["n6", "dpt", "indicator", "direction", "quantile", "threshold"])
+    # Columns of the zones concatenated at once, one frame being costlier than the evaluation of a zone
+    sizes = [len(columns["threshold"]) for _, _, columns in results]
+    df_backtest = pd.DataFrame({
+        "n6": np.repeat([n6 for n6, _, _ in results], sizes),
+        "dpt": np.repeat([dpt for _, dpt, _ in results], sizes),
+    })
+    for column in results[0][2]:
+        values = [columns[column] for _, _, columns in results]
+        if isinstance(values[0], pd.Categorical):
+            # Same categories in every zone (indicators and directions)
+            df_backtest[column] = pd.Categorical.from_codes(np.concatenate([value.codes for value in values]), values[0].categories)
+        else:
+            df_backtest[column] = np.concatenate(values)
+    return df_backtest
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_backtest(loss_threshold=LOSS_THRESHOLD, n_thresholds=N_THRESHOLDS, departments=DEPARTMENTS, max_workers=BACKTEST_WORKERS,
+                  path_agri=AGRI_PATH, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Backtest of every trigger and crop of the departments, cached per loss threshold and departments
+
+    The (crop, department) pairs are evaluated in max_workers processes, see BACKTEST_WORKERS.
+    """
+    return backtest(departments=departments, loss_threshold=loss_threshold, n_thresholds=n_thresholds, max_workers=max_workers,
+                    path_agri=path_agri, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
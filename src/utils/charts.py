@@ -0,0 +1,77 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from utils.profiling import profiled
+
+# Maximum number of points per series sent to the browser by a chart
+MAX_CHART_POINTS = 1000
+
+
+def lttb_indices(x, y, n_out):
+    """Selects the points of a series to keep with the Largest-Triangle-Three-Buckets algorithm
+
+    The first and last points are kept, and one point per bucket in between: the one forming the
+    largest triangle with the point kept in the previous bucket and the mean of the next bucket,
+    which preserves the peaks of the series.
+
+    Args:
+        x (np.ndarray): increasing x values
+        y (np.ndarray): y values, same length
+        n_out (int): number of points to keep
+
+    Returns:
+        np.ndarray: increasing positions of the kept points
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    # n_out - 2 buckets between the first and the last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype("int64")
+    indices = np.empty(n_out, dtype="int64")
+    indices[0], indices[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        with warnings.catch_warnings():
+            # Mean of an all-NaN bucket
+            warnings.simplefilter("ignore", RuntimeWarning)
+            next_x, next_y = np.nanmean(x[end:next_end]), np.nanmean(y[end:next_end])
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(np.nan_to_num(areas, nan=-1.)))
+        indices[bucket + 1] = previous
+    return indices
+
+
+@profiled
+def chart_data(df, x, columns, by=None, max_points=MAX_CHART_POINTS):
+    """Reduces a frame to the data actually plotted by a chart
+
+    Only the x, y and series columns are kept, and each series longer than max_points is
+    downsampled with lttb_indices on the first y column.
+
+    Args:
+        df (pd.DataFrame): data of the chart
+        x (str): x column (numbers or dates), the series are sorted by it
+        columns (list): y columns
+        by (str, optional): column identifying the series (e.g. the color of the lines)
+        max_points (int): maximum number of points per series
+
+    Returns:
+        pd.DataFrame: data to pass once to the chart, shared by its layers
+    """
+    df = df[[x] + list(columns) + ([by] if by is not None else [])]
+    groups = [df] if by is None else [group for _, group in df.groupby(by, sort=False, observed=True)]
+
+    reduced = []
+    for group in groups:
+        group = group.sort_values(x)
+        x_values = group[x].to_numpy()
+        if np.issubdtype(x_values.dtype, np.datetime64):
+            x_values = x_values.astype("datetime64[ns]").astype("int64")
+        reduced.append(group.iloc[lttb_indices(x_values, group[columns[0]].to_numpy(), max_points)])
+    return pd.concat(reduced, ignore_index=True)
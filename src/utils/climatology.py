@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from utils.cube import MeteoCube
+
+# The agricultural season of a year runs from September of the previous year to August
+SEASON_FIRST_MONTH = 9
+
+
+@dataclass
+class MonthlyClimatology:
+    """Per grid point monthly means of every month of the data, and monthly climatology over all years
+
+    Both are computed in a single pass over the daily data, see compute_monthly_climatology. The
+    number of daily values averaged in each climatology value is kept in counts, so that the
+    climatology can be updated with new days.
+    """
+    months: pd.DatetimeIndex
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    monthly: dict
+    climatology: dict
+    counts: dict
+
+    def _to_frame(self, values, dates, variables):
+        variables = list(values) if variables is None else variables
+        cube = MeteoCube(dates, self.latitudes, self.longitudes, {variable: values[variable] for variable in variables})
+        # Same format as get_monthly_mean: indexed by latitude and longitude, with a 'date' column
+        return cube.to_frame().reset_index(level="date")
+
+    def season(self, year, variables=None):
+        """Monthly means of the agricultural season of a year (September of year - 1 to August of year)
+
+        Returns:
+            pd.DataFrame: indexed by latitude and longitude, with 'date' (first day of the month) and the variables
+        """
+        start, end = self.months.searchsorted([pd.Timestamp(year - 1, SEASON_FIRST_MONTH, 1), pd.Timestamp(year, SEASON_FIRST_MONTH, 1)])
+        return self._to_frame({variable: array[start:end] for variable, array in self.monthly.items()}, self.months[start:end], variables)
+
+    def climatology_season(self, year, variables=None):
+        """Monthly climatology dated on the months of the agricultural season of a year, same format as season"""
+        # Calendar months 9-12 then 1-8, dated on the season
+        calendar_months = np.r_[np.arange(SEASON_FIRST_MONTH, 13), np.arange(1, SEASON_FIRST_MONTH)]
+        dates = pd.DatetimeIndex(
+            [pd.Timestamp(year - (month >= SEASON_FIRST_MONTH), month, 1) for month in calendar_months],
+            name="date",
+        )
+        return self._to_frame({variable: array[calendar_months - 1] for variable, array in self.climatology.items()}, dates, variables)
+
+
+def compute_monthly_climatology(cube):
+    """Computes the monthly means and the monthly climatology per grid point in one pass over the data
+
+    The daily values are reduced once into monthly sums and counts, the monthly means and the
+    climatology (sum over the same calendar month of every year) are both derived from them.
+
+    Args:
+        cube (MeteoCube): daily data
+
+    Returns:
+        MonthlyClimatology: monthly means of every month and climatology per calendar month
+    """
+    codes, months = pd.factorize(cube.dates.to_period("M"), sort=True)
+    groups, sums, counts = cube.group_sums(codes)
+    months = pd.PeriodIndex(months).to_timestamp()[groups].rename("date")
+    calendar_months = months.month.to_numpy() - 1
+
+    monthly, climatology, climatology_counts_per_variable = {}, {}, {}
+    for variable in cube.variables:
+        climatology_sums = np.zeros((12,) + sums[variable].shape[1:])
+        climatology_counts = np.zeros((12,) + counts[variable].shape[1:], dtype="int64")
+        np.add.at(climatology_sums, calendar_months, sums[variable])
+        np.add.at(climatology_counts, calendar_months, counts[variable])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            monthly[variable] = (sums[variable] / counts[variable]).astype("float32")
+            climatology[variable] = (climatology_sums / climatology_counts).astype("float32")
+        climatology_counts_per_variable[variable] = climatology_counts
+
+    return MonthlyClimatology(months, cube.latitudes, cube.longitudes, monthly, climatology, climatology_counts_per_variable)
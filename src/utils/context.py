@@ -0,0 +1,199 @@
+import functools
+import inspect
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from utils.profiling import count_rows, stage
+
+# Memory budget of the shared datasets, in MB
+DEFAULT_MAX_MB = int(os.environ.get("DATA_CONTEXT_MAX_MB", 2048))
+
+
+def estimate_nbytes(value):
+    """Estimates the memory used by a dataset (frames, arrays, cubes and containers of them)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True, index=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        value = value.tocsr()
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, pd.Index):
+        return value.memory_usage(deep=True)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(item) for item in value)
+    if isinstance(getattr(value, "nbytes", None), int):
+        return value.nbytes
+    if hasattr(value, "__dataclass_fields__"):
+        return sum(estimate_nbytes(getattr(value, field)) for field in value.__dataclass_fields__)
+    return sys.getsizeof(value)
+
+
+class DataContext:
+    """Process-wide LRU store of read-only datasets, shared by every session of the app
+
+    Datasets are returned without copy: callers must not modify them. When the total estimated
+    size exceeds the budget, the least recently used datasets are evicted.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, loader):
+        """Returns the dataset stored under key, loading it with loader() on a miss
+
+        Concurrent sessions asking for the same missing key wait for a single load.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    # Loaded by another session while waiting for the key lock
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+
+            try:
+                value = loader()
+                nbytes = estimate_nbytes(value)
+
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = (value, nbytes)
+                    self._bytes += nbytes
+                    self._evict(keep=key)
+            finally:
+                # Also when loader() raises, the next session asking for key retries the load
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+        return value
+
+    def _evict(self, keep):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            _, nbytes = self._entries.pop(key)
+            self._bytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counts and memory accounting of the stored datasets"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "datasets": [
+                    {"name": key[0], "arguments": key[1], "bytes": nbytes}
+                    for key, (_, nbytes) in self._entries.items()
+                ],
+            }
+
+
+class NoCache:
+    """Cache backend that never stores: every get loads, e.g. for one-shot batch jobs"""
+
+    def get(self, key, loader):
+        return loader()
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"hits": 0, "misses": 0, "hit_rate": 0., "evictions": 0, "entries": 0, "bytes": 0, "max_bytes": 0, "datasets": []}
+
+
+# Cache backends: factories of objects with get(key, loader), clear() and stats(), like DataContext
+CACHE_BACKENDS = {"memory": DataContext, "none": NoCache}
+DEFAULT_CACHE_BACKEND = os.environ.get("DATA_CACHE_BACKEND", "memory")
+
+_data_context = None
+_data_context_lock = threading.Lock()
+
+
+def get_data_context():
+    """Cache backend of the process, a DEFAULT_CACHE_BACKEND created on first use"""
+    global _data_context
+    with _data_context_lock:
+        if _data_context is None:
+            _data_context = CACHE_BACKENDS[DEFAULT_CACHE_BACKEND]()
+        return _data_context
+
+
+def set_data_context(context):
+    """Replaces the cache backend of the process, e.g. a DataContext with another budget or NoCache"""
+    global _data_context
+    with _data_context_lock:
+        _data_context = context
+
+
+def shared_data(function=None, version=None, key=None):
+    """Decorator storing the result of a loader in the shared DataContext, keyed by its arguments
+
+    Unlike st.cache_data the result is not copied on each hit, so it must be treated as read-only.
+    Each call is recorded as a profiling stage, with 'cache' set to 'hit' or 'miss'.
+
+    Args:
+        version (callable, optional): called with the arguments of the loader (dict), returns the
+            version of the data it reads, e.g. era5.meteo_version. It is part of the key, so that
+            new data is loaded without restarting the app.
+        key (callable, optional): called with the arguments of the loader (dict), returns what identifies
+            the data in the key instead of the arguments, e.g. the hash of a large geometry.
+    """
+    if function is None:
+        return functools.partial(shared_data, version=version, key=key)
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        identity = tuple(arguments.arguments.items()) if key is None else key(arguments.arguments)
+        data_key = (f"{function.__module__}.{function.__qualname__}", repr(identity))
+        with stage(function.__qualname__, cache="hit") as record:
+            if version is not None:
+                data_key += (version(arguments.arguments),)
+
+            def loader():
+                record["cache"] = "miss"
+                return function(*args, **kwargs)
+
+            value = get_data_context().get(data_key, loader)
+            record["rows"] = count_rows(value)
+        return value
+
+    return wrapper
+
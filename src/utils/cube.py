@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from utils.context import shared_data
+from utils.era5 import ERA5_PATH, meteo_version, read_meteo_data
+from utils.profiling import profiled
+
+
+@dataclass
+class MeteoCube:
+    """Dense representation of the ERA5 data: one contiguous float32 [time, latitude, longitude] array per variable
+
+    Grid points missing from the data (outside of the extraction) are NaN. Dates are sorted, so
+    date ranges are slices (views) of the arrays.
+    """
+    dates: pd.DatetimeIndex
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    values: dict
+
+    @property
+    def variables(self):
+        return list(self.values)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.values.values())
+
+    def sel_dates(self, start_date=None, end_date=None):
+        """Cube restricted to a date range (bounds included), sharing memory with this one"""
+        start = 0 if start_date is None else self.dates.searchsorted(pd.Timestamp(start_date), side="left")
+        end = len(self.dates) if end_date is None else self.dates.searchsorted(pd.Timestamp(end_date), side="right")
+        return MeteoCube(
+            self.dates[start:end],
+            self.latitudes,
+            self.longitudes,
+            {variable: array[start:end] for variable, array in self.values.items()},
+        )
+
+    def group_sums(self, codes):
+        """Sums and counts of the non-NaN values over the time axis per group of dates
+
+        Args:
+            codes (np.ndarray): group of each date (integers)
+
+        Returns:
+            (np.ndarray, dict, dict): groups present in codes (sorted), variable -> float64
+            [group, latitude, longitude] sums and variable -> int64 counts
+        """
+        codes = np.asarray(codes)
+        order = None if np.all(np.diff(codes) >= 0) else np.argsort(codes, kind="stable")
+        sorted_codes = codes if order is None else codes[order]
+        boundaries = np.flatnonzero(np.r_[True, np.diff(sorted_codes) != 0])
+
+        sums, counts = {}, {}
+        for variable, array in self.values.items():
+            if order is not None:
+                array = array[order]
+            valid = ~np.isnan(array)
+            sums[variable] = np.add.reduceat(np.where(valid, array, 0.), boundaries, axis=0, dtype="float64")
+            counts[variable] = np.add.reduceat(valid, boundaries, axis=0, dtype="int64")
+        return sorted_codes[boundaries], sums, counts
+
+    def group_mean(self, codes, n_groups=None):
+        """Mean over the time axis per group of dates, ignoring NaN
+
+        Args:
+            codes (np.ndarray): group (0 to n_groups - 1) of each date
+            n_groups (int, optional): number of groups, max(codes) + 1 by default
+
+        Returns:
+            dict: variable -> float32 [group, latitude, longitude] array
+        """
+        n_groups = int(np.max(codes)) + 1 if n_groups is None else n_groups
+        groups, sums, counts = self.group_sums(codes)
+
+        means = {}
+        for variable in self.values:
+            mean = np.full((n_groups,) + sums[variable].shape[1:], np.nan, dtype="float32")
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean[groups] = sums[variable] / counts[variable]
+            means[variable] = mean
+        return means
+
+    def monthly_mean(self):
+        """Monthly means per grid point, as a cube dated on the first day of each month"""
+        months = self.dates.to_period("M")
+        codes, month_values = pd.factorize(months, sort=True)
+        return MeteoCube(
+            pd.PeriodIndex(month_values).to_timestamp().rename("date"),
+            self.latitudes,
+            self.longitudes,
+            self.group_mean(codes, len(month_values)),
+        )
+
+    def climatology(self, by="month"):
+        """Mean over all years per 'month' (1-12) or 'day_of_year' (1-366), per grid point
+
+        Returns:
+            (pd.Index, dict): period labels and variable -> float32 [period, latitude, longitude] array
+        """
+        periods = self.dates.month if by == "month" else self.dates.dayofyear
+        codes, labels = pd.factorize(periods, sort=True)
+        return pd.Index(labels, name=by), self.group_mean(codes, len(labels))
+
+    def spatial_mean(self):
+        """Mean over the grid points for each date, ignoring missing points
+
+        Returns:
+            pd.DataFrame: variables indexed by date
+        """
+        with np.errstate(invalid="ignore"):
+            return pd.DataFrame(
+                {variable: np.nanmean(array, axis=(1, 2)) for variable, array in self.values.items()},
+                index=self.dates.rename("date"),
+            )
+
+    def cell_positions(self, gdf_grid):
+        """(latitude, longitude) positions in the cube of the grid points of gdf_grid, in the order of their 'id'"""
+        gdf_grid = gdf_grid.sort_values("id")
+        lat_positions = np.searchsorted(self.latitudes, gdf_grid.index.get_level_values("latitude"))
+        lon_positions = np.searchsorted(self.longitudes, gdf_grid.index.get_level_values("longitude"))
+        return lat_positions, lon_positions
+
+    def cell_values(self, gdf_grid, variables=None):
+        """Values per grid cell, in the order of the grid 'id' (columns of the regrid weight matrices)
+
+        Returns:
+            np.ndarray: float32 [cell, time, variable] array
+        """
+        variables = self.variables if variables is None else variables
+        lat_positions, lon_positions = self.cell_positions(gdf_grid)
+        return np.stack(
+            [self.values[variable][:, lat_positions, lon_positions].T for variable in variables],
+            axis=-1,
+        )
+
+    def to_frame(self, values=None, periods=None):
+        """Converts the cube (or arrays reduced from it) to the long format indexed by latitude, longitude and period
+
+        Args:
+            values (dict, optional): variable -> [period, latitude, longitude] arrays, the cube values by default
+            periods (pd.Index, optional): labels of the first axis of values, the cube dates by default
+
+        Returns:
+            pd.DataFrame: one row per grid point with data and period
+        """
+        values = self.values if values is None else values
+        periods = self.dates.rename("date") if periods is None else periods
+        # Long format in the (latitude, longitude, period) order of the ERA5 files
+        columns = {variable: np.moveaxis(array, 0, -1).ravel() for variable, array in values.items()}
+        index = pd.MultiIndex.from_product(
+            [pd.Index(self.latitudes, name="latitude"), pd.Index(self.longitudes, name="longitude"), periods]
+        )
+        df = pd.DataFrame(columns, index=index)
+        # Grid points outside of the extraction are all NaN
+        return df[df.notna().any(axis=1).to_numpy()]
+
+
+def cube_from_frame(df_meteo, columns=None):
+    """Builds a MeteoCube from the long-format ERA5 frame (indexed by date, latitude and longitude)"""
+    columns = list(df_meteo.columns) if columns is None else columns
+    date_codes, dates = pd.factorize(df_meteo.index.get_level_values("date"), sort=True)
+    lat_codes, latitudes = pd.factorize(df_meteo.index.get_level_values("latitude"), sort=True)
+    lon_codes, longitudes = pd.factorize(df_meteo.index.get_level_values("longitude"), sort=True)
+
+    values = {}
+    for column in columns:
+        array = np.full((len(dates), len(latitudes), len(longitudes)), np.nan, dtype="float32")
+        array[date_codes, lat_codes, lon_codes] = df_meteo[column].to_numpy()
+        values[column] = array
+
+    return MeteoCube(pd.DatetimeIndex(dates, name="date"), np.asarray(latitudes), np.asarray(longitudes), values)
+
+
+@profiled
+def read_cube(path=ERA5_PATH, start_date=None, end_date=None, columns=None):
+    """Reads a slice of the ERA5 data as a MeteoCube, see era5.read_meteo_data"""
+    return cube_from_frame(read_meteo_data(path, start_date=start_date, end_date=end_date, columns=columns), columns)
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path"]))
+def load_cube(path=ERA5_PATH, start_date=None, end_date=None, columns=None):
+    """Cached MeteoCube shared (not copied) between reruns and sessions, must not be modified"""
+    return read_cube(path, start_date=start_date, end_date=end_date, columns=None if columns is None else list(columns))
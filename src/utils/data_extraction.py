@@ -1,28 +1,47 @@
+import os
+
 import geopandas as gpd
 import pandas as pd
-from shapely.ops import nearest_points
-import streamlit as st
+from utils.agri import AGRI_PATH, get_agri_data, get_agri_index
+from utils.artifacts import ARTIFACTS_DIR, artifact_path, artifacts_key, hash_grid, hash_path, read_artifact, write_artifact
+from utils.departments import DEPARTMENTS, partition_dir
+from utils.context import shared_data
+from utils.era5 import ERA5_PATH, meteo_date_range, meteo_version, read_meteo_data
+from utils.grid import AREA_CRS, GRID_CRS, grid_cell_polygons, nearest_grid_ids, overlap_weights, polygon_areas
+from utils.map_geometry import MAP_TOLERANCES, build_map_geometry, simplify_polygons
+
+# Bumped when the content of the communes artifacts changes, to rebuild them
+COMMUNES_ARTIFACTS_VERSION = 6
+
+@shared_data
+def load_agri_data(path=AGRI_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the agreste data of the departments ('n6', 'dpt', 'variable', 'year' and 'value')
 
-@st.cache_data
-def load_agri_data(path="../data/agreste.csv", drop_columns=['Unnamed: 0', 'n1', 'n2', 'n3', 'n4', 'n5', 'departement']):
-    df_agri = pd.read_csv(path)
-    df_agri.drop(columns=drop_columns, inplace=True)
-    condition = (df_agri['dpt'] == '28') | (df_agri['dpt'] == '27')
-    df_agri = df_agri[condition].copy()
+    Read from the on-disk columnar cache, the CSV is only streamed when it changed, see agri.read_agri_data.
+    """
+    return get_agri_data(path, departments, artifacts_dir)
 
-    return df_agri
+@shared_data
+def load_agri_index(path=AGRI_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the agreste values indexed by (variable, n6, dpt, year), see agri.build_agri_index
 
-@st.cache_data
-def load_meteo_data(path="../data/ERA5_data.parquet"):
-    df_meteorological = pd.read_parquet(path)
+    Read from the on-disk artifact, so the CSV is only parsed when it changed.
+    """
+    return get_agri_index(path, departments, artifacts_dir)
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path"]))
+def load_meteo_data(path=ERA5_PATH, start_date=None, end_date=None, columns=None):
+    df_meteorological = read_meteo_data(path, start_date=start_date, end_date=end_date, columns=columns)
     return df_meteorological
 
-def load_meteo_data_date(path="../data/ERA5_data.parquet", specific_date='2020-01-01'):
-    df_meteorological = pd.read_parquet(path)
-    df_specific_date = df_meteorological[
-        df_meteorological.index.get_level_values("date") == specific_date
-    ]
+@shared_data(version=lambda arguments: meteo_version(arguments["path"]))
+def load_meteo_date_range(path=ERA5_PATH):
+    """First and last dates of the ERA5 data, reloaded when new data is ingested"""
+    return meteo_date_range(path)
 
+def _grid_geodataframe(df_specific_date):
+    # One row per grid point, ids follow the (latitude, longitude) order whatever the storage layout
+    df_specific_date = df_specific_date.sort_index(level=["latitude", "longitude"])
     gdf_meteorological = gpd.GeoDataFrame(
         df_specific_date,
         geometry=gpd.points_from_xy(
@@ -30,33 +49,46 @@ def load_meteo_data_date(path="../data/ERA5_data.parquet", specific_date='2020-0
             df_specific_date.index.get_level_values("latitude"),
         ),
     )
-
     gdf_meteorological["id"] = range(len(gdf_meteorological))
-
     return gdf_meteorological
 
+@shared_data
+def load_meteo_data_date(path=ERA5_PATH, specific_date='2020-01-01'):
+    df_specific_date = read_meteo_data(path, start_date=specific_date, end_date=specific_date)
+    return _grid_geodataframe(df_specific_date)
 
-@st.cache_data
-def load_communes_geometry(path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo="../data/ERA5_data.parquet"):
-    # Extract a 'base' meteo dataframe to build the geometry of communes on it
-    df_base_meteo = pd.read_parquet(path_base_meteo)
-    base_date = "2020-01-01"
-    df_base_meteo = df_base_meteo[
-        df_base_meteo.index.get_level_values("date") == base_date
-    ]
-    gdf_base_meteorological = gpd.GeoDataFrame(
-        df_base_meteo,
-        geometry=gpd.points_from_xy(
-            df_base_meteo.index.get_level_values("longitude"),
-            df_base_meteo.index.get_level_values("latitude"),
-        ),
-    )
+
+def load_base_grid(path_base_meteo=ERA5_PATH, base_date="2020-01-01"):
+    """Extracts the meteorological grid points (one per latitude/longitude) with their 'id'
+
+    Args:
+        path_base_meteo (str): ERA5 parquet file (or year-partitioned folder)
+        base_date (str): date used to enumerate the grid points
+
+    Returns:
+        gpd.GeoDataFrame: grid points geometry with the 'id' column
+    """
+    # Only the index (date, latitude, longitude) of a single date is needed to enumerate the grid
+    df_base_meteo = read_meteo_data(path_base_meteo, start_date=base_date, end_date=base_date, columns=[])
+    return _grid_geodataframe(df_base_meteo)
 
 
+def build_communes_mapping(gdf_base_meteorological, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", departments=DEPARTMENTS):
+    """Assigns each commune of the selected departments to its nearest meteorological grid point
+
+    Args:
+        gdf_base_meteorological (gpd.GeoDataFrame): grid points with 'id', see load_base_grid
+        path_gpd_communes (str): communes shapefile
+        path_df_communes (str): COG communes CSV (gives the department of each commune)
+        departments (tuple): departments to keep
+
+    Returns:
+        gpd.GeoDataFrame: one row per commune with 'insee', 'DEP', 'nearest_id' and geometry
+    """
     gdf_communes = gpd.read_file(path_gpd_communes)
     gdf_communes.drop(columns=["nom", "wikipedia", "surf_ha"], inplace=True)
 
-    df_communes = pd.read_csv(path_df_communes)
+    df_communes = pd.read_csv(path_df_communes, dtype={"COM": str, "DEP": str})
     df_communes.drop(
         columns=[
             "TYPECOM",
@@ -77,33 +109,178 @@ def load_communes_geometry(path_gpd_communes="../data/communes-20220101-shp/", p
     merged_communes_gdf = gdf_communes.merge(df_communes, left_on="insee", right_on="COM")
     merged_communes_gdf.drop(columns=["COM"], inplace=True)
 
-    condition = merged_communes_gdf["DEP"].isin(["27", "28"])
+    condition = merged_communes_gdf["DEP"].isin(list(departments))
     gdf_communes = merged_communes_gdf[condition].copy()
 
-    gdf_base_meteorological["id"] = range(len(gdf_base_meteorological))
+    # Find the nearest meteorological point for each commune centroid, in one batched KD-tree query
+    gdf_communes["nearest_id"] = nearest_grid_ids(gdf_communes.geometry.centroid, gdf_base_meteorological)
+
+    return gdf_communes
+
+
+def check_departments(path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", departments=DEPARTMENTS):
+    """Checks that every department has communes in the COG, e.g. at startup against the DEPARTMENTS environment variable
+
+    Raises:
+        ValueError: naming the departments without communes
+    """
+    cog_departments = set(pd.read_csv(path_df_communes, usecols=["DEP"], dtype=str)["DEP"].dropna())
+    unknown = sorted(set(departments) - cog_departments)
+    if unknown:
+        raise ValueError(f"No communes in departments {', '.join(unknown)} of {path_df_communes}, check the DEPARTMENTS environment variable")
+
+
+def communes_partition_key(path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, gdf_base_meteorological=None):
+    """Key of the communes partitions: content hash of the shapefile, the COG CSV and the ERA5 grid"""
+    if gdf_base_meteorological is None:
+        gdf_base_meteorological = load_base_grid(path_base_meteo)
+    return artifacts_key(
+        hash_path(path_gpd_communes, artifacts_dir=artifacts_dir),
+        hash_path(path_df_communes, artifacts_dir=artifacts_dir),
+        hash_grid(gdf_base_meteorological),
+        area_crs=AREA_CRS,
+        version=COMMUNES_ARTIFACTS_VERSION,
+    )
+
+
+def communes_artifacts_key(path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR, gdf_base_meteorological=None):
+    """Key of the communes artifacts of a set of departments, part of the key of the artifacts computed over the set (e.g. rollups)"""
+    return artifacts_key(
+        communes_partition_key(path_gpd_communes, path_df_communes, path_base_meteo, artifacts_dir, gdf_base_meteorological),
+        departments=sorted(departments),
+    )
+
+
+def build_communes_artifacts(path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Builds and writes the communes artifacts of each department to its partition folder (see departments.partition_dir)
+
+    - 'communes_mapping': commune -> 'nearest_id' table ('insee', 'DEP', 'nearest_id', 'area')
+    - 'communes_grid': communes geometry dissolved by grid point ('nearest_id')
+    - 'communes_map_<detail>': simplified 'communes_grid' geometry of the maps, per level of detail of MAP_TOLERANCES
+    - 'communes_overlap': commune x ERA5 cell intersection areas ('insee', 'DEP', 'cell_id', 'area')
+    - 'communes_polygons': communes polygons ('insee', 'DEP') in AREA_CRS, for the zonal queries
+
+    The communes shapefile is read once for all the departments.
+
+    Returns:
+        str: key of the written partitions
+
+    Raises:
+        ValueError: if a department has no communes, before any partition is written
+    """
+    gdf_base_meteorological = load_base_grid(path_base_meteo)
+    key = communes_partition_key(path_gpd_communes, path_df_communes, path_base_meteo, artifacts_dir, gdf_base_meteorological)
+
+    gdf_communes = build_communes_mapping(gdf_base_meteorological, path_gpd_communes, path_df_communes, departments)
+    unknown = sorted(set(departments) - set(gdf_communes["DEP"]))
+    if unknown:
+        raise ValueError(f"No communes in departments {', '.join(unknown)} of {path_gpd_communes}")
+    # Cache the polygon areas (weights of the averages) once, in a projected CRS
+    gdf_communes["area"] = polygon_areas(gdf_communes)
+    # Weights of the area-overlap regridding, computed once
+    df_overlap = overlap_weights(gdf_communes, grid_cell_polygons(gdf_base_meteorological), ["insee", "DEP"])
+
+    for dpt in departments:
+        gdf_dpt = gdf_communes[gdf_communes["DEP"] == dpt]
+        directory = partition_dir(dpt, artifacts_dir)
+        gdf_communes_meteo = gdf_dpt.drop(columns="area").dissolve(by="nearest_id", as_index=False)
+        gdf_communes_meteo["area"] = polygon_areas(gdf_communes_meteo)
+
+        write_artifact(pd.DataFrame(gdf_dpt.drop(columns="geometry")).reset_index(drop=True), "communes_mapping", key, artifacts_dir=directory)
+        write_artifact(gdf_communes_meteo, "communes_grid", key, artifacts_dir=directory)
+        for detail, tolerance in MAP_TOLERANCES.items():
+            gdf_map = simplify_polygons(gdf_communes_meteo[["nearest_id", "geometry"]], tolerance)
+            write_artifact(gdf_map, f"communes_map_{detail}", key, artifacts_dir=directory)
+        write_artifact(df_overlap[df_overlap["DEP"] == dpt].reset_index(drop=True), "communes_overlap", key, artifacts_dir=directory)
+        write_artifact(gdf_dpt[["insee", "DEP", "geometry"]].to_crs(AREA_CRS).reset_index(drop=True), "communes_polygons", key, artifacts_dir=directory)
+
+    return key
+
+
+def get_communes_artifact(name, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR, geo=False):
+    """Reads a communes artifact (see build_communes_artifacts) of the departments, concatenating their partitions
+
+    The missing partitions (first use of a department, or changed inputs) are built together, in a
+    single read of the communes shapefile.
+
+    Raises:
+        ValueError: if a department has no communes, see check_departments
+    """
+    key = communes_partition_key(path_gpd_communes, path_df_communes, path_base_meteo, artifacts_dir)
+    missing = [dpt for dpt in departments if not os.path.exists(artifact_path(name, key, partition_dir(dpt, artifacts_dir)))]
+    if missing:
+        # Unknown departments fail on the COG, without reading the shapefile
+        check_departments(path_df_communes, missing)
+        build_communes_artifacts(path_gpd_communes, path_df_communes, path_base_meteo, missing, artifacts_dir)
+
+    partitions = [read_artifact(name, key, artifacts_dir=partition_dir(dpt, artifacts_dir), geo=geo) for dpt in departments]
+    if len(partitions) == 1:
+        return partitions[0]
+    return pd.concat(partitions, ignore_index=True)
+
+
+def grid_cells_key(path_base_meteo=ERA5_PATH, gdf_base_meteorological=None):
+    """Key of the grid cells artifact: content hash of the ERA5 grid"""
+    if gdf_base_meteorological is None:
+        gdf_base_meteorological = load_base_grid(path_base_meteo)
+    return artifacts_key(hash_grid(gdf_base_meteorological), area_crs=AREA_CRS, version=COMMUNES_ARTIFACTS_VERSION)
+
+
+def build_grid_cells(path_base_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Builds and writes the 'grid_cells' artifact: ERA5 cells polygons ('id', 'latitude', 'longitude') in AREA_CRS
+
+    Returns:
+        str: key of the written artifact
+    """
+    gdf_base_meteorological = load_base_grid(path_base_meteo)
+    key = grid_cells_key(path_base_meteo, gdf_base_meteorological)
+    gdf_cells = grid_cell_polygons(gdf_base_meteorological)
+    gdf_cells["latitude"] = gdf_base_meteorological.index.get_level_values("latitude").to_numpy()
+    gdf_cells["longitude"] = gdf_base_meteorological.index.get_level_values("longitude").to_numpy()
+    # The grid points are in the coordinates of the communes (WGS84), without CRS
+    write_artifact(gdf_cells.set_crs(GRID_CRS).to_crs(AREA_CRS), "grid_cells", key, artifacts_dir=artifacts_dir)
+    return key
+
+
+def get_grid_cells(path_base_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Reads the grid cells artifact (see build_grid_cells), (re)building it if the grid changed"""
+    key = grid_cells_key(path_base_meteo)
+    gdf_cells = read_artifact("grid_cells", key, artifacts_dir=artifacts_dir, geo=True)
+    if gdf_cells is None:
+        build_grid_cells(path_base_meteo, artifacts_dir)
+        gdf_cells = read_artifact("grid_cells", key, artifacts_dir=artifacts_dir, geo=True)
+    return gdf_cells
+
+
+@shared_data
+def load_communes_geometry(path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the communes geometry of the departments dissolved by nearest meteorological grid point ('nearest_id')
 
-    gdf_communes["nearest_id"] = None  # Add a column for storing the id of the nearest point
-    # Calculate the centroids of the communes if they are not already points
-    gdf_communes["centroid"] = gdf_communes.geometry.centroid
+    Read from the on-disk partitions, which are only rebuilt when one of the inputs changed. A grid
+    point on the border of two departments has a polygon in each of them.
+    """
+    return get_communes_artifact("communes_grid", path_gpd_communes, path_df_communes, path_base_meteo, departments, artifacts_dir, geo=True)
 
-    # Find the nearest meteorological point for each commune centroid
-    for index, commune in gdf_communes.iterrows():
-        # Use unary_union to create a single geometry that includes all meteorological points
-        # This speeds up the operation considerably
-        nearest_geom = nearest_points(
-            commune["centroid"], gdf_base_meteorological.unary_union
-        )[1]
 
-        # Get the nearest point's data
-        nearest_data = gdf_base_meteorological.loc[
-            gdf_base_meteorological["geometry"] == nearest_geom
-        ]
+@shared_data
+def load_communes_mapping(path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the commune -> 'nearest_id' table ('insee', 'DEP', 'nearest_id', 'area') of the departments from the on-disk partitions"""
+    return get_communes_artifact("communes_mapping", path_gpd_communes, path_df_communes, path_base_meteo, departments, artifacts_dir, geo=False)
 
-        # Assign the id of the nearest point
-        gdf_communes.at[index, "nearest_id"] = nearest_data["id"].values[0]
 
-    gdf_communes.drop(columns=["centroid"], inplace=True)
+@shared_data
+def load_map_geometry(detail="medium", path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv", path_base_meteo=ERA5_PATH, departments=DEPARTMENTS, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the simplified communes geometry of the maps of the departments, serialized once to GeoJSON
 
-    gdf_communes_meteo = gdf_communes.dissolve(by="nearest_id", as_index=False)
+    Args:
+        detail (str): level of detail, key of MAP_TOLERANCES
+        departments (tuple): departments on the map, only their partitions are read
 
-    return gdf_communes_meteo
+    Returns:
+        MapGeometry: geometry shared by every render of the maps, see map_geometry.feature_collection
+    """
+    gdf_map = get_communes_artifact(f"communes_map_{detail}", path_gpd_communes, path_df_communes, path_base_meteo, departments, artifacts_dir, geo=True)
+    if gdf_map["nearest_id"].duplicated().any():
+        # Grid points on the border of two departments have a polygon in each partition
+        gdf_map = gdf_map.dissolve(by="nearest_id", as_index=False)
+    return build_map_geometry(gdf_map)
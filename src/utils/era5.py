@@ -0,0 +1,210 @@
+import glob
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+from utils.profiling import profiled
+
+ERA5_PATH = "../data/ERA5_data.parquet"
+ERA5_PARTITIONED_PATH = "../data/ERA5_data_by_year/"
+# About one month of the daily grid per row group, so that date filters skip most of a yearly file
+ROW_GROUP_DAYS = 31
+
+
+def resolve_meteo_path(path=ERA5_PATH):
+    """Prefers the year-partitioned copy of the ERA5 file when it has been built from its current version"""
+    if os.path.isdir(path):
+        return path
+    if path == ERA5_PATH and os.path.isdir(ERA5_PARTITIONED_PATH) and os.path.exists(path):
+        if os.path.getmtime(ERA5_PARTITIONED_PATH) >= os.path.getmtime(path):
+            return ERA5_PARTITIONED_PATH
+    return path
+
+
+def meteo_version(path=ERA5_PATH):
+    """Version of the ERA5 data (modification time in ns), changed by each ingestion, see append_meteo_data"""
+    return os.stat(resolve_meteo_path(path)).st_mtime_ns
+
+
+def _parquet_files(path):
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "year=*", "*.parquet")))
+    return [path]
+
+
+def meteo_date_range(path=ERA5_PATH):
+    """First and last dates of the ERA5 data, read from the parquet statistics (no data is read)
+
+    Returns:
+        (pd.Timestamp, pd.Timestamp): first and last dates
+    """
+    path = resolve_meteo_path(path)
+    first_dates, last_dates = [], []
+    for file_path in _parquet_files(path):
+        metadata = pq.ParquetFile(file_path).metadata
+        date_column = metadata.schema.names.index("date")
+        for row_group in range(metadata.num_row_groups):
+            statistics = metadata.row_group(row_group).column(date_column).statistics
+            if statistics is None or not statistics.has_min_max:
+                # Written without statistics, read the dates
+                dates = pd.read_parquet(file_path, columns=[]).index.get_level_values("date")
+                first_dates.append(dates.min())
+                last_dates.append(dates.max())
+                break
+            first_dates.append(statistics.min)
+            last_dates.append(statistics.max)
+    if not first_dates:
+        raise FileNotFoundError(f"No ERA5 data in {path}")
+    return pd.Timestamp(min(first_dates)), pd.Timestamp(max(last_dates))
+
+
+def _date_filters(start_date, end_date, partitioned):
+    filters = []
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        filters.append(("date", ">=", start_date))
+        if partitioned:
+            filters.append(("year", ">=", start_date.year))
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        filters.append(("date", "<=", end_date))
+        if partitioned:
+            filters.append(("year", "<=", end_date.year))
+    return filters or None
+
+
+@profiled
+def read_meteo_data(path=ERA5_PATH, start_date=None, end_date=None, columns=None):
+    """Reads a slice of the ERA5 data, pushing the date range and columns down to parquet
+
+    Only the row groups (and, for the year-partitioned dataset, the files) overlapping the date
+    range are read, so the memory used follows the requested slice rather than the full file.
+
+    Args:
+        path (str): ERA5 parquet file, or folder written by partition_meteo_by_year
+        start_date (str or pd.Timestamp, optional): first date included
+        end_date (str or pd.Timestamp, optional): last date included
+        columns (list, optional): meteorological columns to read ([] reads the index only)
+
+    Returns:
+        pd.DataFrame: meteorological data indexed by date, latitude and longitude
+    """
+    path = resolve_meteo_path(path)
+    partitioned = os.path.isdir(path)
+    df_meteorological = pd.read_parquet(
+        path,
+        columns=columns,
+        filters=_date_filters(start_date, end_date, partitioned),
+    )
+    if "year" in df_meteorological.columns and partitioned and (columns is None or "year" not in columns):
+        # Partition key added back by the hive-style layout
+        df_meteorological.drop(columns=["year"], inplace=True)
+    return df_meteorological
+
+
+def partition_meteo_by_year(path=ERA5_PATH, output_path=ERA5_PARTITIONED_PATH):
+    """Rewrites the ERA5 file as one parquet file per year (hive layout: year=YYYY/data.parquet)
+
+    Rows are sorted by date inside each file and grouped by about a month, so that a season
+    query only opens two files and skips the row groups outside of its range.
+
+    Args:
+        path (str): ERA5 parquet file
+        output_path (str): folder of the partitioned dataset
+
+    Returns:
+        list: written files
+    """
+    df_meteorological = pd.read_parquet(path)
+    dates = df_meteorological.index.get_level_values("date")
+    n_points = len(df_meteorological) // max(dates.nunique(), 1)
+
+    for stale_file in glob.glob(os.path.join(output_path, "year=*", "*.parquet")):
+        os.remove(stale_file)
+
+    written_files = []
+    for year, df_year in df_meteorological.groupby(dates.year):
+        df_year = df_year.sort_index(level=["date", "latitude", "longitude"])
+        year_path = os.path.join(output_path, f"year={year}")
+        os.makedirs(year_path, exist_ok=True)
+        file_path = os.path.join(year_path, "data.parquet")
+        df_year.to_parquet(file_path, row_group_size=max(n_points * ROW_GROUP_DAYS, 1))
+        written_files.append(file_path)
+
+    # Marks the partitioned copy as up to date with the source file, see resolve_meteo_path
+    os.utime(output_path)
+    return written_files
+
+
+def append_meteo_data(df_new, output_path=ERA5_PARTITIONED_PATH):
+    """Appends new daily ERA5 data to the year-partitioned dataset, without rewriting its files
+
+    The new days are written as new files (year=YYYY/part-<first day>-<last day>.parquet) next to
+    the existing ones. Days already in the dataset are skipped, so that a refresh may overlap the
+    previous one.
+
+    Args:
+        df_new (pd.DataFrame): daily data, indexed and with the columns of the ERA5 file
+        output_path (str): folder of the partitioned dataset, see partition_meteo_by_year
+
+    Returns:
+        pd.DatetimeIndex: appended dates
+    """
+    _, last_date = meteo_date_range(output_path)
+    dates = df_new.index.get_level_values("date")
+    df_new = df_new[dates > last_date]
+    dates = df_new.index.get_level_values("date")
+    if df_new.empty:
+        return pd.DatetimeIndex([], name="date")
+
+    for year, df_year in df_new.groupby(dates.year):
+        df_year = df_year.sort_index(level=["date", "latitude", "longitude"])
+        year_dates = df_year.index.get_level_values("date")
+        year_path = os.path.join(output_path, f"year={year}")
+        os.makedirs(year_path, exist_ok=True)
+        file_name = f"part-{year_dates.min():%Y%m%d}-{year_dates.max():%Y%m%d}.parquet"
+        file_path = os.path.join(year_path, file_name)
+        # Written under a hidden temporary name (skipped by the dataset readers) then renamed
+        tmp_path = os.path.join(year_path, f".{file_name}.{os.getpid()}.tmp")
+        df_year.to_parquet(tmp_path)
+        os.replace(tmp_path, file_path)
+
+    # New version of the dataset, see meteo_version and resolve_meteo_path
+    os.utime(output_path)
+    return pd.DatetimeIndex(dates.unique().sort_values(), name="date")
+
+
+def compact_meteo_partitions(output_path=ERA5_PARTITIONED_PATH, years=None):
+    """Merges the files appended to yearly partitions into a single file per year
+
+    Daily appends leave one small file per refresh, compacting the past years keeps their reads
+    to a single file with monthly row groups (same layout as partition_meteo_by_year).
+
+    Args:
+        output_path (str): folder of the partitioned dataset
+        years (list, optional): years to compact, every year with several files by default
+
+    Returns:
+        list: compacted years
+    """
+    compacted_years = []
+    for year_path in sorted(glob.glob(os.path.join(output_path, "year=*"))):
+        year = int(os.path.basename(year_path).split("=")[1])
+        files = sorted(glob.glob(os.path.join(year_path, "*.parquet")))
+        if len(files) < 2 or (years is not None and year not in years):
+            continue
+        df_year = pd.concat([pd.read_parquet(file_path) for file_path in files])
+        df_year = df_year.sort_index(level=["date", "latitude", "longitude"])
+        n_points = len(df_year) // max(df_year.index.get_level_values("date").nunique(), 1)
+        file_path = os.path.join(year_path, "data.parquet")
+        tmp_path = os.path.join(year_path, f".data.parquet.{os.getpid()}.tmp")
+        df_year.to_parquet(tmp_path, row_group_size=max(n_points * ROW_GROUP_DAYS, 1))
+        os.replace(tmp_path, file_path)
+        for stale_file in files:
+            if stale_file != file_path:
+                os.remove(stale_file)
+        compacted_years.append(year)
+
+    if compacted_years:
+        os.utime(output_path)
+    return compacted_years
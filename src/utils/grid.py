@@ -0,0 +1,111 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from shapely.geometry import box
+
+# Lambert-93, projected CRS of metropolitan France used to compute areas
+AREA_CRS = "EPSG:2154"
+# CRS of the coordinates of the ERA5 grid points (and of the communes shapefile)
+GRID_CRS = "EPSG:4326"
+
+
+def build_grid_index(gdf_grid):
+    """Builds a KD-tree over the coordinates of the meteorological grid points
+
+    Args:
+        gdf_grid (gpd.GeoDataFrame): grid points (one row per latitude/longitude) with point geometry
+
+    Returns:
+        scipy.spatial.cKDTree: tree over the (longitude, latitude) coordinates, in the row order of gdf_grid
+    """
+    coordinates = np.column_stack([gdf_grid.geometry.x.to_numpy(), gdf_grid.geometry.y.to_numpy()])
+    return cKDTree(coordinates)
+
+
+def nearest_grid_ids(points, gdf_grid, grid_index=None):
+    """Finds the id of the nearest grid point for each point, in one batched query
+
+    Args:
+        points (gpd.GeoSeries): points to match (e.g. communes centroids), same CRS as gdf_grid
+        gdf_grid (gpd.GeoDataFrame): grid points with an 'id' column
+        grid_index (scipy.spatial.cKDTree, optional): tree built by build_grid_index, built on the fly if None
+
+    Returns:
+        np.ndarray: id of the nearest grid point, aligned with points
+    """
+    if grid_index is None:
+        grid_index = build_grid_index(gdf_grid)
+
+    coordinates = np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+    _, positions = grid_index.query(coordinates)
+
+    return gdf_grid["id"].to_numpy()[positions]
+
+
+def polygon_areas(gdf, crs=AREA_CRS):
+    """Computes the area of each polygon in a projected CRS (m2)
+
+    Args:
+        gdf (gpd.GeoDataFrame): polygons, with their CRS set (WGS84 for the communes)
+        crs (str): projected CRS used for the computation
+
+    Returns:
+        pd.Series: area of each polygon, aligned with gdf
+    """
+    if gdf.crs is None:
+        # Without a CRS the geometry cannot be projected, fall back to the planar area
+        return gdf.geometry.area
+    return gdf.geometry.to_crs(crs).area
+
+
+def grid_spacing(coordinates):
+    """Spacing of a regular grid along one axis: smallest step between its distinct coordinates"""
+    steps = np.diff(np.unique(coordinates))
+    return steps.min() if len(steps) else 0.25
+
+
+def grid_cell_polygons(gdf_grid):
+    """Builds the cell of each grid point: the box of the grid spacing centered on the point
+
+    Args:
+        gdf_grid (gpd.GeoDataFrame): grid points with an 'id' column and point geometry
+
+    Returns:
+        gpd.GeoDataFrame: 'id' and the cell polygon, in the row order and CRS of gdf_grid
+    """
+    x, y = gdf_grid.geometry.x.to_numpy(), gdf_grid.geometry.y.to_numpy()
+    half_width, half_height = grid_spacing(x) / 2, grid_spacing(y) / 2
+    cells = [box(a - half_width, b - half_height, a + half_width, b + half_height) for a, b in zip(x, y)]
+    return gpd.GeoDataFrame({"id": gdf_grid["id"].to_numpy()}, geometry=cells, crs=gdf_grid.crs)
+
+
+def overlap_weights(gdf_zones, gdf_cells, columns, crs=AREA_CRS):
+    """Computes the intersection area of every (zone, grid cell) pair that overlaps
+
+    The candidate pairs come from a bulk query of the spatial index of the cells, and only
+    those are intersected, in one vectorized operation.
+
+    Args:
+        gdf_zones (gpd.GeoDataFrame): polygons to regrid to (e.g. communes)
+        gdf_cells (gpd.GeoDataFrame): grid cells with 'id', see grid_cell_polygons
+        columns (list): columns of gdf_zones to keep (e.g. ['insee', 'DEP'])
+        crs (str): projected CRS used for the areas
+
+    Returns:
+        pd.DataFrame: one row per overlapping pair, with columns, 'cell_id' and 'area' (m2)
+    """
+    if gdf_cells.crs is None:
+        gdf_cells = gdf_cells.set_crs(gdf_zones.crs)
+    zones = gdf_zones.geometry.to_crs(crs).reset_index(drop=True)
+    cells = gdf_cells.geometry.to_crs(crs).reset_index(drop=True)
+
+    # query_bulk on geopandas < 0.12, query takes the arrays of geometries since
+    query = getattr(cells.sindex, "query_bulk", cells.sindex.query)
+    zone_positions, cell_positions = query(zones, predicate="intersects")
+
+    areas = zones.iloc[zone_positions].reset_index(drop=True).intersection(cells.iloc[cell_positions].reset_index(drop=True)).area
+    df_weights = gdf_zones[list(columns)].iloc[zone_positions].reset_index(drop=True)
+    df_weights["cell_id"] = gdf_cells["id"].to_numpy()[cell_positions].astype("int32")
+    df_weights["area"] = areas.to_numpy(dtype="float32")
+    return pd.DataFrame(df_weights[df_weights["area"] > 0]).reset_index(drop=True)
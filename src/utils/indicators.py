@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from utils.artifacts import ARTIFACTS_DIR, artifacts_key, read_artifact, write_artifact
+from utils.context import shared_data
+from utils.cube import read_cube
+from utils.data_extraction import load_base_grid
+from utils.era5 import ERA5_PATH, meteo_version
+from utils.profiling import profiled
+from utils.regrid import regrid, zone_weight_matrix
+from utils.rollups import rollups_key
+
+# Daily variables the indicators are computed from
+INDICATOR_VARIABLES = ["Tmin", "Tavg", "Tmax", "precipitation"]
+# Base temperature (°C) of the growing degree days, of the winter cereals
+GDD_BASE = 0.
+# Frost days: Tmin below (°C)
+FROST_THRESHOLD = 0.
+# Heat days: Tmax above each threshold (°C), 25 °C being the heat stress threshold of the grain filling
+HEAT_THRESHOLDS = (25., 30.)
+# Dry days: precipitation below (mm)
+DRY_DAY_THRESHOLD = 1.
+# Phenological windows of the winter cereals (months of the season), for the rainfall
+PHENOLOGICAL_WINDOWS = {
+    "sowing": (9, 10, 11),
+    "tillering": (12, 1, 2),
+    "stem_elongation": (3, 4),
+    "heading": (5,),
+    "grain_filling": (6, 7),
+}
+# Bumped when the computation of the indicators changes, to rebuild them
+INDICATORS_VERSION = 1
+
+
+def indicator_columns():
+    """Names of the indicators, in the order of compute_indicators"""
+    return (
+        ["days", "gdd", "frost_days"]
+        + [f"heat_days_{threshold:g}" for threshold in HEAT_THRESHOLDS]
+        + ["longest_dry_spell", "rain"]
+        + [f"rain_{window}" for window in PHENOLOGICAL_WINDOWS]
+    )
+
+
+def season_codes(dates):
+    """Agricultural season of each date (September of the previous year to August)"""
+    return np.asarray(dates.year + (dates.month > 8))
+
+
+def run_lengths(condition, boundaries=(0,)):
+    """Length of the run of consecutive True ending at each position along the first axis (0 on False)
+
+    A run ends on a False or at the start of the next segment. The run length of each day is its
+    distance to the last False (or to the start of its segment), found with a cumulative maximum,
+    so all the columns (e.g. grid points) are processed at once.
+
+    Args:
+        condition (np.ndarray): boolean array, time first
+        boundaries (np.ndarray): increasing start position of each segment (e.g. season), the first being 0
+
+    Returns:
+        np.ndarray: int32 run lengths, same shape as condition
+    """
+    n = condition.shape[0]
+    shape = (-1,) + (1,) * (condition.ndim - 1)
+    positions = np.arange(n, dtype="int32").reshape(shape)
+    # Day before the start of the segment of each day
+    segment_starts = (np.repeat(boundaries, np.diff(np.r_[boundaries, n])) - 1).astype("int32").reshape(shape)
+
+    last_break = np.where(condition, np.int32(-1), positions)
+    np.maximum.accumulate(last_break, axis=0, out=last_break)
+    np.maximum(last_break, segment_starts, out=last_break)
+    return np.subtract(positions, last_break, out=last_break)
+
+
+def longest_runs(condition, boundaries):
+    """Length of the longest run of consecutive True along the first axis, in each segment, see run_lengths
+
+    Returns:
+        np.ndarray: int32 [segment, ...] longest run lengths
+    """
+    return np.maximum.reduceat(run_lengths(condition, boundaries), boundaries, axis=0)
+
+
+@profiled
+def compute_indicators(cube):
+    """Computes the agro-climatic indicators of every season and grid point, in one pass over the daily arrays
+
+    - 'days': number of days with data (seasons at the ends of the data may be partial)
+    - 'gdd': growing degree days, sum of max(Tavg - GDD_BASE, 0)
+    - 'frost_days': days with Tmin < FROST_THRESHOLD
+    - 'heat_days_<threshold>': days with Tmax > threshold, per HEAT_THRESHOLDS
+    - 'longest_dry_spell': longest run of days with precipitation < DRY_DAY_THRESHOLD
+    - 'rain' and 'rain_<window>': cumulative precipitation over the season and per PHENOLOGICAL_WINDOWS
+
+    Args:
+        cube (MeteoCube): daily data with INDICATOR_VARIABLES
+
+    Returns:
+        (pd.Index, dict): seasons and indicator -> float32 [season, latitude, longitude] array (NaN without data)
+    """
+    codes = season_codes(cube.dates)
+    boundaries = np.flatnonzero(np.r_[True, np.diff(codes) != 0])
+    seasons = pd.Index(codes[boundaries], name="season")
+    tmin, tavg, tmax, precipitation = (cube.values[variable] for variable in INDICATOR_VARIABLES)
+
+    def season_sums(array):
+        return np.add.reduceat(array, boundaries, axis=0, dtype="float64")
+
+    indicators = {}
+    days = season_sums(~np.isnan(tavg))
+    indicators["days"] = days
+    # NaN compare as False, and are not summed
+    with np.errstate(invalid="ignore"):
+        indicators["gdd"] = season_sums(np.fmax(tavg - GDD_BASE, 0.))
+        indicators["frost_days"] = season_sums(tmin < FROST_THRESHOLD)
+        for threshold in HEAT_THRESHOLDS:
+            indicators[f"heat_days_{threshold:g}"] = season_sums(tmax > threshold)
+        indicators["longest_dry_spell"] = longest_runs(precipitation < DRY_DAY_THRESHOLD, boundaries)
+
+    # Rainfall per month, then summed over the months of the season and of each window
+    month_codes = np.asarray(cube.dates.year * 12 + cube.dates.month)
+    month_boundaries = np.flatnonzero(np.r_[True, np.diff(month_codes) != 0])
+    monthly_rain = np.add.reduceat(np.nan_to_num(precipitation), month_boundaries, axis=0, dtype="float64")
+    month_seasons = np.searchsorted(seasons, codes[month_boundaries])
+    months = np.asarray(cube.dates.month)[month_boundaries]
+    windows = {"rain": range(1, 13)}
+    windows.update({f"rain_{window}": window_months for window, window_months in PHENOLOGICAL_WINDOWS.items()})
+    for name, window_months in windows.items():
+        in_window = np.isin(months, list(window_months))
+        indicators[name] = np.zeros(days.shape)
+        np.add.at(indicators[name], month_seasons[in_window], monthly_rain[in_window])
+
+    return seasons, {name: np.where(days > 0, values, np.nan).astype("float32") for name, values in indicators.items()}
+
+
+def indicators_key(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Key of the indicators: key of the rollups (data, communes and regridding) and the indicator parameters"""
+    return artifacts_key(
+        rollups_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes),
+        gdd_base=GDD_BASE,
+        frost_threshold=FROST_THRESHOLD,
+        heat_thresholds=list(HEAT_THRESHOLDS),
+        dry_day_threshold=DRY_DAY_THRESHOLD,
+        windows=PHENOLOGICAL_WINDOWS,
+        version=INDICATORS_VERSION,
+    )
+
+
+def dpt_indicators(cube, seasons, indicators, matrix, labels, gdf_grid):
+    """Aggregates the grid indicators to departments with the area weight matrix, see regrid.zone_weight_matrix
+
+    The department values are area-weighted averages of the grid point values, e.g. the mean
+    longest dry spell of the grid points of the department.
+
+    Returns:
+        pd.DataFrame: indicators indexed by department and season
+    """
+    lat_positions, lon_positions = cube.cell_positions(gdf_grid)
+    columns = list(indicators)
+    cell_values = np.stack([indicators[column][:, lat_positions, lon_positions].T for column in columns], axis=-1)
+    dpt_values = regrid(matrix, cell_values)
+    return pd.DataFrame(
+        dpt_values.reshape(-1, len(columns)),
+        index=pd.MultiIndex.from_product([labels, seasons]),
+        columns=columns,
+    )
+
+
+def build_indicators(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Computes the indicators of every season from the daily data and writes them to artifacts_dir
+
+    - 'indicators_grid': indicators per grid point and season
+    - 'indicators_dpt': indicators per department and season
+
+    Returns:
+        str: key of the written artifacts
+    """
+    key = indicators_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+    cube = read_cube(path_meteo, columns=INDICATOR_VARIABLES)
+    seasons, indicators = compute_indicators(cube)
+
+    matrix, labels = zone_weight_matrix("DEP", path_meteo=path_meteo, artifacts_dir=artifacts_dir, path_gpd_communes=path_gpd_communes, path_df_communes=path_df_communes)
+    write_artifact(cube.to_frame(indicators, seasons), "indicators_grid", key, artifacts_dir=artifacts_dir)
+    write_artifact(dpt_indicators(cube, seasons, indicators, matrix, labels, load_base_grid(path_meteo)),
+                   "indicators_dpt", key, artifacts_dir=artifacts_dir)
+    return key
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_indicators(level="dpt", path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the indicators per season of a level ("grid" or "dpt"), building them first if the data changed"""
+    key = indicators_key(path_meteo, artifacts_dir)
+    df_indicators = read_artifact(f"indicators_{level}", key, artifacts_dir=artifacts_dir)
+    if df_indicators is None:
+        build_indicators(path_meteo, artifacts_dir)
+        df_indicators = read_artifact(f"indicators_{level}", key, artifacts_dir=artifacts_dir)
+    return df_indicators
@@ -0,0 +1,114 @@
+import json
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import mapping
+from utils.profiling import profiled
+
+# Simplification tolerance (degrees) of the map polygons per level of detail, from ~1 km to ~100 m
+MAP_TOLERANCES = {"low": 0.01, "medium": 0.003, "high": 0.001}
+# Decimals kept in the GeoJSON coordinates (~1 m)
+COORDINATE_PRECISION = 5
+
+
+@dataclass
+class MapGeometry:
+    """GeoJSON geometry of the map polygons, serialized once per geometry set and shared by every render
+
+    Attributes:
+        geometries (dict): polygon id ('nearest_id') -> GeoJSON geometry, must not be modified
+        bounds (tuple): (min longitude, min latitude, max longitude, max latitude)
+        nbytes (int): size of the serialized geometry
+    """
+    geometries: dict
+    bounds: tuple
+    nbytes: int
+
+    @property
+    def center(self):
+        """[latitude, longitude] of the center of the bounds"""
+        return [(self.bounds[1] + self.bounds[3]) / 2, (self.bounds[0] + self.bounds[2]) / 2]
+
+
+def simplify_polygons(gdf, tolerance):
+    """Simplifies polygons, without making them invalid (topology-preserving simplification)
+
+    Args:
+        gdf (gpd.GeoDataFrame): polygons
+        tolerance (float): maximum distance between the original and simplified geometries, in CRS units
+
+    Returns:
+        gpd.GeoDataFrame: copy of gdf with the simplified geometry
+    """
+    return gdf.assign(geometry=gdf.geometry.simplify(tolerance, preserve_topology=True))
+
+
+def _ring_coordinates(ring, precision):
+    return np.round(np.asarray(ring.coords)[:, :2], precision).tolist()
+
+
+def _polygon_coordinates(polygon, precision):
+    return [_ring_coordinates(polygon.exterior, precision)] + [_ring_coordinates(ring, precision) for ring in polygon.interiors]
+
+
+def geometry_to_geojson(geometry, precision=COORDINATE_PRECISION):
+    """GeoJSON mapping of a geometry with rounded coordinates"""
+    if geometry.geom_type == "Polygon":
+        return {"type": "Polygon", "coordinates": _polygon_coordinates(geometry, precision)}
+    if geometry.geom_type == "MultiPolygon":
+        return {"type": "MultiPolygon", "coordinates": [_polygon_coordinates(polygon, precision) for polygon in geometry.geoms]}
+    return mapping(geometry)
+
+
+def build_map_geometry(gdf_geom, precision=COORDINATE_PRECISION):
+    """Precomputes the GeoJSON geometry of the polygons of the map
+
+    Args:
+        gdf_geom (gpd.GeoDataFrame): polygons with their 'nearest_id', in WGS84
+
+    Returns:
+        MapGeometry: geometry shared by the renders of the map
+    """
+    geometries = {
+        int(polygon_id): geometry_to_geojson(geometry, precision)
+        for polygon_id, geometry in zip(gdf_geom["nearest_id"], gdf_geom.geometry)
+        if geometry is not None and not geometry.is_empty
+    }
+    nbytes = len(json.dumps(list(geometries.values())))
+    return MapGeometry(geometries, tuple(float(bound) for bound in gdf_geom.total_bounds), nbytes)
+
+
+@profiled
+def feature_collection(map_geometry, df_values, columns):
+    """Attaches the values of a render to the precomputed geometry
+
+    Only the properties are built per render, the geometry objects are shared.
+
+    Args:
+        map_geometry (MapGeometry): precomputed geometry
+        df_values (pd.DataFrame): values indexed by polygon id
+        columns (list): columns of df_values set as feature properties
+
+    Returns:
+        dict: GeoJSON FeatureCollection with one feature per polygon of map_geometry
+    """
+    df_values = df_values.reindex(list(map_geometry.geometries))[columns]
+    # NaN is not valid JSON
+    records = df_values.astype(object).where(df_values.notna(), None).to_dict(orient="index")
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "id": str(polygon_id), "properties": {"id": polygon_id, **records[polygon_id]}, "geometry": geometry}
+            for polygon_id, geometry in map_geometry.geometries.items()
+        ],
+    }
+
+
+def payload_size(data):
+    """Size in bytes of a GeoJSON payload (str, dict or GeoDataFrame) once serialized"""
+    if isinstance(data, str):
+        return len(data.encode())
+    if isinstance(data, pd.DataFrame):
+        return len(data.to_json().encode())
+    return len(json.dumps(data).encode())
@@ -1,5 +1,10 @@
 import folium
+import numpy as np
+from branca.colormap import StepColormap
+from branca.utilities import color_brewer
 from folium.features import GeoJsonTooltip
+from utils.map_geometry import feature_collection
+from utils.profiling import profiled
 
 DICT_THRESHOLDS = {
     'precipitation': [0., 1., 2., 3., 4., 5.],
@@ -11,42 +16,104 @@ DICT_THRESHOLDS = {
     'ws10_mean': [0., 2., 4., 6., 8., 10.]
 }
 
-def create_map(geo_df, geojson_data, meteo_column):
+# Number of color bins of the data-driven scales
+N_BINS = 6
+# Color of the polygons without value
+NAN_COLOR = "black"
+
+
+def compute_thresholds(values, method="quantile", n_bins=N_BINS):
+    """Computes the bin edges of a color scale from the values of a variable
+
+    Args:
+        values (np.ndarray): values of the variable, NaN are ignored
+        method (str): "quantile" (bins with the same number of values) or "range" (equal-width bins
+            between the 1st and 99th percentiles)
+        n_bins (int): number of bins
+
+    Returns:
+        list: increasing bin edges (n_bins + 1 at most)
+    """
+    values = np.asarray(values, dtype="float64")
+    values = values[~np.isnan(values)]
+    if method == "quantile":
+        edges = np.quantile(values, np.linspace(0., 1., n_bins + 1))
+    elif method == "range":
+        edges = np.linspace(*np.percentile(values, [1., 99.]), n_bins + 1)
+    else:
+        raise ValueError(f"Unknown thresholds method: {method}")
+    # Rounded for the legend, bins collapsed by the rounding (e.g. many zero precipitations) are merged
+    return np.unique(np.round(edges, 1)).tolist()
+
+
+def symmetric_thresholds(values, n_bins=N_BINS, min_bound=0.1):
+    """Bin edges of a color scale centred on 0 (e.g. of anomalies), up to the 99th percentile of the absolute values
+
+    Never collapses, unlike compute_thresholds on values concentrated around 0.
+
+    Args:
+        values (np.ndarray): values of the variable, NaN are ignored
+        n_bins (int): number of bins
+        min_bound (float): smallest bound of the scale, e.g. for a month without anomaly
+
+    Returns:
+        list: n_bins + 1 increasing bin edges, from -bound to bound
+    """
+    values = np.abs(np.asarray(values, dtype="float64"))
+    values = values[~np.isnan(values)]
+    bound = np.percentile(values, 99.) if len(values) else 0.
+    # Rounded up for the legend
+    bound = max(np.ceil(bound * 10.) / 10., min_bound)
+    return np.round(np.linspace(-bound, bound, n_bins + 1), 2).tolist()
+
+
+def bin_values(values, thresholds):
+    """Bin of each value, values outside of the thresholds are clipped to the first or last bin
+
+    Returns:
+        np.ndarray: bin index (0 to len(thresholds) - 2) of each value, -1 for NaN
+    """
+    values = np.asarray(values, dtype="float64")
+    bins = np.clip(np.searchsorted(thresholds, values, side="right") - 1, 0, len(thresholds) - 2)
+    return np.where(np.isnan(values), -1, bins)
+
+
+@profiled
+def create_map(df_values, meteo_column, map_geometry, thresholds):
+    """Creates the map of a meteorological variable per grid cell polygon
+
+    The polygons are drawn by a single GeoJson layer, which holds both the colors and the tooltips,
+    and whose geometry (and center) is the precomputed map_geometry: only the values are attached
+    per render. df_values is not modified.
+
+    Args:
+        df_values (pd.DataFrame): values indexed by grid cell id ('nearest_id' of the polygons)
+        meteo_column (str): column of df_values to display
+        map_geometry (MapGeometry): polygons of the map, see data_extraction.load_map_geometry
+        thresholds (list): bin edges of the colors, e.g. compute_thresholds or snapshots.load_thresholds
+
+    Returns:
+        folium.Map: map with the layer and its legend
+    """
     # Create a Folium map object
-    m = folium.Map(
-        location=[
-            geo_df["geometry"].centroid.y.mean(),
-            geo_df["geometry"].centroid.x.mean(),
-        ],
-        zoom_start=6,
-    )
-
-    # Define the threshold scale
-    threshold_scale = DICT_THRESHOLDS[meteo_column]
-    geo_df['capped_value'] = geo_df[meteo_column].apply(lambda x: max(min(x, threshold_scale[-1]), threshold_scale[0]))
-    columns = ['id', 'capped_value']
-
-    # Create a Choropleth layer (colors based on the attribute represented)
-    choropleth = folium.Choropleth(
-        geo_data=geojson_data,
-        data=geo_df,
-        columns=columns,
-        key_on="feature.properties.id",
-        fill_color="YlGnBu",  # Make sure this color scale is valid
-        threshold_scale=threshold_scale,
-        fill_opacity=0.7,
-        line_opacity=0.2,
-        legend_name=meteo_column,
-    ).add_to(m)
+    m = folium.Map(location=map_geometry.center, zoom_start=6)
+
+    # Color of each polygon from its bin (same colors as a YlGnBu choropleth), and the legend
+    palette = color_brewer("YlGnBu", n=len(thresholds) - 1)
+    colormap = StepColormap(palette, index=thresholds, vmin=thresholds[0], vmax=thresholds[-1], caption=meteo_column)
+    colors = np.array(palette + [NAN_COLOR])[bin_values(df_values[meteo_column].to_numpy(), thresholds)]
+    fill_colors = dict(zip(df_values.index.astype(str), colors.tolist()))
 
-    # Create a GeoJson layer with tooltips
-    geojson_layer = folium.GeoJson(
-        geojson_data,
+    # Single layer with the colors (based on the attribute represented) and the tooltips
+    folium.GeoJson(
+        feature_collection(map_geometry, df_values, [meteo_column]),
         name="Communes",
         style_function=lambda feature: {
+            "fillColor": fill_colors.get(feature["id"], NAN_COLOR),
+            "fillOpacity": 0.7,
             "color": "black",
             "weight": 0.5,
-            "fillOpacity": 0.1,
+            "opacity": 0.2,
         },
         tooltip=GeoJsonTooltip(
             fields=[meteo_column],
@@ -55,6 +122,7 @@ def create_map(geo_df, geojson_data, meteo_column):
             sticky=True,
         ),
     ).add_to(m)
+    colormap.add_to(m)
 
     # Add the layer control
     folium.LayerControl().add_to(m)
@@ -1,20 +1,58 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from utils.data_extraction import load_meteo_data_date, load_meteo_data
+from utils.climatology import compute_monthly_climatology
+from utils.cube import MeteoCube, cube_from_frame
+from utils.data_extraction import load_meteo_data_date, load_meteo_data, load_meteo_date_range
+from utils.era5 import ERA5_PATH
+from utils.grid import polygon_areas
+from utils.profiling import profiled
 
 METEOROLOGICAL_COLUMNS = ['precipitation', 'r_min', 'ssrd_mean', 'Tmax', 'Tavg', 'Tmin', 'ws10_mean']
 
-def convert_lat_long_to_communes(df_meteo, gdf_geom):
+def season_dates(year):
+    """First and last dates of the agricultural season of a year (September of the previous year to August)"""
+    return pd.to_datetime(f"{year-1}-09-01"), pd.to_datetime(f"{year}-08-31")
+
+def season_range(first_date, last_date):
+    """First and last agricultural seasons (years) with data between two dates"""
+    return first_date.year, last_date.year + (last_date.month > 8)
+
+def available_seasons(path=ERA5_PATH):
+    """First and last agricultural seasons (years) with data, following the ingested ERA5 data"""
+    return season_range(*load_meteo_date_range(path))
+
+def climatology_to_season(df_climatology, year):
+    """Dates a monthly climatology on the months of the agricultural season of a year
+
+    Args:
+        df_climatology (pd.DataFrame): must have 'month' as (last) index level
+        year (int): year of the season, months from September are dated on the previous year
+
+    Returns:
+        pd.DataFrame: same values with a 'date' level (first day of the month) instead of 'month'
+    """
+    months = df_climatology.index.get_level_values('month')
+    dates = pd.to_datetime(pd.DataFrame({'year': year - (months > 8), 'month': months, 'day': 1}))
+
+    df_season = df_climatology.copy()
+    levels = [df_season.index.get_level_values(name) for name in df_season.index.names if name != 'month']
+    df_season.index = pd.MultiIndex.from_arrays(levels + [pd.DatetimeIndex(dates, name='date')]) if levels else pd.DatetimeIndex(dates, name='date')
+    return df_season
+
+@profiled
+def convert_lat_long_to_communes(df_meteo, gdf_geom, path_meteo=ERA5_PATH):
     """Converts a df_meteo to the communes geometry (with dpt feature)
 
     Args:
         df_meteo (pd.DataFrame): must have latitude and longitude as index
         gdf_geom (gdp.GeoDataFrame): communes gdf with corresponding geometry
+        path_meteo (str): ERA5 data the grid point ids come from
 
     Returns:
         gpd.GeoDataFrame: geodataframe with communes geometry and corresponding meteorological values
     """
-    gdf_base_meteo = load_meteo_data_date()
+    gdf_base_meteo = load_meteo_data_date(path_meteo)
     lat_lon_to_id = gdf_base_meteo.reset_index().drop_duplicates(subset=['latitude', 'longitude']).set_index(['latitude', 'longitude'])['id']
 
     df_meteo_with_id = df_meteo.copy()
@@ -36,79 +74,63 @@ def convert_lat_long_to_communes(df_meteo, gdf_geom):
 
     return gdf_communes_meteo
 
-# Function to calculate weighted average for a group
-def weighted_avg(group, cols, weight_col):
-    weighted_avgs = {}
-    total_weight = group[weight_col].sum()
-    for col in cols:
-        weighted_avgs[col] = (group[col] * group[weight_col]).sum() / total_weight
-    return pd.Series(weighted_avgs)
+def weighted_average(df, by, weights, columns=METEOROLOGICAL_COLUMNS):
+    """Weighted average of several columns per group, with a single grouped sum
+
+    Args:
+        df (pd.DataFrame): values to average
+        by (list): grouping keys, column or index level names (e.g. ['DEP', 'date'])
+        weights (str or array-like): weight column name, or weights aligned with df
+        columns (list): columns to average
 
-def surface_dpt_average(gdf_meteo):
+    Returns:
+        pd.DataFrame: weighted averages indexed by the grouping keys
+    """
+    if isinstance(weights, str):
+        weights = df[weights]
+    weights = np.asarray(weights, dtype='float64')
+
+    # Weight x value products of every column at once, reduced together with the weights
+    df_products = pd.DataFrame(df[columns].to_numpy(dtype='float64') * weights[:, None], columns=columns)
+    df_products['weight'] = weights
+    keys = [df[key].to_numpy() if key in df.columns else df.index.get_level_values(key) for key in by]
+    sums = df_products.groupby([pd.Index(key, name=name) for key, name in zip(keys, by)], sort=True).sum()
+
+    return sums[columns].div(sums['weight'], axis=0)
+
+@profiled
+def surface_dpt_average(gdf_meteo, by='DEP'):
     """Gets weighted average for departments based on a gpd dataframe
 
     Args:
         gdf_meteo (gpd.GeoDataFrame): needs to have communes geometry, meteorological data and dates
+        by (str): zone column to average on ('DEP' for departments, or 'REG', a custom zone...)
 
     Returns:
         gpd.GeoDataFrame: dataframe with department as index, date as column and corresponding meteorological data
     """
-    # Calculate the area of each polygon if not already present
-    gdf_meteo['area'] = gdf_meteo.geometry.area
-
-    # Function to calculate weighted average for a group
-    def weighted_avg(group, cols, weight_col):
-        weighted_avgs = {}
-        total_weight = group[weight_col].sum()
-        for col in cols:
-            weighted_avgs[col] = (group[col] * group[weight_col]).sum() / total_weight
-        return pd.Series(weighted_avgs)
-
-    # Group by 'department' and 'date', then apply the weighted average function
-    result = gdf_meteo.groupby(['DEP', 'date']).apply(weighted_avg, METEOROLOGICAL_COLUMNS, 'area')
+    # Use the polygon areas cached with the communes geometry, compute them only if not already present
+    areas = gdf_meteo['area'] if 'area' in gdf_meteo.columns else polygon_areas(gdf_meteo)
+
+    result = weighted_average(gdf_meteo, [by, 'date'], areas, METEOROLOGICAL_COLUMNS)
     result.reset_index(level='date', inplace=True)
     return result
 
+@profiled
 def get_monthly_mean(df_meteo, year=None, compare_year=2020):
-    df_meteo_reset = df_meteo.reset_index(level='date')
+    """Gets monthly means per grid point for an agricultural season, or the monthly climatology
+
+    Args:
+        df_meteo (pd.DataFrame or MeteoCube): daily data, indexed by latitude, longitude and date for a frame
+        year (int, optional): season to extract (September of year - 1 to August of year)
+        compare_year (int): if year is None, season on which the climatology (mean over all years) is dated
+
+    Returns:
+        pd.DataFrame: indexed by latitude and longitude, with 'date' (first day of the month) and the meteorological values
+    """
+    cube = df_meteo if isinstance(df_meteo, MeteoCube) else cube_from_frame(df_meteo)
+    monthly_climatology = compute_monthly_climatology(cube)
 
     if year is not None:
-        # Filter the data from September of the selected year to August of the next year
-        start_date = pd.to_datetime(f"{year-1}-09-01")
-        end_date = pd.to_datetime(f"{year}-08-31")
-        filtered_df = df_meteo_reset[(df_meteo_reset['date'] >= start_date) & (df_meteo_reset['date'] <= end_date)]
-
-        # Group by latitude, longitude, year, and month, then calculate the mean
-        monthly_means = filtered_df.groupby([pd.Grouper(level='latitude'), 
-                            pd.Grouper(level='longitude'), 
-                            filtered_df['date'].dt.year.rename('year'), 
-                            filtered_df['date'].dt.month.rename('month')]).mean()
-        
-        # Reset index to turn 'year' and 'month' back into columns
-        monthly_means = monthly_means.reset_index()
-
-        # Create a new 'date' column that is the first day of each month and year
-        monthly_means['date'] = pd.to_datetime(monthly_means['year'].astype(str) + '-' + 
-                                       monthly_means['month'].astype(str) + '-01')
-
-    else:
-        filtered_df = df_meteo_reset
-        # Group by latitude, longitude, year, and month, then calculate the mean
-        monthly_means = filtered_df.groupby([pd.Grouper(level='latitude'), 
-                            pd.Grouper(level='longitude'), 
-                            filtered_df['date'].dt.month.rename('month')]).mean()
-        monthly_means['year'] = monthly_means.index.get_level_values('month').map(lambda x: compare_year if x <= 8 else compare_year-1)
-
-        # Reset index to turn 'year' and 'month' back into columns
-        monthly_means = monthly_means.reset_index()
-
-        # Create a new 'date' column that is the first day of each month and year
-        monthly_means['date'] = pd.to_datetime(monthly_means['year'].astype(str) + '-' + 
-                                       monthly_means['month'].astype(str) + '-01')
-
-    # Drop the 'year' and 'month' columns as they are now redundant with the 'date' column
-    monthly_means.drop(['year', 'month'], axis=1, inplace=True)
-
-    # Set 'latitude' and 'longitude' back as the index
-    monthly_means.set_index(['latitude', 'longitude'], inplace=True)
-    return monthly_means
+        return monthly_climatology.season(year)
+    return monthly_climatology.climatology_season(compare_year)
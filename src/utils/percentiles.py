@@ -0,0 +1,337 @@
+import numpy as np
+import pandas as pd
+from utils.artifacts import ARTIFACTS_DIR, artifacts_key, read_artifact, write_artifact
+from utils.context import shared_data
+from utils.cube import MeteoCube, read_cube
+from utils.data_extraction import load_base_grid
+from utils.era5 import ERA5_PATH, meteo_date_range, meteo_version
+from utils.indicators import DRY_DAY_THRESHOLD, run_lengths
+from utils.meteo import METEOROLOGICAL_COLUMNS
+from utils.profiling import profiled
+from utils.regrid import grid_cell_ids
+from utils.rollups import LEVEL_KEYS, query_rollup, rollups_key
+
+# Percentiles of the daily climatology
+PERCENTILES = (10, 50, 90)
+# Days of the moving window centred on each calendar day: the percentiles of a day pool the values
+# of the days of its window over every year
+WINDOW_DAYS = 15
+# Days of the calendar of the climatology, February 29 sharing the percentiles of February 28
+CALENDAR_DAYS = 365
+# Extreme events: variable, direction, percentile exceeded, minimum consecutive days and minimum value
+EVENTS = {
+    "heatwave": ("Tmax", "above", 90, 3, None),
+    "cold_snap": ("Tmin", "below", 10, 3, None),
+    "heavy_rain": ("precipitation", "above", 90, 1, DRY_DAY_THRESHOLD),
+}
+# Variables of the grid percentiles, those of the events
+GRID_VARIABLES = sorted({variable for variable, *_ in EVENTS.values()})
+# Years of daily grid data read at once
+CHUNK_YEARS = 5
+# Memory budget of the windowed samples sorted at once, the calendar days being processed in blocks
+BLOCK_BYTES = 64 * 1024 ** 2
+# Memory budget of the daily history of the grid points whose percentiles are computed at once, the grid
+# being processed in bands of latitudes
+BAND_BYTES = 256 * 1024 ** 2
+# Bumped when the computation of the percentiles or of the events changes, to rebuild them
+PERCENTILES_VERSION = 1
+
+
+def percentile_column(variable, percentile):
+    return f"{variable}_p{percentile:g}"
+
+
+def calendar_days(dates):
+    """Day of the 365-day calendar (0 to 364) of each date, February 29 being February 28"""
+    day_of_year = np.asarray(dates.dayofyear)
+    return day_of_year - 1 - (np.asarray(dates.is_leap_year) & (day_of_year > 59))
+
+
+def calendar_array(dates, values, years):
+    """Arranges daily values by year and calendar day, February 29 being left out
+
+    Args:
+        dates (pd.DatetimeIndex): dates of the first axis of values
+        values (np.ndarray): [time, ...] values
+        years (np.ndarray): years of the first axis of the result
+
+    Returns:
+        np.ndarray: float32 [year, CALENDAR_DAYS, ...] values, NaN on the days without data
+    """
+    array = np.full((len(years), CALENDAR_DAYS) + values.shape[1:], np.nan, dtype="float32")
+    kept = ~((dates.month == 2) & (dates.day == 29))
+    array[np.searchsorted(years, dates.year[kept]), calendar_days(dates[kept])] = values[kept]
+    return array
+
+
+def sorted_quantiles(samples, quantiles):
+    """Quantiles along the second axis of sorted samples, NaN (sorted last) being ignored
+
+    The linear interpolation of np.quantile, on the number of valid samples of each column.
+
+    Args:
+        samples (np.ndarray): [block, sample, cell] values sorted along the sample axis
+        quantiles (np.ndarray): quantiles in [0, 1]
+
+    Returns:
+        np.ndarray: float32 [quantile, block, cell] values, NaN without valid sample
+    """
+    counts = (~np.isnan(samples)).sum(axis=1)
+    positions = quantiles[:, None, None] * np.maximum(counts - 1, 0)
+    lower = np.floor(positions).astype("int64")
+    upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+    fraction = (positions - lower).astype("float32")
+    lower_values = np.take_along_axis(samples, lower.transpose(1, 0, 2), axis=1).transpose(1, 0, 2)
+    upper_values = np.take_along_axis(samples, upper.transpose(1, 0, 2), axis=1).transpose(1, 0, 2)
+    values = lower_values + fraction * (upper_values - lower_values)
+    return np.where(counts > 0, values, np.nan).astype("float32")
+
+
+@profiled
+def window_percentiles(calendar_values, percentiles=PERCENTILES, window=WINDOW_DAYS, max_bytes=BLOCK_BYTES):
+    """Percentiles of each calendar day over the values of its moving window in every year
+
+    The window wraps around the end of the year. The calendar days are processed in blocks whose
+    windowed samples fit in max_bytes, each block being sorted once for all the percentiles.
+
+    Args:
+        calendar_values (np.ndarray): [year, CALENDAR_DAYS, ...] values, see calendar_array
+
+    Returns:
+        np.ndarray: float32 [percentile, CALENDAR_DAYS, ...] values
+    """
+    n_years, n_days = calendar_values.shape[:2]
+    cells_shape = calendar_values.shape[2:]
+    # Calendar day first, so that the windows of a block are gathered as a [day, window, year, cell] array
+    values = calendar_values.reshape(n_years, n_days, -1).transpose(1, 0, 2)
+    n_cells = values.shape[2]
+    half = window // 2
+    block = max(1, int(max_bytes // (n_years * window * max(n_cells, 1) * values.itemsize)))
+    quantiles = np.asarray(percentiles, dtype="float64") / 100.
+
+    result = np.empty((len(quantiles), n_days, n_cells), dtype="float32")
+    for start in range(0, n_days, block):
+        days = np.arange(start, min(start + block, n_days))
+        window_days = (days[:, None] + np.arange(-half, window - half)[None, :]) % n_days
+        samples = values[window_days].reshape(len(days), window * n_years, n_cells)
+        samples.sort(axis=1)
+        result[:, days] = sorted_quantiles(samples, quantiles)
+    return result.reshape((len(quantiles), n_days) + cells_shape)
+
+
+def level_percentiles(df_daily, keys, percentiles=PERCENTILES, window=WINDOW_DAYS):
+    """Calendar day percentiles of daily means indexed by keys + ['date'] (e.g. the department rollups)
+
+    Returns:
+        pd.DataFrame: '<variable>_p<percentile>' columns indexed by keys + ['calendar_day'] (1 to 365)
+    """
+    # One column per (variable, keys), dates as rows
+    df_wide = df_daily.unstack(keys) if keys else df_daily
+    dates = pd.DatetimeIndex(df_wide.index)
+    values = window_percentiles(calendar_array(dates, df_wide.to_numpy(dtype="float32"), np.unique(dates.year)), percentiles, window)
+
+    days = pd.RangeIndex(1, CALENDAR_DAYS + 1, name="calendar_day")
+    labels = df_wide[df_daily.columns[0]].columns if keys else None
+    index = pd.MultiIndex.from_product([labels, days]) if keys else days
+    columns = {}
+    for variable in df_daily.columns:
+        positions = df_wide.columns.get_loc(variable)
+        for i, percentile in enumerate(percentiles):
+            # [calendar day, label] values, in the (label, calendar day) order of the index
+            columns[percentile_column(variable, percentile)] = values[i][:, positions].T.ravel()
+    return pd.DataFrame(columns, index=index)
+
+
+def flag_runs(condition, min_days):
+    """Days belonging to a run of at least min_days consecutive True along the first axis"""
+    if min_days <= 1:
+        return condition
+    # A run of min_days ending at a day covers the min_days - 1 days before it
+    run_ends = run_lengths(condition) >= min_days
+    flags = run_ends.copy()
+    for shift in range(1, min_days):
+        flags[:-shift] |= run_ends[shift:]
+    return flags
+
+
+def detect_events(dates, values, percentiles, events=EVENTS):
+    """Flags the days of each extreme event, comparing every day to the percentiles of its calendar day
+
+    Args:
+        dates (pd.DatetimeIndex): consecutive days of the first axis of values
+        values (dict): variable -> [time, ...] daily values
+        percentiles (dict): '<variable>_p<percentile>' -> [CALENDAR_DAYS, ...] percentiles on the same grid
+        events (dict): see EVENTS
+
+    Returns:
+        dict: event -> bool [time, ...] array
+    """
+    days = calendar_days(dates)
+    flags = {}
+    for event, (variable, direction, percentile, min_days, min_value) in events.items():
+        threshold = percentiles[percentile_column(variable, percentile)][days]
+        with np.errstate(invalid="ignore"):
+            exceeded = values[variable] > threshold if direction == "above" else values[variable] < threshold
+            if min_value is not None:
+                exceeded &= values[variable] >= min_value
+        flags[event] = flag_runs(exceeded, min_days)
+    return flags
+
+
+def percentiles_key(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Key of the percentiles and events: key of the rollups and the percentile and event parameters"""
+    return artifacts_key(
+        rollups_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes),
+        percentiles=list(PERCENTILES),
+        window=WINDOW_DAYS,
+        events={event: list(definition) for event, definition in EVENTS.items()},
+        version=PERCENTILES_VERSION,
+    )
+
+
+def _year_chunks(path_meteo, chunk_years):
+    first_date, last_date = meteo_date_range(path_meteo)
+    years = np.arange(first_date.year, last_date.year + 1)
+    return years, [years[i:i + chunk_years] for i in range(0, len(years), chunk_years)]
+
+
+def _grid_positions(cube, latitudes, longitudes):
+    return np.searchsorted(latitudes, cube.latitudes), np.searchsorted(longitudes, cube.longitudes)
+
+
+@profiled
+def compute_grid_percentiles(path_meteo=ERA5_PATH, chunk_years=CHUNK_YEARS, variables=GRID_VARIABLES, max_bytes=BAND_BYTES):
+    """Calendar day percentiles per grid point, by bands of latitudes
+
+    The (year, calendar day) values of the variables over the whole history are needed at once for
+    the percentiles of a grid point, so the grid is split in bands of latitudes whose history fits in
+    max_bytes. The daily data is read chunk_years at a time for each band and only the rows of the band
+    are kept: the memory used is max_bytes plus a chunk of daily data whatever the number of years,
+    the data being read once per band. The percentiles are computed on the grid points with data, see
+    window_percentiles.
+
+    Returns:
+        (np.ndarray, np.ndarray, dict): latitudes, longitudes and '<variable>_p<percentile>' ->
+        float32 [CALENDAR_DAYS, latitude, longitude] array
+    """
+    years, chunks = _year_chunks(path_meteo, chunk_years)
+    gdf_grid = load_base_grid(path_meteo)
+    latitudes = np.unique(gdf_grid.index.get_level_values("latitude"))
+    longitudes = np.unique(gdf_grid.index.get_level_values("longitude"))
+    # float32 history of the variables of one row of latitude
+    row_bytes = len(years) * CALENDAR_DAYS * len(longitudes) * len(variables) * 4
+    band_size = max(1, int(max_bytes // row_bytes))
+
+    percentiles = {percentile_column(variable, percentile): np.full((CALENDAR_DAYS, len(latitudes), len(longitudes)), np.nan, dtype="float32")
+                   for variable in variables for percentile in PERCENTILES}
+    for band_start in range(0, len(latitudes), band_size):
+        band = slice(band_start, min(band_start + band_size, len(latitudes)))
+        n_band = band.stop - band.start
+        calendar_values = {variable: np.full((len(years), CALENDAR_DAYS, n_band, len(longitudes)), np.nan, dtype="float32")
+                           for variable in variables}
+        for chunk in chunks:
+            cube = read_cube(path_meteo, start_date=f"{chunk[0]}-01-01", end_date=f"{chunk[-1]}-12-31", columns=variables)
+            lat_positions, lon_positions = _grid_positions(cube, latitudes, longitudes)
+            in_band = (lat_positions >= band.start) & (lat_positions < band.stop)
+            if not in_band.any():
+                continue
+            year_positions = np.searchsorted(years, chunk)
+            for variable in variables:
+                values = calendar_array(cube.dates, cube.values[variable][:, in_band], chunk)
+                calendar_values[variable][np.ix_(year_positions, np.arange(CALENDAR_DAYS), lat_positions[in_band] - band.start, lon_positions)] = values
+            del cube
+
+        for variable in variables:
+            # Grid points with data only (the extraction does not fill the rectangle of the grid)
+            values = calendar_values.pop(variable).reshape(len(years), CALENDAR_DAYS, -1)
+            cells = np.flatnonzero(~np.isnan(values).all(axis=(0, 1)))
+            variable_percentiles = np.full((len(PERCENTILES), CALENDAR_DAYS, values.shape[2]), np.nan, dtype="float32")
+            variable_percentiles[:, :, cells] = window_percentiles(values[:, :, cells])
+            for i, percentile in enumerate(PERCENTILES):
+                percentiles[percentile_column(variable, percentile)][:, band] = variable_percentiles[i].reshape(CALENDAR_DAYS, n_band, len(longitudes))
+    return latitudes, longitudes, percentiles
+
+
+@profiled
+def compute_grid_events(latitudes, longitudes, percentiles, path_meteo=ERA5_PATH, chunk_years=CHUNK_YEARS):
+    """Detects the extreme events of every day and grid point, reading the daily data chunk_years at a time
+
+    Each chunk is read with the days around it that may be part of a run of its first or last days.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): days of each event per grid point and month (indexed by latitude,
+        longitude and 'date', the first day of the month, with the grid cell 'id') and share of the grid
+        points in each event per day
+    """
+    _, chunks = _year_chunks(path_meteo, chunk_years)
+    gdf_grid = load_base_grid(path_meteo)
+    overlap = max(min_days for _, _, _, min_days, _ in EVENTS.values()) - 1
+    days = np.arange(CALENDAR_DAYS)
+
+    monthly, daily = [], []
+    for chunk in chunks:
+        start_date, end_date = pd.Timestamp(f"{chunk[0]}-01-01"), pd.Timestamp(f"{chunk[-1]}-12-31")
+        cube = read_cube(path_meteo, start_date=start_date - pd.Timedelta(days=overlap), end_date=end_date + pd.Timedelta(days=overlap),
+                         columns=GRID_VARIABLES)
+        lat_positions, lon_positions = _grid_positions(cube, latitudes, longitudes)
+        grid_percentiles = {column: array[np.ix_(days, lat_positions, lon_positions)] for column, array in percentiles.items()}
+        flags = detect_events(cube.dates, cube.values, grid_percentiles)
+
+        kept = (cube.dates >= start_date) & (cube.dates <= end_date)
+        dates = cube.dates[kept]
+        with_data = ~np.isnan(cube.values[GRID_VARIABLES[0]][kept])
+        flags = {event: event_flags[kept] for event, event_flags in flags.items()}
+        chunk_cube = cube.sel_dates(start_date, end_date)
+        codes, months = pd.factorize(dates.to_period("M"), sort=True)
+        boundaries = np.flatnonzero(np.r_[True, np.diff(codes) != 0])
+        counts = {event: np.add.reduceat(event_flags, boundaries, axis=0, dtype="float32") for event, event_flags in flags.items()}
+        # Grid points without data are not counted
+        counts = {event: np.where(with_data[boundaries], event_counts, np.nan) for event, event_counts in counts.items()}
+        monthly.append(chunk_cube.to_frame(counts, pd.PeriodIndex(months).to_timestamp().rename("date")))
+        n_points = with_data.sum(axis=(1, 2))
+        daily.append(pd.DataFrame({event: event_flags.sum(axis=(1, 2)) / np.maximum(n_points, 1) for event, event_flags in flags.items()},
+                                  index=dates.rename("date")))
+    df_monthly = pd.concat(monthly).sort_index()
+    df_monthly.insert(0, "id", grid_cell_ids(df_monthly, gdf_grid))
+    return df_monthly, pd.concat(daily)
+
+
+def build_percentiles(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, chunk_years=CHUNK_YEARS, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Computes the percentile climatologies and the extreme events and writes them to artifacts_dir
+
+    - 'percentiles_grid': calendar day percentiles of the event variables per grid point
+    - 'percentiles_dpt' and 'percentiles_area': calendar day percentiles of every variable, from the
+      department and study area daily means
+    - 'events_grid_monthly': days of each event per grid point and month
+    - 'events_area_daily': share of the grid points in each event per day
+
+    Returns:
+        str: key of the written artifacts
+    """
+    key = percentiles_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+    latitudes, longitudes, percentiles = compute_grid_percentiles(path_meteo, chunk_years)
+    days = pd.RangeIndex(1, CALENDAR_DAYS + 1, name="calendar_day")
+    df_grid = MeteoCube(pd.DatetimeIndex([]), latitudes, longitudes, percentiles).to_frame(periods=days)
+    write_artifact(df_grid, "percentiles_grid", key, artifacts_dir=artifacts_dir)
+
+    for level in ("dpt", "area"):
+        df_daily = query_rollup(level, "daily", columns=METEOROLOGICAL_COLUMNS, path_meteo=path_meteo, artifacts_dir=artifacts_dir,
+                                path_gpd_communes=path_gpd_communes, path_df_communes=path_df_communes)
+        write_artifact(level_percentiles(df_daily, LEVEL_KEYS[level]), f"percentiles_{level}", key, artifacts_dir=artifacts_dir)
+
+    df_monthly, df_daily_events = compute_grid_events(latitudes, longitudes, percentiles, path_meteo, chunk_years)
+    write_artifact(df_monthly, "events_grid_monthly", key, artifacts_dir=artifacts_dir)
+    write_artifact(df_daily_events, "events_area_daily", key, artifacts_dir=artifacts_dir)
+    return key
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_percentiles(name, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Loads a percentile or event table ("percentiles_<level>", "events_grid_monthly" or "events_area_daily"),
+    building them first if the data changed"""
+    key = percentiles_key(path_meteo, artifacts_dir)
+    df = read_artifact(name, key, artifacts_dir=artifacts_dir)
+    if df is None:
+        build_percentiles(path_meteo, artifacts_dir)
+        df = read_artifact(name, key, artifacts_dir=artifacts_dir)
+    return df
@@ -0,0 +1,139 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the maximum resident memory is then not reported
+    resource = None
+
+# JSON-lines file the stage records are appended to, none by default
+PROFILE_LOG = os.environ.get("PROFILE_LOG")
+# Peak Python memory of each stage with tracemalloc, which slows down allocations: off by default
+PROFILE_MEMORY = os.environ.get("PROFILE_MEMORY", "0") == "1"
+# Number of records kept in memory for the whole process
+MAX_RECORDS = 1000
+
+_records = deque(maxlen=MAX_RECORDS)
+# Current run and stack of open stages, per thread (each Streamlit session runs its script in its own thread)
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def count_rows(value):
+    """Number of rows of a frame or an array, None for other values"""
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple) and len(shape):
+        return int(shape[0])
+    return None
+
+
+def start_run(name):
+    """Starts a new run (e.g. a rerun of a page) in the current thread: the next stages are recorded in it"""
+    _local.run = {"name": name, "start": time.time(), "records": []}
+
+
+def run_records():
+    """Records of the stages of the current run of the thread, in their order of start"""
+    run = getattr(_local, "run", None)
+    return sorted(run["records"], key=lambda record: record["start"]) if run is not None else []
+
+
+def recent_records():
+    """Last MAX_RECORDS records of the process, every thread"""
+    return list(_records)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Records the wall time, memory and row count of a block of code
+
+    The yielded record can be completed in the block, e.g. record["rows"] = len(df). Stages can be
+    nested, each record then has the name of its parent stage and its depth.
+
+    Args:
+        name (str): name of the stage
+        **fields: extra fields of the record (e.g. the year)
+
+    Yields:
+        dict: record of the stage
+    """
+    stack = _stack()
+    record = {"stage": name, "parent": stack[-1]["record"]["stage"] if stack else None, "depth": len(stack), "rows": None, "start": time.time()}
+    record.update(fields)
+    frame = {"record": record, "children_peak": 0}
+
+    trace_memory = PROFILE_MEMORY and hasattr(tracemalloc, "reset_peak")
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        stack.pop()
+        if trace_memory:
+            # The peak was reset by the nested stages, so it is the max of theirs and the one since the last reset
+            peak = max(tracemalloc.get_traced_memory()[1], frame["children_peak"])
+            record["peak_mb"] = (peak - start_memory) / 1024 ** 2
+            if stack:
+                stack[-1]["children_peak"] = max(stack[-1]["children_peak"], peak)
+        record["max_rss_mb"] = _max_rss_mb()
+        _save(record)
+
+
+def _save(record):
+    run = getattr(_local, "run", None)
+    record["run"] = run["name"] if run is not None else None
+    if run is not None:
+        run["records"].append(record)
+    _records.append(record)
+    if PROFILE_LOG:
+        line = json.dumps(record, default=str)
+        with _log_lock:
+            with open(PROFILE_LOG, "a") as file:
+                file.write(line + "\n")
+
+
+def profiled(function=None, name=None):
+    """Decorator recording each call of a function as a stage, with the number of rows of its result
+
+    Args:
+        name (str, optional): name of the stage, the qualified name of the function by default
+    """
+    if function is None:
+        return functools.partial(profiled, name=name)
+    stage_name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(stage_name) as record:
+            result = function(*args, **kwargs)
+            record["rows"] = count_rows(result)
+        return result
+
+    return wrapper
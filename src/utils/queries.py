@@ -0,0 +1,266 @@
+import pandas as pd
+from utils.agri import AGRI_PATH, agri_value, agri_values, lowest_values
+from utils.artifacts import ARTIFACTS_DIR
+from utils.backtest import LOSS_THRESHOLD, load_backtest, trigger_history
+from utils.data_extraction import load_agri_index, load_meteo_data_date
+from utils.departments import DEPARTMENTS
+from utils.era5 import ERA5_PATH
+from utils.indicators import load_indicators
+from utils.meteo import available_seasons, season_dates
+from utils.percentiles import EVENTS, PERCENTILES, calendar_days, load_percentiles, percentile_column
+from utils.regrid import grid_cell_ids
+from utils.rollups import CLIMATOLOGY_PERIODS, LEVEL_KEYS, query_rollup
+from utils.snapshots import load_snapshot
+from utils.zones import load_zone_cells, resolve_zone, zone_series, zone_weights
+
+
+def get_seasons(path_meteo=ERA5_PATH):
+    """First and last agricultural seasons with ERA5 data"""
+    return available_seasons(path_meteo)
+
+
+def get_series(variable, season, freq="monthly", level="area", departments=DEPARTMENTS, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Values of a variable over a season with the climatology of the same periods (mean over all years)
+
+    Args:
+        variable (str): meteorological column
+        season (int): agricultural season (September of season - 1 to August)
+        freq (str): "daily" or "monthly"
+        level (str): "area" (whole study area) or "dpt" (departments)
+        departments (list): departments of the "dpt" level, only their partitions are read
+
+    Returns:
+        pd.DataFrame: the level keys (e.g. 'DEP'), 'date', the variable and 'climatology'
+    """
+    start_date, end_date = season_dates(season)
+    df_series = query_rollup(level, freq, start_date=start_date, end_date=end_date, columns=[variable],
+                             path_meteo=path_meteo, artifacts_dir=artifacts_dir, departments=departments)
+    df_climatology = query_rollup(level, freq, kind="climatology", columns=[variable], path_meteo=path_meteo, artifacts_dir=artifacts_dir,
+                                  departments=departments)
+
+    # Climatology of the (keys, period) of each row, the period being the day of the year or the month
+    dates = df_series.index.get_level_values("date")
+    periods = pd.Index(dates.dayofyear if CLIMATOLOGY_PERIODS[freq] == "day_of_year" else dates.month, name=CLIMATOLOGY_PERIODS[freq])
+    keys = [df_series.index.get_level_values(key) for key in LEVEL_KEYS[level]]
+    climatology_index = pd.MultiIndex.from_arrays(keys + [periods]) if keys else periods
+
+    df_series = df_series.reset_index()
+    df_series["climatology"] = df_climatology[variable].reindex(climatology_index).to_numpy()
+    return df_series
+
+
+def get_percentile_series(variable, season, level="area", path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Daily values of a variable over a season with the percentiles of their calendar day, see percentiles.level_percentiles
+
+    Args:
+        variable (str): meteorological column
+        season (int): agricultural season
+        level (str): "area" (whole study area) or "dpt" (departments)
+
+    Returns:
+        pd.DataFrame: the level keys, 'date', the variable, 'p<percentile>' for each of PERCENTILES,
+        'anomaly' (difference to the median) and 'extreme' ("above" the highest percentile, "below" the
+        lowest or "")
+    """
+    start_date, end_date = season_dates(season)
+    df_series = query_rollup(level, "daily", start_date=start_date, end_date=end_date, columns=[variable],
+                             path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    df_percentiles = load_percentiles(f"percentiles_{level}", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+
+    days = pd.Index(calendar_days(df_series.index.get_level_values("date")) + 1, name="calendar_day")
+    keys = [df_series.index.get_level_values(key) for key in LEVEL_KEYS[level]]
+    percentiles_index = pd.MultiIndex.from_arrays(keys + [days]) if keys else days
+
+    df_series = df_series.reset_index()
+    for percentile in PERCENTILES:
+        df_series[f"p{percentile:g}"] = df_percentiles[percentile_column(variable, percentile)].reindex(percentiles_index).to_numpy()
+    df_series["anomaly"] = df_series[variable] - df_series[f"p{PERCENTILES[len(PERCENTILES) // 2]:g}"]
+    df_series["extreme"] = ""
+    df_series.loc[df_series[variable] > df_series[f"p{PERCENTILES[-1]:g}"], "extreme"] = "above"
+    df_series.loc[df_series[variable] < df_series[f"p{PERCENTILES[0]:g}"], "extreme"] = "below"
+    return df_series
+
+
+def get_event_series(season, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Share of the grid points of the study area in each extreme event (see percentiles.EVENTS) per day of a season
+
+    Returns:
+        pd.DataFrame: one column per event indexed by 'date'
+    """
+    start_date, end_date = season_dates(season)
+    df_events = load_percentiles("events_area_daily", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    return df_events.loc[start_date:end_date]
+
+
+def get_event_days(season, month, event, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Number of days of an extreme event per grid cell in a month of a season, as displayed by the map
+
+    Args:
+        month (int): month number (1 to 12), from September of season - 1 to August of season
+        event (str): one of percentiles.EVENTS
+
+    Returns:
+        pd.DataFrame: the event column indexed by grid cell 'id'
+    """
+    if event not in EVENTS:
+        raise ValueError(f"Unknown event: {event}")
+    df_events = load_percentiles("events_grid_monthly", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    date = pd.Timestamp(season - (month >= 9), month, 1)
+    df_month = df_events[df_events.index.get_level_values("date") == date]
+    return df_month[["id", event]].set_index("id")
+
+
+def get_snapshot_anomaly(season, month, variable, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Monthly mean of a variable per grid cell minus its monthly climatology, for a month of a season
+
+    Returns:
+        pd.DataFrame: the variable anomaly indexed by grid cell 'id'
+    """
+    date = pd.Timestamp(season - (month >= 9), month, 1)
+    df_month = query_rollup("grid", "monthly", start_date=date, end_date=date, columns=[variable],
+                            path_meteo=path_meteo, artifacts_dir=artifacts_dir).droplevel("date")
+    df_climatology = query_rollup("grid", "monthly", kind="climatology", columns=[variable], path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    df_climatology = df_climatology[df_climatology.index.get_level_values("month") == month].droplevel("month")
+    df_anomaly = df_month - df_climatology.reindex(df_month.index)
+    return df_anomaly.set_index(pd.Index(grid_cell_ids(df_anomaly, load_meteo_data_date(path_meteo)), name="id"))
+
+
+def get_department_series(variable, season, freq="monthly", departments=DEPARTMENTS, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Department averages of a variable over a season with their climatology, see get_series
+
+    Returns:
+        pd.DataFrame: 'DEP', 'date', the variable and 'climatology'
+    """
+    return get_series(variable, season, freq, level="dpt", departments=departments, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+
+
+def get_snapshot_chart(season, variable, departments=DEPARTMENTS, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Department monthly means of a season and their climatology, as plotted by the year snapshot
+
+    Returns:
+        pd.DataFrame: 'DEP', 'date', the variable and 'line_type' ('Dpt <department>' or 'Mean Dpt <department>')
+    """
+    df_chart = load_snapshot(season, variable, "chart", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    return df_chart[df_chart["DEP"].isin(list(departments))]
+
+
+def get_snapshot_months(season, variable, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Months of a season with data in its snapshot (first days of the months)"""
+    df_map = load_snapshot(season, variable, "map", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    return pd.DatetimeIndex(df_map["date"].unique()).sort_values()
+
+
+def get_snapshot(season, month, variable, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Monthly mean of a variable per grid cell for a month of a season, as displayed by the map
+
+    Args:
+        month (int): month number (1 to 12), from September of season - 1 to August of season
+
+    Returns:
+        pd.DataFrame: the variable indexed by grid cell 'id'
+    """
+    df_map = load_snapshot(season, variable, "map", path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    return df_map.loc[df_map["date"].dt.month == month, ["id", variable]].set_index("id")
+
+
+def get_indicators(season=None, level="dpt", departments=None, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Agro-climatic indicators (see indicators.compute_indicators) of a season, or of every season
+
+    Args:
+        season (int, optional): agricultural season, every season if None
+        level (str): "dpt" (departments) or "grid" (grid points)
+        departments (list, optional): departments kept, of the "dpt" level
+
+    Returns:
+        pd.DataFrame: indicators indexed by the level keys, and by 'season' if season is None
+    """
+    df_indicators = load_indicators(level, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    if departments is not None:
+        df_indicators = df_indicators[df_indicators.index.get_level_values("DEP").isin(list(departments))]
+    if season is None:
+        return df_indicators
+    return df_indicators[df_indicators.index.get_level_values("season") == season].droplevel("season")
+
+
+def get_backtest(n6=None, dpt=None, loss_threshold=LOSS_THRESHOLD, departments=DEPARTMENTS, path_agri=AGRI_PATH, path_meteo=ERA5_PATH,
+                 artifacts_dir=ARTIFACTS_DIR):
+    """Backtest of the parametric triggers against the yields (see backtest.backtest), optionally of a category and a department
+
+    Only the department dpt, or the departments if dpt is None, are backtested.
+
+    Args:
+        n6 (str, optional): category
+        dpt (str, optional): department
+        loss_threshold (float): yield shortfall below the trend from which a season is a loss
+        departments (list): departments backtested when dpt is None
+
+    Returns:
+        pd.DataFrame: one row per (n6, dpt, indicator, direction, threshold) with its hit rate, basis risk and payout
+    """
+    departments = (dpt,) if dpt is not None else tuple(departments)
+    df_backtest = load_backtest(loss_threshold, departments=departments, path_agri=path_agri, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    if n6 is not None:
+        df_backtest = df_backtest[df_backtest["n6"] == n6]
+    return df_backtest
+
+
+def get_trigger_history(n6, dpt, indicator, path_agri=AGRI_PATH, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Values of an indicator, yields and yield losses of a category in a department per year, see backtest.trigger_history"""
+    return trigger_history(n6, dpt, indicator, path_agri=path_agri, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+
+
+def get_zone_series(variables, start_date=None, end_date=None, freq="daily", wkt=None, geojson=None, insee=None,
+                    longitude=None, latitude=None, radius_km=None, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Weighted averages of variables over an ad-hoc zone, see zones.resolve_zone for the zone and zones.zone_series
+
+    Args:
+        variables (list): meteorological columns
+        start_date (str, optional): first date included
+        end_date (str, optional): last date included
+        freq (str): "daily" or "monthly"
+        wkt (str, optional): polygon in WKT (longitude, latitude)
+        geojson (dict, optional): GeoJSON geometry, Feature or FeatureCollection
+        insee (list, optional): INSEE codes of communes
+        longitude, latitude, radius_km (float, optional): site and radius
+
+    Returns:
+        pd.DataFrame: variables indexed by 'date'
+    """
+    zone = resolve_zone(wkt, geojson, insee, longitude, latitude, radius_km, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    return zone_series(zone, tuple(variables), start_date, end_date, freq, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+
+
+def get_zone_weights(wkt=None, geojson=None, insee=None, longitude=None, latitude=None, radius_km=None,
+                     path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Grid cells of an ad-hoc zone with their weight (area share of the zone), see get_zone_series for the zone
+
+    Returns:
+        pd.DataFrame: 'latitude', 'longitude' and 'weight' indexed by grid cell 'id'
+    """
+    zone = resolve_zone(wkt, geojson, insee, longitude, latitude, radius_km, path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    weights = zone_weights(zone, path_meteo, artifacts_dir)
+    cells = load_zone_cells(path_meteo, artifacts_dir).set_index("id")
+    return cells.loc[weights.index, ["latitude", "longitude"]].assign(weight=weights)
+
+
+def get_yield_variables(departments=DEPARTMENTS, path=AGRI_PATH):
+    """Variables of the agreste data of the departments (e.g. 'Rendement')"""
+    return list(load_agri_index(path, tuple(departments)).index.unique("variable"))
+
+
+def get_yields(variable, n6=None, dpt=None, departments=DEPARTMENTS, path=AGRI_PATH):
+    """Agreste values of a variable, optionally of a category and then of a department, see agri.agri_values
+
+    Only the partition of dpt, or of the departments if dpt is None, is read.
+    """
+    return agri_values(load_agri_index(path, (dpt,) if dpt is not None else tuple(departments)), variable, n6, dpt)
+
+
+def get_yield(variable, n6, dpt, year, path=AGRI_PATH):
+    """Agreste value of a variable for a category, a department and a year, None if missing"""
+    return agri_value(load_agri_index(path, (dpt,)), variable, n6, dpt, year)
+
+
+def get_lowest_yields(variable, n6, dpt, n, path=AGRI_PATH):
+    """n lowest values (worst years) of a variable for a category and a department, indexed by 'year'"""
+    return lowest_values(load_agri_index(path, (dpt,)), variable, n6, dpt, n)
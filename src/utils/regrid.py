@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from utils.artifacts import ARTIFACTS_DIR
+from utils.context import shared_data
+from utils.data_extraction import get_communes_artifact, load_base_grid
+from utils.era5 import ERA5_PATH
+from utils.meteo import METEOROLOGICAL_COLUMNS
+from utils.profiling import profiled
+
+# Regridding of the zone averages:
+# - 'nearest': each commune counts for its whole area on the grid cell nearest its centroid
+# - 'overlap': each commune counts on every grid cell it intersects, for the intersection area
+REGRID_MODES = {"nearest": ("communes_mapping", "nearest_id"), "overlap": ("communes_overlap", "cell_id")}
+REGRID_MODE = os.environ.get("REGRID_MODE", "nearest")
+
+
+def build_weight_matrix(df_mapping, n_cells, by="DEP", weights="area", cells="nearest_id"):
+    """Builds the sparse weight matrix from zones (communes, departments...) to grid cells
+
+    Each row sums to 1, so that multiplying grid values by the matrix gives the weighted
+    average of each zone.
+
+    Args:
+        df_mapping (pd.DataFrame): one row per (commune, grid cell) pair, with the zone column,
+            the grid cell id column and the weight column
+        n_cells (int): number of grid cells (columns of the matrix)
+        by (str): zone column, e.g. 'insee' for communes or 'DEP' for departments
+        weights (str, optional): weight column ('area'), None for equal weights
+        cells (str): grid cell id column ('nearest_id', or 'cell_id' of the overlap weights)
+
+    Returns:
+        (scipy.sparse.csr_matrix, pd.Index): matrix of shape (zones, grid cells) and the zone labels of its rows
+
+    Raises:
+        ValueError: if the weights of a zone sum to zero, its average being undefined
+    """
+    labels, rows = np.unique(df_mapping[by].to_numpy(), return_inverse=True)
+    columns = df_mapping[cells].to_numpy()
+    values = np.ones(len(df_mapping)) if weights is None else df_mapping[weights].to_numpy(dtype="float64")
+
+    # Duplicate (zone, cell) pairs are summed, e.g. all the communes of a department on the same cell
+    matrix = sparse.coo_matrix((values, (rows, columns)), shape=(len(labels), n_cells)).tocsr()
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    if (row_sums <= 0).any():
+        raise ValueError(f"Zones without weight on the grid: {list(labels[row_sums <= 0][:10])}")
+    matrix = sparse.diags(1. / row_sums) @ matrix
+
+    return matrix.tocsr(), pd.Index(labels, name=by)
+
+
+def zone_weight_matrix(by="DEP", path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, mode=REGRID_MODE, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Area weight matrix from zones ('insee' or 'DEP') to ERA5 grid cells, see build_weight_matrix
+
+    Args:
+        mode (str): regridding mode, a key of REGRID_MODES
+        path_gpd_communes (str): communes shapefile, see data_extraction.build_communes_artifacts
+        path_df_communes (str): COG communes CSV
+    """
+    name, cells = REGRID_MODES[mode]
+    df_mapping = get_communes_artifact(name, path_gpd_communes, path_df_communes, path_base_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    n_cells = len(load_base_grid(path_meteo))
+    return build_weight_matrix(df_mapping, n_cells, by=by, cells=cells)
+
+
+@shared_data
+def load_weight_matrix(by="DEP", path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, mode=REGRID_MODE, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    return zone_weight_matrix(by, path_meteo=path_meteo, artifacts_dir=artifacts_dir, mode=mode, path_gpd_communes=path_gpd_communes, path_df_communes=path_df_communes)
+
+
+def grid_cell_ids(df_meteo, gdf_grid):
+    """Grid cell id of each row of a frame indexed by latitude and longitude (-1 if not on the grid)"""
+    grid_coordinates = pd.MultiIndex.from_arrays([
+        gdf_grid.index.get_level_values("latitude"),
+        gdf_grid.index.get_level_values("longitude"),
+    ])
+    positions = grid_coordinates.get_indexer(pd.MultiIndex.from_arrays([
+        df_meteo.index.get_level_values("latitude"),
+        df_meteo.index.get_level_values("longitude"),
+    ]))
+    return np.where(positions >= 0, gdf_grid["id"].to_numpy()[positions], -1)
+
+
+def regrid(matrix, values):
+    """Regrids an array whose first axis is the grid cells, with a single sparse product
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): weight matrix of shape (zones, grid cells)
+        values (np.ndarray): array of shape (grid cells, ...), e.g. (grid cells, time, variables)
+
+    Returns:
+        np.ndarray: array of shape (zones, ...)
+    """
+    flat_values = values.reshape(values.shape[0], -1)
+    return np.asarray(matrix @ flat_values).reshape((matrix.shape[0],) + values.shape[1:])
+
+
+@profiled
+def regrid_frame(df_meteo, matrix, labels, gdf_grid, columns=METEOROLOGICAL_COLUMNS):
+    """Regrids a long-format meteorological frame to zones
+
+    Args:
+        df_meteo (pd.DataFrame): values indexed by latitude, longitude and date
+        matrix (scipy.sparse.csr_matrix): weight matrix, see build_weight_matrix
+        labels (pd.Index): zone labels of the rows of matrix
+        gdf_grid (gpd.GeoDataFrame): grid points with 'id', see load_base_grid
+        columns (list): columns to regrid
+
+    Returns:
+        pd.DataFrame: weighted averages indexed by zone and date
+    """
+    cell_ids = grid_cell_ids(df_meteo, gdf_grid)
+    on_grid = cell_ids >= 0
+    dates, date_positions = np.unique(df_meteo.index.get_level_values("date")[on_grid], return_inverse=True)
+
+    # Dense (grid cells, dates, variables) array, cells without values stay NaN
+    values = np.full((matrix.shape[1], len(dates), len(columns)), np.nan)
+    values[cell_ids[on_grid], date_positions] = df_meteo[columns].to_numpy(dtype="float64")[on_grid]
+
+    zone_values = regrid(matrix, values)
+    index = pd.MultiIndex.from_product([labels, pd.DatetimeIndex(dates, name="date")])
+    return pd.DataFrame(zone_values.reshape(-1, len(columns)), index=index, columns=columns)
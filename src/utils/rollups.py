@@ -0,0 +1,343 @@
+import numpy as np
+import pandas as pd
+from utils.artifacts import ARTIFACTS_DIR, artifacts_key, hash_path, read_artifact, write_artifact
+from utils.climatology import compute_monthly_climatology
+from utils.context import shared_data
+from utils.cube import read_cube
+from utils.data_extraction import communes_artifacts_key, load_base_grid
+from utils.departments import DEPARTMENTS, partition_dir
+from utils.era5 import ERA5_PATH, meteo_version, read_meteo_data, resolve_meteo_path
+from utils.meteo import climatology_to_season, season_dates
+from utils.regrid import REGRID_MODE, regrid, zone_weight_matrix
+
+# Spatial levels of the rollups and the index levels identifying a row at each of them
+LEVEL_KEYS = {
+    "grid": ["latitude", "longitude"],
+    "dpt": ["DEP"],
+    "area": [],
+}
+FREQS = ("daily", "monthly")
+KINDS = ("mean", "climatology")
+# Number of daily values averaged in each climatology value, stored to update the climatologies incrementally
+COUNT_KIND = "count"
+# Period of the climatologies of each frequency
+CLIMATOLOGY_PERIODS = {"daily": "day_of_year", "monthly": "month"}
+
+
+def rollup_name(level, freq, kind):
+    return f"rollup_{level}_{freq}_{kind}"
+
+
+def rollups_key(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Key of the rollups: content hash of the ERA5 data, key of the communes artifacts and regridding mode"""
+    return artifacts_key(
+        hash_path(resolve_meteo_path(path_meteo), artifacts_dir=artifacts_dir),
+        communes_artifacts_key(path_gpd_communes, path_df_communes, path_base_meteo=path_meteo, artifacts_dir=artifacts_dir),
+        regrid_mode=REGRID_MODE,
+    )
+
+
+def _periods(dates, by):
+    return pd.Index(dates.month if by == "month" else dates.dayofyear, name=by)
+
+
+def _month_starts(dates):
+    return dates.to_period("M").to_timestamp().rename("date")
+
+
+def _period_rollups(df_daily, keys):
+    # Derive the monthly means and the climatologies from daily means indexed by keys + ['date']
+    dates = df_daily.index.get_level_values("date")
+    key_values = [df_daily.index.get_level_values(key) for key in keys]
+
+    rollups = {
+        ("daily", "mean"): df_daily,
+        ("monthly", "mean"): df_daily.groupby(key_values + [_month_starts(dates)]).mean(),
+    }
+    for freq, by in CLIMATOLOGY_PERIODS.items():
+        grouped = df_daily.groupby(key_values + [_periods(dates, by)])
+        rollups[freq, "climatology"] = grouped.mean()
+        rollups[freq, COUNT_KIND] = grouped.count()
+    return rollups
+
+
+def _grid_climatology(cube, by):
+    # Climatology per grid point and the number of daily values averaged in it
+    codes, labels = pd.factorize(_periods(cube.dates, by), sort=True)
+    groups, sums, counts = cube.group_sums(codes)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = {variable: (sums[variable] / counts[variable]).astype("float32") for variable in cube.variables}
+    periods = pd.Index(np.asarray(labels)[groups], name=by)
+    df_climatology = cube.to_frame(means, periods)
+    return df_climatology, cube.to_frame(counts, periods).reindex(df_climatology.index)
+
+
+def _dpt_daily(cube, matrix, labels, gdf_grid):
+    # Department daily means, one sparse product per year to bound the size of the dense array
+    df_dpt_daily = []
+    for year in np.unique(cube.dates.year):
+        cube_year = cube.sel_dates(f"{year}-01-01", f"{year}-12-31")
+        dpt_values = regrid(matrix, cube_year.cell_values(gdf_grid))
+        df_dpt_daily.append(pd.DataFrame(
+            dpt_values.reshape(-1, len(cube.variables)),
+            index=pd.MultiIndex.from_product([labels, cube_year.dates.rename("date")]),
+            columns=cube.variables,
+        ))
+    return pd.concat(df_dpt_daily).sort_index()
+
+
+def compute_rollups(cube, matrix, labels, gdf_grid):
+    """Computes every rollup from the daily grid data
+
+    Args:
+        cube (MeteoCube): daily ERA5 data
+        matrix (scipy.sparse.csr_matrix): department area weight matrix, see regrid.build_weight_matrix
+        labels (pd.Index): departments of the rows of matrix
+        gdf_grid (gpd.GeoDataFrame): grid points with 'id', see load_base_grid
+
+    Returns:
+        dict: (level, freq, kind) -> pd.DataFrame, kind COUNT_KIND being the counts of the climatologies
+    """
+    rollups = {}
+
+    # Grid level, reduced along the time axis of the cube (the grid daily means are the ERA5
+    # data itself, read through read_meteo_data)
+    monthly_climatology = compute_monthly_climatology(cube)
+    months = pd.RangeIndex(1, 13, name="month")
+    rollups["grid", "monthly", "mean"] = cube.to_frame(monthly_climatology.monthly, monthly_climatology.months)
+    rollups["grid", "monthly", "climatology"] = cube.to_frame(monthly_climatology.climatology, months)
+    rollups["grid", "monthly", COUNT_KIND] = cube.to_frame(monthly_climatology.counts, months).reindex(
+        rollups["grid", "monthly", "climatology"].index)
+    rollups["grid", "daily", "climatology"], rollups["grid", "daily", COUNT_KIND] = _grid_climatology(cube, "day_of_year")
+
+    df_dpt_daily = _dpt_daily(cube, matrix, labels, gdf_grid)
+    for (freq, kind), df_rollup in _period_rollups(df_dpt_daily, LEVEL_KEYS["dpt"]).items():
+        rollups["dpt", freq, kind] = df_rollup
+
+    for (freq, kind), df_rollup in _period_rollups(cube.spatial_mean(), LEVEL_KEYS["area"]).items():
+        rollups["area", freq, kind] = df_rollup
+
+    return rollups
+
+
+def _replace_months(df_monthly, df_new_monthly):
+    # Monthly means with the months of df_new_monthly replaced (or added)
+    months = df_monthly.index.get_level_values("date")
+    kept = ~months.isin(df_new_monthly.index.get_level_values("date").unique())
+    return pd.concat([df_monthly[kept], df_new_monthly.astype(df_monthly.dtypes.to_dict())]).sort_index()
+
+
+def _update_climatology(df_climatology, df_counts, df_daily, keys, by):
+    """Adds new daily values to a climatology, from the counts of the values already averaged
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): updated climatology and counts
+    """
+    dates = df_daily.index.get_level_values("date")
+    grouped = df_daily.groupby([df_daily.index.get_level_values(key) for key in keys] + [_periods(dates, by)])
+    sums = (df_climatology.fillna(0.) * df_counts).add(grouped.sum(), fill_value=0.)
+    counts = df_counts.add(grouped.count(), fill_value=0).astype("int64")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        df_climatology = (sums / counts).astype(df_climatology.dtypes.to_dict())
+    return df_climatology, counts
+
+
+def update_rollups(rollups, cube_months, new_dates, matrix, labels, gdf_grid):
+    """Updates the rollups with new days, only recomputing the periods they affect
+
+    Daily means are appended, the monthly means of the months of the new days are recomputed and
+    the climatologies are updated from their counts: the cost follows the new data, not the history.
+
+    Args:
+        rollups (dict): rollups before the new days, see compute_rollups
+        cube_months (MeteoCube): daily data of the months of the new days (first day of the first month to the last new day)
+        new_dates (pd.DatetimeIndex): new days, after the last day of the rollups
+        matrix, labels, gdf_grid: see compute_rollups
+
+    Returns:
+        dict: updated rollups
+    """
+    rollups = dict(rollups)
+    cube_new = cube_months.sel_dates(new_dates.min(), new_dates.max())
+
+    monthly_grid = cube_months.monthly_mean()
+    rollups["grid", "monthly", "mean"] = _replace_months(rollups["grid", "monthly", "mean"], monthly_grid.to_frame())
+    df_grid_new = cube_new.to_frame()
+
+    df_dpt_new = _dpt_daily(cube_new, matrix, labels, gdf_grid)
+    df_area_new = cube_new.spatial_mean()
+    for level, df_new in (("dpt", df_dpt_new), ("area", df_area_new)):
+        keys = LEVEL_KEYS[level]
+        df_daily = pd.concat([rollups[level, "daily", "mean"], df_new]).sort_index()
+        rollups[level, "daily", "mean"] = df_daily
+        # The months of the new days, with their days already in the rollups
+        dates = df_daily.index.get_level_values("date")
+        df_months = df_daily[dates >= new_dates.min().to_period("M").to_timestamp()]
+        month_starts = _month_starts(df_months.index.get_level_values("date"))
+        df_new_monthly = df_months.groupby([df_months.index.get_level_values(key) for key in keys] + [month_starts]).mean()
+        rollups[level, "monthly", "mean"] = _replace_months(rollups[level, "monthly", "mean"], df_new_monthly)
+
+    for level, df_new in (("grid", df_grid_new), ("dpt", df_dpt_new), ("area", df_area_new)):
+        for freq, by in CLIMATOLOGY_PERIODS.items():
+            rollups[level, freq, "climatology"], rollups[level, freq, COUNT_KIND] = _update_climatology(
+                rollups[level, freq, "climatology"], rollups[level, freq, COUNT_KIND], df_new, LEVEL_KEYS[level], by)
+
+    return rollups
+
+
+def _rollup_kinds():
+    return [(level, freq, kind) for level in LEVEL_KEYS for freq in FREQS for kind in KINDS + (COUNT_KIND,)
+            if (level, freq, kind) != ("grid", "daily", "mean")]
+
+
+def write_rollups(rollups, key, artifacts_dir=ARTIFACTS_DIR):
+    """Writes the rollups, those of the "dpt" level partitioned by department (see departments.partition_dir)"""
+    for (level, freq, kind), df_rollup in rollups.items():
+        if level != "dpt":
+            write_artifact(df_rollup, rollup_name(level, freq, kind), key, artifacts_dir=artifacts_dir)
+            continue
+        for dpt in df_rollup.index.unique("DEP"):
+            write_artifact(df_rollup.loc[[dpt]], rollup_name(level, freq, kind), key, artifacts_dir=partition_dir(dpt, artifacts_dir))
+
+
+def read_rollup(level, freq, kind, key, artifacts_dir=ARTIFACTS_DIR, departments=DEPARTMENTS):
+    """Reads a rollup written under key, of some departments for the "dpt" level, or returns None if missing"""
+    name = rollup_name(level, freq, kind)
+    if level != "dpt":
+        return read_artifact(name, key, artifacts_dir=artifacts_dir)
+    partitions = [read_artifact(name, key, artifacts_dir=partition_dir(dpt, artifacts_dir)) for dpt in departments]
+    if any(df_partition is None for df_partition in partitions):
+        return None
+    return partitions[0] if len(partitions) == 1 else pd.concat(partitions)
+
+
+def read_rollups(key, artifacts_dir=ARTIFACTS_DIR):
+    """Reads every rollup written under key, or returns None if one of them is missing"""
+    rollups = {}
+    for level, freq, kind in _rollup_kinds():
+        df_rollup = read_rollup(level, freq, kind, key, artifacts_dir=artifacts_dir)
+        if df_rollup is None:
+            return None
+        rollups[level, freq, kind] = df_rollup
+    return rollups
+
+
+def build_rollups(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Builds and writes every rollup to artifacts_dir, to be run once per data refresh
+
+    Args:
+        path_gpd_communes (str): communes shapefile of the department weights, see regrid.zone_weight_matrix
+        path_df_communes (str): COG communes CSV
+
+    Returns:
+        str: key of the written rollups
+    """
+    key = rollups_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+    matrix, labels = zone_weight_matrix("DEP", path_meteo=path_meteo, artifacts_dir=artifacts_dir, path_gpd_communes=path_gpd_communes, path_df_communes=path_df_communes)
+    rollups = compute_rollups(read_cube(path_meteo), matrix, labels, load_base_grid(path_meteo))
+    write_rollups(rollups, key, artifacts_dir=artifacts_dir)
+    return key
+
+
+def refresh_rollups(previous_key, new_dates, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Brings the rollups up to date after new days were appended to the ERA5 data
+
+    The rollups of previous_key (the data before the append) are updated with the new days only,
+    see update_rollups, and written under the key of the current data. They are fully rebuilt if
+    they are missing.
+
+    Returns:
+        str: key of the written rollups
+    """
+    rollups = read_rollups(previous_key, artifacts_dir=artifacts_dir)
+    if rollups is None:
+        return build_rollups(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+
+    key = rollups_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+    if len(new_dates):
+        matrix, labels = zone_weight_matrix("DEP", path_meteo=path_meteo, artifacts_dir=artifacts_dir, path_gpd_communes=path_gpd_communes, path_df_communes=path_df_communes)
+        first_month = new_dates.min().to_period("M").to_timestamp()
+        cube_months = read_cube(path_meteo, start_date=first_month, end_date=new_dates.max())
+        rollups = update_rollups(rollups, cube_months, new_dates, matrix, labels, load_base_grid(path_meteo))
+    if len(new_dates) or key != previous_key:
+        # Same rollups under the key of the rewritten files, e.g. after compact_meteo_partitions
+        write_rollups(rollups, key, artifacts_dir=artifacts_dir)
+    return key
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_rollup(level, freq, kind="mean", path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, departments=DEPARTMENTS, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Loads a rollup table from disk, building the rollups first if the data changed
+
+    Only the partitions of the departments are read for the "dpt" level.
+
+    Raises:
+        KeyError: if one of the departments is not part of the rollups (see departments.DEPARTMENTS)
+        FileNotFoundError: if the rollup is still missing once built
+    """
+    unknown = set(departments) - set(DEPARTMENTS)
+    if unknown:
+        raise KeyError(f"No rollups for departments {sorted(unknown)}")
+    key = rollups_key(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+    df_rollup = read_rollup(level, freq, kind, key, artifacts_dir=artifacts_dir, departments=departments)
+    if df_rollup is None:
+        build_rollups(path_meteo, artifacts_dir, path_gpd_communes, path_df_communes)
+        df_rollup = read_rollup(level, freq, kind, key, artifacts_dir=artifacts_dir, departments=departments)
+    if df_rollup is None:
+        raise FileNotFoundError(f"Rollup {level}/{freq}/{kind} missing after building the rollups in {artifacts_dir}")
+    return df_rollup
+
+
+def query_rollup(level, freq, kind="mean", start_date=None, end_date=None, columns=None, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR,
+                 departments=DEPARTMENTS, path_gpd_communes="../data/communes-20220101-shp/", path_df_communes="../data/cog_ensemble_2021_csv/commune2021.csv"):
+    """Query API over the rollups
+
+    Args:
+        level (str): "grid", "dpt" (area-weighted department average) or "area" (whole study area)
+        freq (str): "daily" or "monthly"
+        kind (str): "mean" (indexed by date, monthly dates are month starts) or "climatology"
+            (mean over all years, indexed by 'day_of_year' for daily or 'month' for monthly)
+        start_date (str or pd.Timestamp, optional): first date included, for "mean" only
+        end_date (str or pd.Timestamp, optional): last date included, for "mean" only
+        columns (list, optional): meteorological columns to return
+        departments (tuple): departments of the "dpt" level
+
+    Returns:
+        pd.DataFrame: meteorological values indexed by the level keys and the period
+    """
+    if level not in LEVEL_KEYS or freq not in FREQS or kind not in KINDS:
+        raise ValueError(f"Unknown rollup: {level}, {freq}, {kind}")
+
+    if (level, freq, kind) == ("grid", "daily", "mean"):
+        return read_meteo_data(path_meteo, start_date=start_date, end_date=end_date, columns=columns)
+
+    df_rollup = load_rollup(level, freq, kind, path_meteo=path_meteo, artifacts_dir=artifacts_dir, departments=tuple(departments), path_gpd_communes=path_gpd_communes, path_df_communes=path_df_communes)
+    if kind == "mean" and (start_date is not None or end_date is not None):
+        dates = df_rollup.index.get_level_values("date")
+        condition = np.ones(len(df_rollup), dtype=bool)
+        if start_date is not None:
+            condition &= dates >= pd.Timestamp(start_date)
+        if end_date is not None:
+            condition &= dates <= pd.Timestamp(end_date)
+        df_rollup = df_rollup[condition]
+    if columns is not None:
+        df_rollup = df_rollup[columns]
+    return df_rollup
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_season_monthly_means(year, columns, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Per grid point monthly means of a season and monthly climatology dated on it, cached per (season, columns)
+
+    Read from the grid rollups, so changing the season or the variables never scans the daily data.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): season and climatology, both indexed by latitude and longitude with a
+        'date' column, as returned by get_monthly_mean
+    """
+    start_date, end_date = season_dates(year)
+    df_season = query_rollup("grid", "monthly", start_date=start_date, end_date=end_date, columns=list(columns),
+                             path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    df_climatology = query_rollup("grid", "monthly", kind="climatology", columns=list(columns),
+                                  path_meteo=path_meteo, artifacts_dir=artifacts_dir)
+    return df_season.reset_index(level="date"), climatology_to_season(df_climatology, year).reset_index(level="date")
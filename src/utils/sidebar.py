@@ -0,0 +1,36 @@
+import pandas as pd
+import streamlit as st
+from utils.context import get_data_context
+from utils.departments import DEFAULT_SELECTED, DEPARTMENTS, department_name
+from utils.profiling import run_records
+
+
+def sidebar_context_stats():
+    """Displays the shared datasets memory and cache statistics in the sidebar"""
+    stats = get_data_context().stats()
+    with st.sidebar.expander("Données partagées"):
+        st.metric("Mémoire", f"{stats['bytes'] / 1024 ** 2:.0f} / {stats['max_bytes'] / 1024 ** 2:.0f} MB")
+        st.text(f"Hits: {stats['hits']}, misses: {stats['misses']} ({stats['hit_rate']:.0%}), évictions: {stats['evictions']}")
+        st.dataframe(pd.DataFrame(stats["datasets"], columns=["name", "arguments", "bytes"]))
+
+
+def sidebar_profile():
+    """Displays the duration, memory and rows of the stages of the current run in the sidebar"""
+    df_records = pd.DataFrame(run_records(), columns=["stage", "depth", "seconds", "rows", "cache", "peak_mb", "max_rss_mb"])
+    with st.sidebar.expander("Profil de la page"):
+        # Stages indented under their parent
+        df_records["stage"] = ["  " * depth + name for name, depth in zip(df_records["stage"], df_records["depth"])]
+        st.text(f"Temps total: {df_records.loc[df_records['depth'] == 0, 'seconds'].sum():.2f}s")
+        st.dataframe(df_records.drop(columns="depth").round(3))
+
+
+def sidebar_departments():
+    """Departments selected in the sidebar, kept when changing page; only their partitions are loaded
+
+    Returns:
+        tuple: selected departments, in the order of DEPARTMENTS
+    """
+    selected = st.sidebar.multiselect("Départements", DEPARTMENTS, default=st.session_state.get("departments", list(DEFAULT_SELECTED)),
+                                      format_func=lambda dpt: f"{dpt} - {department_name(dpt)}")
+    st.session_state["departments"] = selected
+    return tuple(dpt for dpt in DEPARTMENTS if dpt in selected)
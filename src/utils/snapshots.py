@@ -0,0 +1,178 @@
+import glob
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from utils.artifacts import ARTIFACTS_DIR
+from utils.context import shared_data
+from utils.data_extraction import load_base_grid
+from utils.era5 import ERA5_PATH, meteo_version
+from utils.maps import DICT_THRESHOLDS, N_BINS, compute_thresholds
+from utils.meteo import climatology_to_season, season_dates
+from utils.profiling import profiled
+from utils.regrid import grid_cell_ids
+from utils.rollups import build_rollups, load_rollup, query_rollup, read_rollup, rollups_key
+
+# Snapshot store: products of the year snapshot page per (season, variable), in a folder per rollups key
+SNAPSHOTS_DIR = os.path.join(ARTIFACTS_DIR, "snapshots")
+# Products of a snapshot: per grid cell monthly values of the map, department monthly series of the chart
+SNAPSHOT_PRODUCTS = ("map", "chart")
+# Rollups the snapshots are computed from
+SNAPSHOT_ROLLUPS = (("grid", "monthly", "mean"), ("dpt", "monthly", "mean"), ("dpt", "monthly", "climatology"))
+
+
+def snapshot_path(key, year, variable, product, snapshots_dir=SNAPSHOTS_DIR):
+    return os.path.join(snapshots_dir, key, f"{year}_{variable}_{product}.parquet")
+
+
+def season_map_frame(df_grid_monthly, gdf_grid, year, variable):
+    """Monthly means of a variable per grid cell over a season, as displayed by the map
+
+    Returns:
+        pd.DataFrame: 'id' (grid cell), 'date' (first day of the month) and the variable
+    """
+    start_date, end_date = season_dates(year)
+    dates = df_grid_monthly.index.get_level_values("date")
+    df_season = df_grid_monthly.loc[(dates >= start_date) & (dates <= end_date), [variable]]
+    return pd.DataFrame({
+        "id": grid_cell_ids(df_season, gdf_grid),
+        "date": df_season.index.get_level_values("date"),
+        variable: df_season[variable].to_numpy(),
+    })
+
+
+def season_chart_frame(df_dpt_monthly, df_dpt_climatology, year, variable):
+    """Monthly means of a variable per department over a season and the climatology dated on it, as plotted by the chart
+
+    Returns:
+        pd.DataFrame: 'DEP', 'date', the variable and 'line_type' ('Dpt <department>' or 'Mean Dpt <department>')
+    """
+    start_date, end_date = season_dates(year)
+    dates = df_dpt_monthly.index.get_level_values("date")
+    df_season = df_dpt_monthly.loc[(dates >= start_date) & (dates <= end_date), [variable]].reset_index(level="date")
+    df_mean = climatology_to_season(df_dpt_climatology[[variable]], year).reset_index(level="date")
+
+    frames = []
+    for department in df_season.index.unique():
+        frames.append(df_season.loc[[department]].assign(line_type=f"Dpt {department}"))
+    for department in df_mean.index.unique():
+        frames.append(df_mean.loc[[department]].assign(line_type=f"Mean Dpt {department}"))
+    return pd.concat(frames).reset_index()
+
+
+@profiled
+def compute_snapshot(year, variable, rollups, gdf_grid):
+    """Computes the products of a (season, variable) snapshot
+
+    Args:
+        rollups (dict): (level, freq, kind) -> rollup, for SNAPSHOT_ROLLUPS
+        gdf_grid (gpd.GeoDataFrame): grid points with 'id', see load_base_grid
+
+    Returns:
+        (dict, dict): product -> pd.DataFrame, and stage -> duration (s)
+    """
+    timings = {}
+    start = time.perf_counter()
+    df_map = season_map_frame(rollups["grid", "monthly", "mean"], gdf_grid, year, variable)
+    timings["map"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_chart = season_chart_frame(rollups["dpt", "monthly", "mean"], rollups["dpt", "monthly", "climatology"], year, variable)
+    timings["chart"] = time.perf_counter() - start
+
+    return {"map": df_map, "chart": df_chart}, timings
+
+
+# Inputs of the worker processes, loaded once per process by _init_worker
+_worker_inputs = {}
+
+
+def _init_worker(key, path_meteo, artifacts_dir):
+    start = time.perf_counter()
+    _worker_inputs["rollups"] = {
+        rollup: read_rollup(*rollup, key, artifacts_dir=artifacts_dir) for rollup in SNAPSHOT_ROLLUPS
+    }
+    _worker_inputs["gdf_grid"] = load_base_grid(path_meteo)
+    _worker_inputs["load_time"] = time.perf_counter() - start
+
+
+def _snapshot_task(key, year, variable, snapshots_dir):
+    products, timings = compute_snapshot(year, variable, _worker_inputs["rollups"], _worker_inputs["gdf_grid"])
+    start = time.perf_counter()
+    for product, df_product in products.items():
+        path = snapshot_path(key, year, variable, product, snapshots_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df_product.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    timings["write"] = time.perf_counter() - start
+    # The loading time of the inputs is reported once per process, with its first task
+    timings["load"] = _worker_inputs.pop("load_time", 0.)
+    return year, variable, timings
+
+
+def build_snapshots(years, variables, max_workers=None, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, snapshots_dir=SNAPSHOTS_DIR):
+    """Precomputes the snapshots of every (season, variable) in a pool of processes, one task per pair
+
+    The snapshots of the previous versions of the data are removed.
+
+    Args:
+        years (list): seasons
+        variables (list): meteorological columns
+        max_workers (int, optional): number of processes, the number of CPUs by default
+
+    Returns:
+        (str, pd.DataFrame): key of the snapshots and the duration (s) of each stage per (year, variable)
+    """
+    key = rollups_key(path_meteo, artifacts_dir)
+    if any(read_rollup(*rollup, key, artifacts_dir=artifacts_dir) is None for rollup in SNAPSHOT_ROLLUPS):
+        # The workers read the rollups, built first if needed
+        build_rollups(path_meteo, artifacts_dir)
+
+    os.makedirs(os.path.join(snapshots_dir, key), exist_ok=True)
+    for stale_dir in glob.glob(os.path.join(snapshots_dir, "*")):
+        if os.path.basename(stale_dir) != key:
+            shutil.rmtree(stale_dir)
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(key, path_meteo, artifacts_dir)) as executor:
+        futures = [executor.submit(_snapshot_task, key, year, variable, snapshots_dir) for year in years for variable in variables]
+        results = [future.result() for future in futures]
+
+    df_timings = pd.DataFrame(
+        [timings for _, _, timings in results],
+        index=pd.MultiIndex.from_tuples([(year, variable) for year, variable, _ in results], names=["year", "variable"]),
+    )
+    return key, df_timings
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_snapshot(year, variable, product, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR, snapshots_dir=SNAPSHOTS_DIR):
+    """Loads a product ('map' or 'chart') of a (season, variable) snapshot from the snapshot store
+
+    Computed from the rollups when the snapshot was not precomputed, see build_snapshots.
+    """
+    key = rollups_key(path_meteo, artifacts_dir)
+    path = snapshot_path(key, year, variable, product, snapshots_dir)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    rollups = {rollup: load_rollup(*rollup, path_meteo=path_meteo, artifacts_dir=artifacts_dir) for rollup in SNAPSHOT_ROLLUPS}
+    products, _ = compute_snapshot(year, variable, rollups, load_base_grid(path_meteo))
+    return products[product]
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_thresholds(meteo_column, method="quantile", n_bins=N_BINS, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Color scale of a variable, computed once over the monthly means of the full history of every grid point
+
+    The same scale is used for every month and season, so that the maps can be compared.
+    Falls back to DICT_THRESHOLDS with method "fixed" or when the data does not give the 3 bins
+    needed by the ColorBrewer palette.
+    """
+    if method != "fixed":
+        values = query_rollup("grid", "monthly", columns=[meteo_column], path_meteo=path_meteo, artifacts_dir=artifacts_dir)[meteo_column]
+        thresholds = compute_thresholds(values.to_numpy(), method=method, n_bins=n_bins)
+        if len(thresholds) > 3:
+            return thresholds
+    return DICT_THRESHOLDS[meteo_column]
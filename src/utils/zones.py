@@ -0,0 +1,206 @@
+import hashlib
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely import wkt as shapely_wkt
+from shapely.geometry import Point, shape
+from shapely.ops import unary_union
+from utils.artifacts import ARTIFACTS_DIR
+from utils.context import shared_data
+from utils.cube import load_cube
+from utils.data_extraction import get_communes_artifact, get_grid_cells
+from utils.departments import DEPARTMENT_NAMES, commune_department
+from utils.era5 import ERA5_PATH, meteo_version
+from utils.grid import AREA_CRS
+from utils.profiling import profiled
+
+# CRS of the zones given by the users (GeoJSON, WKT, sites)
+ZONE_CRS = "EPSG:4326"
+ZONE_FREQS = ("daily", "monthly")
+# Intersections of a zone with the grid cells smaller than this share of the zone are dropped, e.g. the
+# slivers along the cell borders left by the reprojection of the communes
+MIN_CELL_SHARE = 1e-3
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_zone_cells(path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the ERA5 grid cells polygons ('id', 'latitude', 'longitude') in AREA_CRS and builds their R-tree, once per process"""
+    gdf_cells = get_grid_cells(path_meteo, artifacts_dir)
+    # Built lazily by geopandas, here rather than by the first query
+    gdf_cells.sindex
+    return gdf_cells
+
+
+@shared_data(version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def load_zone_communes(dpt, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Loads the communes polygons of a department in AREA_CRS, indexed by 'insee', from its partition"""
+    gdf_communes = get_communes_artifact("communes_polygons", path_base_meteo=path_meteo, departments=(dpt,), artifacts_dir=artifacts_dir, geo=True)
+    return gdf_communes.set_index("insee", drop=False)
+
+
+def project_zone(geometry, crs=ZONE_CRS):
+    """Projects a zone (shapely geometry) to AREA_CRS, the CRS of the zone index"""
+    return gpd.GeoSeries([geometry], crs=crs).to_crs(AREA_CRS).iloc[0]
+
+
+def feature_zone(feature):
+    """Zone of a GeoJSON Feature in ZONE_CRS, a Point with a 'radius' property (in meters) being a disk
+
+    The circles drawn on the maps (Leaflet.draw) are exported as their center and radius.
+    """
+    geometry = shape(feature["geometry"])
+    radius = (feature.get("properties") or {}).get("radius")
+    if geometry.geom_type == "Point" and radius:
+        return project_zone(geometry).buffer(float(radius))
+    return project_zone(geometry)
+
+
+def geojson_zone(geojson):
+    """Zone of a GeoJSON geometry, Feature or FeatureCollection (union of its features) in ZONE_CRS, see feature_zone"""
+    if geojson.get("type") == "FeatureCollection":
+        features = geojson["features"]
+    elif geojson.get("type") == "Feature":
+        features = [geojson]
+    else:
+        features = [{"geometry": geojson}]
+    return unary_union([feature_zone(feature) for feature in features])
+
+
+def site_zone(longitude, latitude, radius_km):
+    """Zone within radius_km of a site"""
+    return project_zone(Point(longitude, latitude)).buffer(radius_km * 1000.)
+
+
+def communes_zone(insee, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Zone of a list of communes (INSEE codes), only the partitions of their departments are read"""
+    department_codes = {}
+    for code in insee:
+        department_codes.setdefault(commune_department(code), []).append(code)
+    unknown = []
+    geometries = []
+    for dpt, codes in department_codes.items():
+        if dpt not in DEPARTMENT_NAMES:
+            unknown += codes
+            continue
+        gdf_communes = load_zone_communes(dpt, path_meteo, artifacts_dir)
+        unknown += [code for code in codes if code not in gdf_communes.index]
+        geometries += [gdf_communes.at[code, "geometry"] for code in codes if code in gdf_communes.index]
+    if unknown:
+        raise KeyError(f"Unknown communes: {sorted(unknown)}")
+    return unary_union(geometries)
+
+
+def resolve_zone(wkt=None, geojson=None, insee=None, longitude=None, latitude=None, radius_km=None, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Zone in AREA_CRS given by exactly one of: a WKT or GeoJSON polygon (in ZONE_CRS), a list of INSEE codes,
+    or a site (longitude, latitude) and a radius"""
+    specifications = [wkt is not None, geojson is not None, insee is not None, longitude is not None or latitude is not None]
+    if sum(specifications) != 1:
+        raise ValueError("A zone is given by one of wkt, geojson, insee or longitude, latitude and radius_km")
+    if wkt is not None:
+        try:
+            geometry = shapely_wkt.loads(wkt)
+        except Exception as error:
+            # WKTReadingError in shapely 1.8, GEOSException in shapely 2
+            raise ValueError(f"Invalid WKT: {error}") from error
+        return project_zone(geometry)
+    if geojson is not None:
+        return geojson_zone(geojson)
+    if insee is not None:
+        return communes_zone(insee, path_meteo, artifacts_dir)
+    if longitude is None or latitude is None or radius_km is None:
+        raise ValueError("A site zone needs longitude, latitude and radius_km")
+    return site_zone(longitude, latitude, radius_km)
+
+
+def zone_hash(zone):
+    """Content hash of a zone geometry, identifying it in the caches"""
+    return hashlib.sha1(zone.wkb).hexdigest()[:16]
+
+
+def cell_weights(zone, gdf_cells):
+    """Area share of the zone in each grid cell it intersects
+
+    Only the cells returned by the R-tree are intersected with the zone. Intersections below
+    MIN_CELL_SHARE of the zone are dropped.
+
+    Args:
+        zone (shapely geometry): zone in AREA_CRS
+        gdf_cells (gpd.GeoDataFrame): grid cells polygons with their 'id', see load_zone_cells
+
+    Returns:
+        pd.Series: weights summing to 1, indexed by grid cell 'id'
+    """
+    positions = gdf_cells.sindex.query(zone, predicate="intersects")
+    areas = gdf_cells.geometry.iloc[positions].intersection(zone).area.to_numpy()
+    kept = areas > MIN_CELL_SHARE * areas.sum()
+    if not kept.any():
+        raise ValueError("The zone does not intersect the ERA5 grid")
+    weights = pd.Series(areas[kept] / areas[kept].sum(), index=pd.Index(gdf_cells["id"].to_numpy()[positions[kept]], name="id"), name="weight")
+    return weights.sort_index()
+
+
+def _zone_key(arguments):
+    # The zone is identified by its hash, the other arguments as they are
+    return tuple((name, zone_hash(value) if name == "zone" else value) for name, value in arguments.items())
+
+
+@shared_data(key=_zone_key, version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def zone_weights(zone, path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Grid cell weights of a zone, see cell_weights, cached by the hash of the zone"""
+    return cell_weights(zone, load_zone_cells(path_meteo, artifacts_dir))
+
+
+@profiled
+def weighted_series(cube, weights, cells, variable):
+    """Weighted average of the grid cells of a variable for each date, over the cells with a value
+
+    Args:
+        cube (MeteoCube): daily data
+        weights (pd.Series): weights indexed by grid cell 'id', see cell_weights
+        cells (pd.DataFrame): 'latitude' and 'longitude' of the grid cells, indexed by 'id'
+
+    Returns:
+        np.ndarray: [time] averages, NaN when none of the cells has a value
+    """
+    lat_positions = np.searchsorted(cube.latitudes, cells.loc[weights.index, "latitude"].to_numpy())
+    lon_positions = np.searchsorted(cube.longitudes, cells.loc[weights.index, "longitude"].to_numpy())
+    values = cube.values[variable][:, lat_positions, lon_positions]
+    valid = ~np.isnan(values)
+    weight_values = weights.to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.where(valid, values, 0.) @ weight_values) / (valid @ weight_values)
+
+
+@shared_data(key=_zone_key, version=lambda arguments: meteo_version(arguments["path_meteo"]))
+def zone_series(zone, variables, start_date=None, end_date=None, freq="daily", path_meteo=ERA5_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Weighted averages of variables over a zone, cached by the hash of the zone and the other arguments
+
+    The daily grid of each variable is loaded once in the shared cube cache, each zone then gathers
+    the values of its cells only.
+
+    Args:
+        zone (shapely geometry): zone in AREA_CRS, see resolve_zone
+        variables (tuple): meteorological columns
+        start_date (str, optional): first date included
+        end_date (str, optional): last date included
+        freq (str): "daily" or "monthly" (monthly means of the daily averages, dated on the first day)
+
+    Returns:
+        pd.DataFrame: variables indexed by 'date'
+    """
+    if freq not in ZONE_FREQS:
+        raise ValueError(f"Unknown frequency: {freq}")
+    if not variables:
+        raise ValueError("No variable")
+    weights = zone_weights(zone, path_meteo, artifacts_dir)
+    cells = load_zone_cells(path_meteo, artifacts_dir).set_index("id")
+
+    columns = {}
+    for variable in variables:
+        cube = load_cube(path_meteo, columns=(variable,)).sel_dates(start_date, end_date)
+        columns[variable] = weighted_series(cube, weights, cells, variable)
+    df_series = pd.DataFrame(columns, index=cube.dates.rename("date"))
+    if freq == "monthly":
+        df_series = df_series.groupby(df_series.index.to_period("M").to_timestamp().rename("date")).mean()
+    return df_series